@@ -1,9 +1,9 @@
 from __future__ import annotations
+import sys
 from typing import List, Any, Optional, Dict, Union, TYPE_CHECKING
 
 import asyncpg
 
-from .models import ConfiguredCounter
 from deps import arg_lex, safe_regex
 
 if TYPE_CHECKING:
@@ -16,6 +16,8 @@ __all__ = (
     "BaseAst",
     "CounterAccess",
     "VariableAccess",
+    "BuiltinCall",
+    "VariableLookup",
     "BiOpExpr",
     "ChainedBiOpExpr",
     "Literal",
@@ -24,7 +26,7 @@ __all__ = (
     "VarSep",
 )
 
-PARSE_VARS = Optional[Dict[str, Union[str, int, bool]]]
+PARSE_VARS = Optional[Dict[str, Union[str, int, bool]]]  # a dict, LazyVariables or Scope
 
 
 class ExecutionInterrupt(Exception):
@@ -62,46 +64,19 @@ class CounterAccess(BaseAst):
         return f"<CounterAccess value={self.value} args={self.args}>"
 
     async def access(self, ctx: ParsingContext, vbls: Optional[PARSE_VARS], conn: asyncpg.Connection) -> int:
-        if self.value not in ctx.counters:
-            data = await conn.fetchrow(
-                "SELECT * FROM counters WHERE cfg_id = $1 AND name = $2", ctx._cfg_id, self.value
-            )
-            if not data:
-                raise ExecutionInterrupt(
-                    f"| {{input}}\n| {' ' * self.token.start}{'^' * (self.token.end - self.token.start)}\n| "
-                    f"Failed late to find counter '{self.value}'",
-                    self.stack,
-                )
-
-            ctx.counters[self.value] = counter = ConfiguredCounter(
-                name=data["name"],
-                per_user=data["per_user"],
-                initial_count=data["start"],
-                decay_per=data["decay_per"],
-                decay_rate=data["decay_rate"],
-                id=data["id"],
+        counter = await ctx.get_counter(self.value, conn)
+        if counter is None:
+            raise ExecutionInterrupt(
+                f"| {{input}}\n| {' ' * self.token.start}{'^' * (self.token.end - self.token.start)}\n| "
+                f"Failed late to find counter '{self.value}'",
+                ctx.stack.get(),
             )
 
-            if not counter["per_user"]:
-                c = await conn.fetchval("SELECT val FROM counter_values WHERE counter_id = $1", counter["id"])
-                if c is None:
-                    await conn.execute(
-                        "INSERT INTO counter_values VALUES ($1, $2, (NOW() AT TIME ZONE 'utc'), null)",
-                        counter["id"],
-                        counter["initial_count"],
-                    )
-                    return counter["initial_count"]
-                else:
-                    return c
-
-        else:
-            counter = ctx.counters[self.value]
-
         if counter["per_user"] and not self.args:
             raise ExecutionInterrupt(
                 f"| {{input}}\n| {' ' * self.token.start}{'^' * (self.token.end - self.token.start)}\n| "
                 f"No argument passed to per-user counter",
-                self.stack,
+                ctx.stack.get(),
             )
 
         elif counter["per_user"]:
@@ -110,21 +85,21 @@ class CounterAccess(BaseAst):
                 raise ExecutionInterrupt(
                     f"| {{input}}\n| {' ' * self.args[0].token.start}{'^' * (self.args[0].token.end - self.args[0].token.start)}\n| "
                     f"Expected a user id to access per-user counter, got {d.__class__.__name__}",
-                    self.stack,
+                    ctx.stack.get(),
                 )
 
-            return await conn.fetchval(
-                "INSERT INTO counter_values VALUES ($1, $2, (now() at time zone 'utc'), $3) ON CONFLICT (counter_id, user_id) DO UPDATE set val = counter_values.val RETURNING counter_values.val",
-                counter["id"],
-                counter["initial_count"] or 0,
-                d,
-            )
+            return await ctx.bot.counters.get(conn, ctx.guild.id, counter, d)
 
         else:
-            return await conn.fetchval("SELECT val FROM counter_values WHERE counter_id = $1", counter["id"])
+            return await ctx.bot.counters.get(conn, ctx.guild.id, counter)
 
 
 class VariableAccess(BaseAst):
+    """
+    A ``$name``, which is either a builtin call or a variable. Parsing makes one of the two subclasses right away,
+    using ``VariableAccess.make``, so that running them doesn't have to check which it is.
+    """
+
     __slots__ = ("args",)
 
     def __init__(self, t: arg_lex.Token, stack: List[str]):
@@ -133,30 +108,58 @@ class VariableAccess(BaseAst):
         self.args: List[BaseAst] = []
 
     def __repr__(self):
-        return f"<VariableAccess value={self.value} args={self.args}>"
+        return f"<{self.__class__.__name__} value={self.value} args={self.args}>"
+
+    @staticmethod
+    def make(t: arg_lex.Token, stack: List[str]) -> VariableAccess:
+        from .parse import FROZEN_BUILTINS
+
+        if t.value.lstrip("$") in FROZEN_BUILTINS:
+            return BuiltinCall(t, stack)
+
+        return VariableLookup(t, stack)
+
+
+class BuiltinCall(VariableAccess):
+    __slots__ = ("fn", "min_args")
+
+    def __init__(self, t: arg_lex.Token, stack: List[str]):
+        from .parse import BUILTINS
+
+        super().__init__(t, stack)
+        self.fn, self.min_args = BUILTINS[self.value]
+
+    async def access(self, ctx: ParsingContext, vbls: Optional[PARSE_VARS], conn: asyncpg.Connection) -> Any:
+        if self.min_args is not None and len(self.args) < self.min_args:
+            raise ExecutionInterrupt(
+                f"| {{input}}\n| {' ' * self.token.start}{'^' * (self.token.end - self.token.start)}\n| "
+                f"Built in '{self.value}' expected at least {self.min_args} arguments, got {len(self.args)}",
+                ctx.stack.get(),
+            )
+
+        return await self.fn(ctx, conn, vbls, ctx.stack.get(), self.args)
+
+
+class VariableLookup(VariableAccess):
+    __slots__ = ()
+
+    def __init__(self, t: arg_lex.Token, stack: List[str]):
+        super().__init__(t, stack)
+        self.value = sys.intern(self.value)  # the event's keys are interned, so lookups match on identity
 
     async def access(
         self, ctx: ParsingContext, vbls: Optional[PARSE_VARS], conn: asyncpg.Connection
     ) -> Union[int, str, bool]:
-        from .parse import FROZEN_BUILTINS, BUILTINS
-
-        if self.value in FROZEN_BUILTINS:  # fast lookup
-            if BUILTINS[self.value][1] is not None and len(self.args) < BUILTINS[self.value][1]:
-                print(self.args)
-                raise ExecutionInterrupt(
-                    f"| {{input}}\n| {' ' * self.token.start}{'^' * (self.token.end - self.token.start)}\n| "
-                    f"Built in '{self.value}' expected at least {BUILTINS[self.value][1]} arguments, got {len(self.args)}",
-                    self.stack,
-                )
-            return await BUILTINS[self.value][0](ctx, conn, vbls, self.stack, self.args)
-
-        if vbls and self.value in vbls:  # potentially slow lookup
-            return vbls[self.value]
+        if vbls is not None:
+            try:
+                return vbls[self.value]
+            except KeyError:
+                pass
 
         raise ExecutionInterrupt(
             f"| {{input}}\n| {' ' * self.token.start}{'^' * (self.token.end - self.token.start)}\n| "
             f"Variable '{self.value}' not found in this context",
-            self.stack,
+            ctx.stack.get(),
         )
 
 
@@ -178,14 +181,14 @@ class BiOpExpr(BaseAst):
             raise ExecutionInterrupt(
                 f"| {{input}}\n| {' '*self.token.start}{'^'*(self.token.end-self.token.start)}\n| "
                 f"Cannot compare {condl.__class__.__name__} to {condr.__class__.__name__}",
-                self.stack,
+                ctx.stack.get(),
             )
 
-        if type(condr) is not int and self.token.value in ("SEQ", "GEQ", "GQ", "SQ"):
+        if type(condr) is not int and self.token.name in ("SEQ", "GEQ", "GQ", "SQ"):
             raise ExecutionInterrupt(
                 f"| {{input}}\n| {' '*self.token.start}{'^'*(self.token.end-self.token.start)}\n| "
                 f"Cannot apply operator '{self.token.value}' to {condr.__class__.__name__}",
-                self.stack,
+                ctx.stack.get(),
             )
 
         return getattr(self, self.token.name)(condl, condr)
@@ -228,9 +231,10 @@ class ChainedBiOpExpr(BaseAst):
 
     async def access(self, ctx: ParsingContext, vbls: Optional[PARSE_VARS], conn: asyncpg.Connection) -> bool:
         condl = await self.left.access(ctx, vbls, conn)
-        condr = await self.right.access(ctx, vbls, conn)
+        if (self.token.name == "And") is not bool(condl):  # short circuit, the right side can't change the outcome
+            return condl
 
-        return self.comps[self.token.name](condl, condr)
+        return await self.right.access(ctx, vbls, conn)
 
 
 class Literal(BaseAst):
@@ -15,6 +15,11 @@ import sys
 from discord.ext import commands
 from . import time
 from .context import Context
+from .counters import CounterEngine
+from .connection import LazyConnection, PoolStats
+from .messages import MessageWriter, RecentMessages
+from .migrations import run_migrations
+from .outbound import LogSink, ReplyQueue
 from .models import *
 
 __all__ = ("Bot",)
@@ -77,6 +82,16 @@ class Bot(commands.Bot):
         self._token = self.settings["token"]
         self.error_channel = self.settings["error_channel"]
         self.db: asyncpg.pool.Pool = None  # noqa
+        self.pool_stats = PoolStats()
+        self.counters: CounterEngine = None  # noqa
+        self.message_writer: MessageWriter = None  # noqa
+        self.recent_messages = RecentMessages(self.settings.get("message_cache_budget", 1 << 20))
+        self.log_sink = LogSink(
+            linger=self.settings.get("log_linger", 1.0), max_backlog=self.settings.get("log_backlog", 200)
+        )
+        self.replies = ReplyQueue(
+            linger=self.settings.get("reply_linger", 0.1), max_backlog=self.settings.get("reply_backlog", 20)
+        )
 
         intents = discord.Intents.all()
         intents.presences = False  # noqa
@@ -102,10 +117,20 @@ class Bot(commands.Bot):
     async def setup_hook(self) -> None:
         self.session = aiohttp.ClientSession()
         self.db: asyncpg.pool.Pool = await asyncpg.create_pool(self.settings["db_uri"], min_size=1)
-        with open("schema.sql") as f:
-            schema = f.read()
-
-        await self.db.execute(schema)
+        for migration in await run_migrations(self.db):
+            print(f"Applied migration {migration}")
+
+        self.counters = CounterEngine(self.db, flush_interval=self.settings.get("counter_flush_interval", 0.5))
+        self.counters.start()
+        self.message_writer = MessageWriter(
+            self.db,
+            flush_size=self.settings.get("message_flush_size", 500),
+            flush_interval=self.settings.get("message_flush_interval", 1.0),
+            max_pending=self.settings.get("message_buffer_size", 10_000),
+            overflow=self.settings.get("message_buffer_overflow", "wait"),
+            compress_threshold=self.settings.get("message_compress_threshold", 512),
+        )
+        self.message_writer.start()
 
         await self.load_extension("jishaku")
         for ext in os.listdir("extensions"):
@@ -114,6 +139,12 @@ class Bot(commands.Bot):
 
             await self.load_extension(f"extensions.{ext[:-3]}")
 
+    def lazy_connection(self) -> LazyConnection:
+        """
+        A connection from the pool that's only acquired once something queries it, see LazyConnection.
+        """
+        return LazyConnection(self.db, self.pool_stats)
+
     async def on_ready(self):
         print(self.user)
 
@@ -140,6 +171,22 @@ class Bot(commands.Bot):
             await self.invoke(ctx)
 
     async def close(self) -> None:
+        # the cogs go first, so that no event handler writes anything after the final flushes below
+        for extension in tuple(self.extensions):
+            await self.unload_extension(extension)
+
+        for cog in tuple(self.cogs):
+            await self.remove_cog(cog)
+
+        if self.counters:
+            await self.counters.close()
+
+        if self.message_writer:
+            await self.message_writer.close()
+
+        await self.log_sink.close()
+        await self.replies.close()
+
         await self.session.close()
         return await super().close()
 
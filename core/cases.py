@@ -0,0 +1,40 @@
+from __future__ import annotations
+from typing import Optional
+
+import asyncpg
+
+__all__ = ("create_case",)
+
+# case ids are numbered per guild. the next one comes from the guild's row in case_counters, which is locked by the
+# upsert until the transaction ends, so concurrent cases can't be handed the same id.
+# a guild without a row yet (including ones that had cases before case_counters existed) starts after its highest case
+CREATE_CASE_QUERY = """
+WITH allocated AS (
+    INSERT INTO case_counters (guild_id, last_id)
+    VALUES ($1, COALESCE((SELECT MAX(id) FROM cases WHERE guild_id = $1), 0) + 1)
+    ON CONFLICT (guild_id) DO UPDATE SET last_id = case_counters.last_id + 1
+    RETURNING last_id
+)
+INSERT INTO
+    cases
+    (guild_id, id, user_id, mod_id, action, reason, link)
+SELECT
+    $1, last_id, $2, $3, $4, $5, $6
+FROM allocated
+RETURNING id
+"""
+
+
+async def create_case(
+    conn: asyncpg.Connection,
+    guild_id: int,
+    user_id: int,
+    mod_id: int,
+    action: str,
+    reason: Optional[str],
+    link: Optional[str] = None,
+) -> int:
+    """
+    Creates a new moderation case, returning its id.
+    """
+    return await conn.fetchval(CREATE_CASE_QUERY, guild_id, user_id, mod_id, action, reason, link)
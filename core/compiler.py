@@ -0,0 +1,275 @@
+from __future__ import annotations
+import operator
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypedDict, Union, TYPE_CHECKING
+
+import asyncpg
+
+from .ast import *
+
+if TYPE_CHECKING:
+    from .parse import ParsingContext
+
+__all__ = ("Program", "CompiledAction", "ActionIndex", "compile_node")
+
+Evaluator = Callable[["ParsingContext", PARSE_VARS, asyncpg.Connection], Any]
+CompiledNode = Tuple[Evaluator, bool]  # the bool is whether the evaluator returns an awaitable
+
+OPERATORS = {
+    "EQ": operator.eq,
+    "NEQ": operator.ne,
+    "SEQ": operator.le,
+    "GEQ": operator.ge,
+    "SQ": operator.lt,
+    "GQ": operator.gt,
+}
+NUMERIC_OPERATORS = {"SEQ", "GEQ", "SQ", "GQ"}
+
+
+def _pointer(token) -> str:
+    return f"| {{input}}\n| {' ' * token.start}{'^' * (token.end - token.start)}\n| "
+
+
+def compile_node(node: BaseAst) -> CompiledNode:
+    """
+    Turns a parsed node into a closure with everything that can be looked up ahead of time already bound.
+    Nodes that never touch the database or a builtin compile to plain functions; only builtin calls and counter reads
+    (and anything containing them) return awaitables.
+    """
+    if isinstance(node, (Literal, Whitespace, Re, Bool)):
+        value = node.value
+        return (lambda ctx, vbls, conn: value), False
+
+    if isinstance(node, VariableAccess):
+        return _compile_variable(node)
+
+    if isinstance(node, CounterAccess):
+        return node.access, True
+
+    if isinstance(node, BiOpExpr):
+        return _compile_biop(node)
+
+    if isinstance(node, ChainedBiOpExpr):
+        return _compile_chained(node)
+
+    return node.access, True
+
+
+def _compile_variable(node: VariableAccess) -> CompiledNode:
+    name = node.value
+    token = node.token
+
+    if isinstance(node, BuiltinCall):
+        fn, min_args = node.fn, node.min_args
+        args = node.args
+
+        if min_args is not None and len(args) < min_args:
+
+            async def builtin_arity_error(ctx, vbls, conn):
+                raise ExecutionInterrupt(
+                    f"{_pointer(token)}Built in '{name}' expected at least {min_args} arguments, got {len(args)}",
+                    ctx.stack.get(),
+                )
+
+            return builtin_arity_error, True
+
+        async def builtin(ctx, vbls, conn):
+            return await fn(ctx, conn, vbls, ctx.stack.get(), args)
+
+        return builtin, True
+
+    def variable(ctx, vbls, conn):
+        if vbls is not None:
+            try:
+                return vbls[name]  # one lookup, rather than walking the scopes for `in` and then again for []
+            except KeyError:
+                pass
+
+        raise ExecutionInterrupt(f"{_pointer(token)}Variable '{name}' not found in this context", ctx.stack.get())
+
+    return variable, False
+
+
+def _compile_biop(node: BiOpExpr) -> CompiledNode:
+    left, left_async = compile_node(node.left)
+    right, right_async = compile_node(node.right)
+    op = OPERATORS[node.token.name]
+    numeric = node.token.name in NUMERIC_OPERATORS
+    token = node.token
+
+    def compare(ctx, condl, condr):
+        if type(condl) != type(condr):
+            raise ExecutionInterrupt(
+                f"{_pointer(token)}Cannot compare {condl.__class__.__name__} to {condr.__class__.__name__}",
+                ctx.stack.get(),
+            )
+
+        if numeric and type(condr) is not int:
+            raise ExecutionInterrupt(
+                f"{_pointer(token)}Cannot apply operator '{token.value}' to {condr.__class__.__name__}",
+                ctx.stack.get(),
+            )
+
+        return op(condl, condr)
+
+    if not left_async and not right_async:
+        return (lambda ctx, vbls, conn: compare(ctx, left(ctx, vbls, conn), right(ctx, vbls, conn))), False
+
+    async def biop(ctx, vbls, conn):
+        condl = left(ctx, vbls, conn)
+        if left_async:
+            condl = await condl
+
+        condr = right(ctx, vbls, conn)
+        if right_async:
+            condr = await condr
+
+        return compare(ctx, condl, condr)
+
+    return biop, True
+
+
+def _compile_chained(node: ChainedBiOpExpr) -> CompiledNode:
+    left, left_async = compile_node(node.left)
+    right, right_async = compile_node(node.right)
+    # the right side only runs when it can change the outcome: && stops at the first falsy value, || at the first truthy
+    continue_on = node.token.name == "And"
+
+    if not left_async and not right_async:
+
+        def chained_sync(ctx, vbls, conn):
+            condl = left(ctx, vbls, conn)
+            if bool(condl) is not continue_on:
+                return condl
+
+            return right(ctx, vbls, conn)
+
+        return chained_sync, False
+
+    async def chained(ctx, vbls, conn):
+        condl = left(ctx, vbls, conn)
+        if left_async:
+            condl = await condl
+
+        if bool(condl) is not continue_on:
+            return condl
+
+        condr = right(ctx, vbls, conn)
+        if right_async:
+            condr = await condr
+
+        return condr
+
+    return chained, True
+
+
+def _find_counter_reads(node: Optional[BaseAst], out: List[Tuple[str, Optional[str]]]) -> None:
+    if isinstance(node, CounterAccess):
+        if not node.args:
+            out.append((node.value, None))
+        elif isinstance(node.args[0], VariableAccess) and not node.args[0].args:
+            out.append((node.value, node.args[0].value))
+
+    if isinstance(node, (CounterAccess, VariableAccess)):
+        for arg in node.args:
+            _find_counter_reads(arg, out)
+
+    elif isinstance(node, (BiOpExpr, ChainedBiOpExpr)):
+        _find_counter_reads(node.left, out)
+        _find_counter_reads(node.right, out)
+
+
+class Program:
+    """
+    A compiled sequence of nodes, as produced by ParsingContext.parse_input.
+    The original nodes are kept around for the static checks (and error pointers) that need them.
+    """
+
+    __slots__ = ("nodes", "parts", "is_async", "counter_reads")
+
+    def __init__(self, nodes: Sequence[BaseAst]):
+        self.nodes: Tuple[BaseAst, ...] = tuple(nodes)
+        self.parts: Tuple[CompiledNode, ...] = tuple(compile_node(x) for x in self.nodes)
+        self.is_async: bool = any(x[1] for x in self.parts)
+
+        # (counter name, the variable its target comes from) for every counter read whose target is known up front,
+        # so that a dispatch can load them all at once before running anything
+        reads = []
+        for node in self.nodes:
+            _find_counter_reads(node, reads)
+
+        self.counter_reads: Tuple[Tuple[str, Optional[str]], ...] = tuple(reads)
+
+    def __repr__(self):
+        return f"<Program nodes={self.nodes} async={self.is_async}>"
+
+    def run_sync(self, ctx: ParsingContext, vbls: PARSE_VARS, conn: asyncpg.Connection) -> List[Any]:
+        return [fn(ctx, vbls, conn) for fn, _ in self.parts]
+
+    async def run(self, ctx: ParsingContext, vbls: PARSE_VARS, conn: asyncpg.Connection) -> List[Any]:
+        if not self.is_async:
+            return self.run_sync(ctx, vbls, conn)
+
+        out = []
+        for fn, is_async in self.parts:
+            v = fn(ctx, vbls, conn)
+            if is_async:
+                v = await v
+
+            out.append(v)
+
+        return out
+
+
+class CompiledAction(TypedDict):
+    # each value is None when the action doesn't have that field, or it failed to compile (it'll be parsed at runtime)
+    condition: Optional[Program]
+    main_text: Optional[Program]
+    target: Optional[Program]
+    event: Optional[Program]
+    args: Dict[str, Optional[Program]]
+    counters: List[Tuple[str, Optional[str]]]  # every counter read or written with a known target, see Program
+    guard: Optional[Tuple[str, Union[str, int, bool]]]  # the comparison the condition starts with, see ActionIndex
+
+
+class ActionIndex:
+    """
+    The actions of an automod trigger, indexed by the ``$variable == value`` comparison their conditions start with
+    (see extractor.equality_guard). ``candidates`` gives the positions of the actions whose condition could be true
+    for an event, in order. The others would be false on their first comparison, so running them does nothing.
+
+    An action is only skipped when the event has its variable, of the same type as the value. Otherwise the condition
+    raises, and it still gets to.
+    """
+
+    __slots__ = ("actions", "unguarded", "guarded")
+
+    def __init__(self, actions: List[Dict[str, Any]]):
+        self.actions = actions
+        self.unguarded: List[int] = []
+        # variable: type of the values: value: positions of the actions comparing the variable to it
+        self.guarded: Dict[str, Dict[type, Dict[Any, List[int]]]] = {}
+
+        for i, action in enumerate(actions):
+            guard = action["compiled"]["guard"]
+            if guard is None:
+                self.unguarded.append(i)
+            else:
+                name, value = guard
+                self.guarded.setdefault(name, {}).setdefault(type(value), {}).setdefault(value, []).append(i)
+
+    def candidates(self, vbls: Optional[PARSE_VARS]) -> Sequence[int]:
+        if not self.guarded:
+            return range(len(self.actions))
+
+        out = self.unguarded.copy()
+        for name, kinds in self.guarded.items():
+            value = vbls[name] if vbls and name in vbls else None
+            for kind, values in kinds.items():
+                if value is not None and type(value) is kind:
+                    out.extend(values.get(value, ()))
+                else:
+                    for positions in values.values():
+                        out.extend(positions)
+
+        out.sort()
+        return out
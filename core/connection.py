@@ -0,0 +1,113 @@
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+__all__ = ("LazyConnection", "PoolStats")
+
+
+class PoolStats:
+    """
+    How long lazy connections waited on the pool, and how often they didn't need it at all.
+    """
+
+    __slots__ = ("acquired", "skipped", "total_wait", "max_wait")
+
+    def __init__(self):
+        self.acquired = 0
+        self.skipped = 0  # handles released without ever running a query
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "acquired": self.acquired,
+            "skipped": self.skipped,
+            "average_wait": self.acquired and self.total_wait / self.acquired,
+            "max_wait": self.max_wait,
+        }
+
+
+class _LazyTransaction:
+    __slots__ = ("lazy", "kwargs", "transaction")
+
+    def __init__(self, lazy: LazyConnection, kwargs: Dict[str, Any]):
+        self.lazy = lazy
+        self.kwargs = kwargs
+        self.transaction: Optional[asyncpg.transaction.Transaction] = None
+
+    async def __aenter__(self):
+        conn = await self.lazy.get()
+        self.transaction = conn.transaction(**self.kwargs)
+        return await self.transaction.__aenter__()
+
+    async def __aexit__(self, *exc):
+        return await self.transaction.__aexit__(*exc)
+
+
+class LazyConnection:
+    """
+    Stands in for a connection from the pool, but only acquires one when the first query is run, and releases it when
+    the ``async with`` block ends. Dispatches whose actions never touch the database then never wait on the pool.
+
+    Only the parts of asyncpg.Connection the bot uses are here.
+    """
+
+    __slots__ = ("pool", "stats", "_conn", "_lock")
+
+    def __init__(self, pool: asyncpg.Pool, stats: Optional[PoolStats] = None):
+        self.pool = pool
+        self.stats = stats
+        self._conn: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> asyncpg.Connection:
+        if self._conn is None:
+            # queries run concurrently on the same handle must not each acquire a connection
+            async with self._lock:
+                if self._conn is None:
+                    start = time.perf_counter()
+                    self._conn = await self.pool.acquire()
+                    if self.stats is not None:
+                        waited = time.perf_counter() - start
+                        self.stats.acquired += 1
+                        self.stats.total_wait += waited
+                        self.stats.max_wait = max(self.stats.max_wait, waited)
+
+        return self._conn
+
+    async def release(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await self.pool.release(conn)
+        elif self.stats is not None:
+            self.stats.skipped += 1
+
+    async def __aenter__(self) -> LazyConnection:
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.release()
+
+    def transaction(self, **kwargs) -> _LazyTransaction:
+        return _LazyTransaction(self, kwargs)
+
+    async def execute(self, query: str, *args, **kwargs):
+        return await (await self.get()).execute(query, *args, **kwargs)
+
+    async def executemany(self, query: str, args, **kwargs):
+        return await (await self.get()).executemany(query, args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        return await (await self.get()).fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await (await self.get()).fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await (await self.get()).fetchval(query, *args, **kwargs)
+
+    async def copy_records_to_table(self, table_name: str, **kwargs):
+        return await (await self.get()).copy_records_to_table(table_name, **kwargs)
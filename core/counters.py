@@ -0,0 +1,377 @@
+from __future__ import annotations
+import asyncio
+import datetime
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+from .models import ConfiguredCounter
+
+__all__ = ("CounterEngine", "CounterStore", "CounterValue", "WindowCounter")
+
+CounterKey = Tuple[int, Optional[int]]  # counter id, user id (None for counters that aren't per-user)
+
+
+class CounterValue:
+    __slots__ = ("val", "last_decay", "exists")
+
+    def __init__(self, val: int, last_decay: datetime.datetime, exists: bool):
+        self.val = val
+        self.last_decay = last_decay
+        self.exists = exists  # whether there's a row for this in counter_values yet
+
+    def __repr__(self):
+        return f"<CounterValue val={self.val} last_decay={self.last_decay} exists={self.exists}>"
+
+
+class WindowCounter:
+    """
+    Counts events over a trailing window, as a ring of ``buckets`` time slices that each cover ``window / buckets``
+    seconds. The count is kept as a running total, so reading it is O(1); slices are only cleared as time moves past
+    them.
+    """
+
+    __slots__ = ("counts", "total", "head")
+
+    def __init__(self, buckets: int, tick: int):
+        self.counts: List[int] = [0] * buckets
+        self.total = 0
+        self.head = tick  # the tick the newest slice belongs to
+
+    def __repr__(self):
+        return f"<WindowCounter total={self.total} head={self.head}>"
+
+    def advance(self, tick: int) -> None:
+        elapsed = tick - self.head
+        if elapsed <= 0:
+            return
+
+        size = len(self.counts)
+        if elapsed >= size:
+            self.counts = [0] * size
+            self.total = 0
+        else:
+            for t in range(self.head + 1, tick + 1):
+                idx = t % size
+                self.total -= self.counts[idx]
+                self.counts[idx] = 0
+
+        self.head = tick
+
+    def add(self, tick: int, amount: int) -> int:
+        self.advance(tick)
+        self.counts[tick % len(self.counts)] += amount
+        self.total += amount
+        return self.total
+
+
+class CounterStore:
+    """
+    The in-memory counter values of a single guild.
+    Window counters only ever live here; they cover seconds to minutes, so they aren't worth persisting.
+    """
+
+    __slots__ = ("values", "dirty", "windows")
+
+    def __init__(self):
+        self.values: Dict[CounterKey, CounterValue] = {}
+        self.dirty: Set[CounterKey] = set()
+        # counter id -> user id -> window, least recently touched first
+        self.windows: Dict[int, OrderedDict[Optional[int], WindowCounter]] = {}
+
+
+class CounterEngine:
+    """
+    Serves counter reads and writes from memory, and writes changed values back to counter_values in batches.
+    Changes are flushed every ``flush_interval`` seconds, which is the most that can be lost if the bot dies.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        flush_interval: float = 0.5,
+        max_entries: int = 10_000,
+        max_window_users: int = 100_000,
+    ):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries  # per guild. only clean values are evicted
+        self.max_window_users = max_window_users  # per window counter. the least recently active are evicted first
+        self.stores: Dict[int, CounterStore] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = asyncio.Event()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            # let a flush that's running finish instead of cancelling it halfway through
+            self._closing.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+
+    def store_for(self, guild_id: int) -> CounterStore:
+        store = self.stores.get(guild_id)
+        if store is None:
+            store = self.stores[guild_id] = CounterStore()
+
+        return store
+
+    def drop_guild(self, guild_id: int) -> None:
+        self.stores.pop(guild_id, None)
+
+    async def _load(
+        self, conn: asyncpg.Connection, store: CounterStore, counter: ConfiguredCounter, user_id: Optional[int]
+    ) -> CounterValue:
+        key = (counter["id"], user_id)
+        # kept as separate = and IS NULL lookups, IS NOT DISTINCT FROM can't use the (counter_id, user_id) index
+        if user_id is None:
+            row = await conn.fetchrow(
+                "SELECT val, last_decay FROM counter_values WHERE counter_id = $1 AND user_id IS NULL", counter["id"]
+            )
+        else:
+            row = await conn.fetchrow(
+                "SELECT val, last_decay FROM counter_values WHERE counter_id = $1 AND user_id = $2",
+                counter["id"],
+                user_id,
+            )
+        if row:
+            value = CounterValue(row["val"], row["last_decay"], True)
+        else:
+            value = CounterValue(counter["initial_count"] or 0, datetime.datetime.utcnow(), False)
+
+        # someone else may have loaded (and modified) it while we were waiting on the database
+        return store.values.setdefault(key, value)
+
+    async def prefetch(
+        self, conn: asyncpg.Connection, guild_id: int, keys: List[Tuple[ConfiguredCounter, Optional[int]]]
+    ) -> None:
+        """
+        Loads any of the given values that aren't in memory yet with a single query.
+        """
+        store = self.store_for(guild_id)
+        missing = {}
+        for counter, user_id in keys:
+            key = (counter["id"], user_id)
+            if key not in store.values:
+                missing[key] = counter
+
+        if not missing:
+            return
+
+        # per-user and global values are matched separately, so that both use the (counter_id, user_id) index
+        per_user = [x for x in missing if x[1] is not None]
+        rows = await conn.fetch(
+            """
+            SELECT
+                counter_values.counter_id, counter_values.user_id, val, last_decay
+            FROM counter_values
+            INNER JOIN UNNEST($1::INT[], $2::BIGINT[]) AS k(counter_id, user_id)
+                ON counter_values.counter_id = k.counter_id AND counter_values.user_id = k.user_id
+            UNION ALL
+            SELECT counter_id, user_id, val, last_decay
+            FROM counter_values
+            WHERE counter_id = ANY($3::INT[]) AND user_id IS NULL
+            """,
+            [x[0] for x in per_user],
+            [x[1] for x in per_user],
+            [x[0] for x in missing if x[1] is None],
+        )
+        found = {(x["counter_id"], x["user_id"]): x for x in rows}
+
+        now = datetime.datetime.utcnow()
+        for key, counter in missing.items():
+            row = found.get(key)
+            if row:
+                value = CounterValue(row["val"], row["last_decay"], True)
+            else:
+                value = CounterValue(counter["initial_count"] or 0, now, False)
+
+            store.values.setdefault(key, value)
+
+    @staticmethod
+    def _decay(value: CounterValue, counter: ConfiguredCounter) -> None:
+        """
+        Applies every decay tick that has passed since the value last decayed.
+        The value and last_decay move together, so a copy that hasn't been written back decays to the same number as
+        the row it came from; reading a counter never needs to mark it dirty.
+        """
+        per, rate = counter["decay_per"], counter["decay_rate"]
+        if not per or not rate:
+            return
+
+        ticks = int((datetime.datetime.utcnow() - value.last_decay).total_seconds() // per)
+        if ticks <= 0:
+            return
+
+        if value.val > 0:
+            value.val = max(value.val - rate * ticks, 0)
+
+        value.last_decay += datetime.timedelta(seconds=per * ticks)
+
+    def _window(self, store: CounterStore, counter: ConfiguredCounter, user_id: Optional[int], create: bool):
+        tick = int(time.monotonic() * counter["buckets"] // counter["window"])
+        windows = store.windows.get(counter["id"])
+        if windows is None:
+            windows = store.windows[counter["id"]] = OrderedDict()
+
+        # anyone who hasn't been counted for a whole window is back at 0, so there's no reason to keep them around.
+        # the oldest entries are at the front, so this stops at the first one that's still active
+        while windows:
+            oldest_user, oldest = next(iter(windows.items()))
+            if tick - oldest.head < counter["buckets"] and len(windows) < self.max_window_users:
+                break
+
+            del windows[oldest_user]
+
+        window = windows.get(user_id)
+        if create:
+            # only counting moves an entry to the back, which keeps the front ordered by the last time it counted
+            if window is None:
+                window = windows[user_id] = WindowCounter(counter["buckets"], tick)
+            else:
+                windows.move_to_end(user_id)
+
+        return window, tick
+
+    async def get(
+        self, conn: asyncpg.Connection, guild_id: int, counter: ConfiguredCounter, user_id: Optional[int] = None
+    ) -> int:
+        store = self.store_for(guild_id)
+        if counter["window"]:
+            window, tick = self._window(store, counter, user_id, False)
+            if window is None:
+                return 0
+
+            window.advance(tick)
+            return window.total
+
+        value = store.values.get((counter["id"], user_id))
+        if value is None:
+            value = await self._load(conn, store, counter, user_id)
+
+        self._decay(value, counter)
+        return value.val
+
+    async def modify(
+        self,
+        conn: asyncpg.Connection,
+        guild_id: int,
+        counter: ConfiguredCounter,
+        modify: int,
+        user_id: Optional[int] = None,
+    ) -> int:
+        store = self.store_for(guild_id)
+        if counter["window"]:
+            window, tick = self._window(store, counter, user_id, True)
+            return window.add(tick, modify)
+
+        key = (counter["id"], user_id)
+        value = store.values.get(key)
+        if value is None:
+            value = await self._load(conn, store, counter, user_id)
+
+        self._decay(value, counter)
+        value.val += modify
+        store.dirty.add(key)
+        return value.val
+
+    async def forget_clean(self) -> None:
+        """
+        Drops every value that has no pending changes, so that the next read comes from the database.
+        Waits for a running flush, whose values aren't marked dirty anymore but aren't written yet either.
+        """
+        async with self._flush_lock:
+            for store in self.stores.values():
+                store.values = {k: v for k, v in store.values.items() if k in store.dirty}
+
+    def _evict(self) -> None:
+        for store in self.stores.values():
+            if len(store.values) > self.max_entries:
+                evictable = [k for k in store.values if k not in store.dirty]
+                for key in evictable[: len(store.values) - self.max_entries]:
+                    del store.values[key]
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            upserts: List[tuple] = []
+            updates: List[tuple] = []
+            inserts: List[tuple] = []
+            flushed: List[Tuple[CounterStore, CounterKey]] = []
+
+            for store in self.stores.values():
+                for key in store.dirty:
+                    value = store.values[key]
+                    counter_id, user_id = key
+                    if user_id is not None:
+                        upserts.append((counter_id, value.val, value.last_decay, user_id))
+                    elif value.exists:
+                        updates.append((value.val, value.last_decay, counter_id))
+                    else:
+                        inserts.append((counter_id, value.val, value.last_decay))
+
+                    flushed.append((store, key))
+
+                store.dirty.clear()
+
+            if not flushed:
+                self._evict()  # values that are only ever read pile up too
+                return
+
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        if upserts:
+                            await conn.executemany(
+                                "INSERT INTO counter_values VALUES ($1, $2, $3, $4) ON CONFLICT (counter_id, user_id) "
+                                "DO UPDATE SET val = excluded.val, last_decay = excluded.last_decay",
+                                upserts,
+                            )
+                        if updates:
+                            await conn.executemany(
+                                "UPDATE counter_values SET val = $1, last_decay = $2 "
+                                "WHERE counter_id = $3 AND user_id IS NULL",
+                                updates,
+                            )
+                        if inserts:
+                            await conn.executemany("INSERT INTO counter_values VALUES ($1, $2, $3, null)", inserts)
+            except BaseException:
+                # put them back, the next flush will try again
+                for store, key in flushed:
+                    if key in store.values:
+                        store.dirty.add(key)
+
+                raise
+
+            for store, key in flushed:
+                value = store.values.get(key)
+                if value is not None:
+                    value.exists = True
+
+            self._evict()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._closing.wait(), timeout=self.flush_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print("Failed to flush counter values:", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Union, List, Dict, Any, Optional
+from typing import Union, List, Dict, Any, Optional, Tuple
 
 import re
 import tomli
@@ -21,9 +21,12 @@ EMOJI_FULL_RE = re.compile(r"<a?:[a-zA-Z0-9_]{2,32}:[0-9]{18,23}>|" + _emoji_re)
 del _emoji_re  # useless once it's compiled
 
 ROLE_PING_RE = re.compile(r"<@&([0-9]+)>")
-DECAY_RE = re.compile(r"(\d+)/(\d+)(m|h|d|w|mo|y)")
+DECAY_RE = re.compile(r"(\d+)/(\d+)(s|mo|m|h|d|w|y)$")
 
-DECAY_INTERVAL = {"m": 60, "h": 3600, "d": 86400, "w": 604800, "mo": 2592000, "y": 31536000}
+DURATION_RE = re.compile(r"(\d+)(s|mo|m|h|d|w|y)$")
+MAX_WINDOW_BUCKETS = 60
+
+DECAY_INTERVAL = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "mo": 2592000, "y": 31536000}
 
 
 class ConfigLoadError(Exception):
@@ -48,7 +51,19 @@ def _convert_bool(arg: Any):
         raise ValueError("bad argument given to convert_bool")
 
 
-ALLOWED_KEYS = {"error-channel", "mute-role", "group", "selfrole", "counter", "event", "logging", "automod", "command"}
+ALLOWED_KEYS = {
+    "error-channel",
+    "mute-role",
+    "group",
+    "selfrole",
+    "counter",
+    "event",
+    "logging",
+    "automod",
+    "command",
+    "reorder-conditions",
+    "message-storage",
+}
 
 
 async def parse_guild_config(cfg: str, ctx: Context) -> GuildConfig:
@@ -71,6 +86,15 @@ async def parse_guild_config(cfg: str, ctx: Context) -> GuildConfig:
     if "mute-role" in parsed:
         config.mute_role = await resolve_role(ctx, parsed["mute-role"], "mute-role")
 
+    if "reorder-conditions" in parsed:
+        try:
+            config.reorder_conditions = _convert_bool(parsed["reorder-conditions"])
+        except ValueError:
+            raise ConfigLoadError("Expected a true or false value for 'reorder-conditions'")
+
+    if "message-storage" in parsed:
+        config.message_storage = await parse_message_storage(parsed["message-storage"])
+
     if "group" in parsed:
         config.groups = await parse_guild_groups(ctx, parsed["group"])
 
@@ -100,9 +124,11 @@ async def parse_guild_config(cfg: str, ctx: Context) -> GuildConfig:
         for i, action in enumerate(event["actions"], start=1):
             await postextract_resolve_action(config, action, f"Verifying event '{event['name']}' action #{i}")
 
-    for name, event in config.automod_events.items():
-        for i, action in enumerate(event["actions"], start=1):
-            await postextract_resolve_action(config, action, f"Verifying automod event '{name}' action #{i}")
+    for name, blocks in config.automod_events.items():
+        for n, event in enumerate(blocks, start=1):
+            context = f"automod event '{name}'" if len(blocks) == 1 else f"automod event '{name}' (block #{n})"
+            for i, action in enumerate(event["actions"], start=1):
+                await postextract_resolve_action(config, action, f"Verifying {context} action #{i}")
 
     for name, event in config.commands.items():
         for i, action in enumerate(event["actions"], start=1):
@@ -220,6 +246,36 @@ async def resolve_auto_selfrole(ctx: Context, section: Dict[str, Any], context:
     return roles
 
 
+async def parse_message_storage(section: Dict[str, Any]) -> MessageStorage:
+    if not isinstance(section, dict):
+        raise ConfigLoadError("Expected 'message-storage' to be a table")
+
+    resp = MessageStorage(enabled=True, content=True, attachments=True, retention=DEFAULT_MESSAGE_RETENTION)
+    for key, value in section.items():
+        if key in ("enabled", "content", "attachments"):
+            try:
+                resp[key] = _convert_bool(value)
+            except ValueError:
+                raise ConfigLoadError(f"Expected a true or false value for 'message-storage.{key}'")
+
+        elif key == "retention":
+            retention = isinstance(value, str) and DURATION_RE.match(value)
+            if not retention:
+                raise ConfigLoadError("Invalid retention for 'message-storage'")
+
+            resp["retention"] = int(retention.group(1)) * DECAY_INTERVAL[retention.group(2)]
+            if not 0 < resp["retention"] <= MAX_MESSAGE_RETENTION:
+                raise ConfigLoadError(
+                    f"Invalid retention for 'message-storage'. "
+                    f"It must be more than 0 and at most {MAX_MESSAGE_RETENTION // 86400} days"
+                )
+
+        else:
+            raise ConfigLoadError(f"Unknown config key 'message-storage.{key}'")
+
+    return resp
+
+
 async def parse_guild_counters(section: Union[Dict[str, Any], List[Dict[str, Any]]]) -> Dict[str, ConfigCounter]:
     if isinstance(section, dict):
         section = [section]
@@ -238,6 +294,37 @@ async def parse_guild_counters(section: Union[Dict[str, Any], List[Dict[str, Any
             except ValueError:
                 raise ConfigLoadError(f"unable to parse counter '{name}'. Unable to convert initial-count to a number.")
 
+            counter_type = counter.get("type", "decay")
+            if counter_type not in ("decay", "window"):
+                raise ConfigLoadError(
+                    f"Unknown type '{counter_type}' for counter '{name}'. Expected one of 'decay' or 'window'"
+                )
+
+            window = None
+            buckets = None
+            if counter_type == "window":
+                if "decay" in counter:
+                    raise ConfigLoadError(f"Counter '{name}' is a window counter, which can't have a decay")
+
+                window = counter["window"]
+                window = isinstance(window, str) and DURATION_RE.match(window)
+                if not window:
+                    raise ConfigLoadError(f"Invalid window for counter '{name}'")
+
+                window = int(window.group(1)) * DECAY_INTERVAL[window.group(2)]
+                if not window:
+                    raise ConfigLoadError(f"Invalid window for counter '{name}'. The window can't be 0")
+
+                try:
+                    buckets = int(counter.get("buckets", 10))
+                except (TypeError, ValueError):
+                    raise ConfigLoadError(f"unable to parse counter '{name}'. Unable to convert buckets to a number.")
+
+                if not 1 <= buckets <= MAX_WINDOW_BUCKETS:
+                    raise ConfigLoadError(
+                        f"Invalid buckets for counter '{name}'. Expected a number between 1 and {MAX_WINDOW_BUCKETS}"
+                    )
+
             decay = counter.get("decay", None)
             decay_rate = None
             decay_per = None
@@ -249,9 +336,17 @@ async def parse_guild_counters(section: Union[Dict[str, Any], List[Dict[str, Any
                 decay_rate = int(decay.group(1))
                 decay_per = int(decay.group(2))
                 decay_per *= DECAY_INTERVAL[decay.group(3)]
+                if not decay_per:
+                    raise ConfigLoadError(f"Invalid decay for counter '{name}'. The decay period can't be 0")
 
             resp[name] = ConfigCounter(
-                name=name, per_user=per_user, initial_count=initial_count, decay_rate=decay_rate, decay_per=decay_per
+                name=name,
+                per_user=per_user,
+                initial_count=initial_count,
+                decay_rate=decay_rate,
+                decay_per=decay_per,
+                window=window,
+                buckets=buckets,
             )
         except KeyError as e:
             if name:
@@ -317,7 +412,9 @@ async def parse_guild_logging(ctx: Context, cfg: Union[Dict[str, Any], List[Dict
     return resp
 
 
-async def parse_guild_automod(ctx: Context, cfg: Union[Dict[str, Any], List[Dict[str, Any]]]) -> Dict[str, Automod]:
+async def parse_guild_automod(
+    ctx: Context, cfg: Union[Dict[str, Any], List[Dict[str, Any]]]
+) -> Dict[str, List[Automod]]:
     if isinstance(cfg, dict):
         cfg = [cfg]
 
@@ -327,11 +424,8 @@ async def parse_guild_automod(ctx: Context, cfg: Union[Dict[str, Any], List[Dict
         event = None
         try:
             event = str(automod["event"])
-            if event in resp:
-                raise ConfigLoadError(f"Automod trigger '{event}' is duplicated")
-
             context = f"automod '{event}' (#{i+1})"
-            parsed_ignores = {"roles": [], "channels": []}
+            parsed_ignores = {"roles": [], "channels": [], "categories": [], "emoji": [], "bots": False}
 
             ignores = automod.get("ignore")
             if ignores is not None and not isinstance(ignores, dict):
@@ -347,6 +441,20 @@ async def parse_guild_automod(ctx: Context, cfg: Union[Dict[str, Any], List[Dict
                 if "channels" in ignores and isinstance(ignores["channels"], list):
                     parsed_ignores["channels"] = [await resolve_channel(ctx, x, context) for x in ignores["channels"]]
 
+                if "categories" in ignores and isinstance(ignores["categories"], list):
+                    parsed_ignores["categories"] = [
+                        await resolve_category(ctx, x, context) for x in ignores["categories"]
+                    ]
+
+                if "emoji" in ignores and isinstance(ignores["emoji"], list):
+                    parsed_ignores["emoji"] = [str(await resolve_emoji(ctx, x, context)) for x in ignores["emoji"]]
+
+                if "bots" in ignores:
+                    try:
+                        parsed_ignores["bots"] = _convert_bool(ignores["bots"])
+                    except ValueError:
+                        raise ConfigLoadError(f"Expected a true or false value for 'bots' in the ignores of {context}")
+
             if not isinstance(automod["actions"], list):
                 raise ConfigLoadError(
                     f"Unable to parse actions for {context}. Expected an array, got "
@@ -355,7 +463,20 @@ async def parse_guild_automod(ctx: Context, cfg: Union[Dict[str, Any], List[Dict
 
             actions = [await parse_action(x, context, n) for n, x in enumerate(automod["actions"])]
 
-            resp[event] = Automod(event=event, ignore=parsed_ignores, actions=actions)
+            priority = automod.get("priority", 0)
+            if not isinstance(priority, int) or isinstance(priority, bool):
+                raise ConfigLoadError(
+                    f"Unable to parse priority for {context}. Expected a number, got {priority.__class__.__name__}"
+                )
+
+            try:
+                stop = _convert_bool(automod.get("stop", False))
+            except ValueError:
+                raise ConfigLoadError(f"Expected a true or false value for 'stop' in {context}")
+
+            resp.setdefault(event, []).append(
+                Automod(event=event, ignore=parsed_ignores, actions=actions, priority=priority, stop=stop)
+            )
 
         except KeyError as e:
             if event:
@@ -563,6 +684,27 @@ async def resolve_channel(ctx: Context, arg: Union[str, int], parse_context: str
     return channels[0].id
 
 
+async def resolve_category(ctx: Context, arg: Union[str, int], parse_context: str) -> int:
+    if isinstance(arg, int):
+        if not any(x.id == arg for x in ctx.guild.categories):
+            raise ConfigLoadError(f"The referenced category, {arg}, ({parse_context}), is invalid (not found).")
+
+        return arg
+
+    _arg = arg.lower()
+    categories = tuple(x for x in ctx.guild.categories if x.name.lower() == _arg)
+    if not categories:
+        raise ConfigLoadError(f"The referenced category, {arg}, ({parse_context}), is invalid (not found).")
+
+    if len(categories) > 1:
+        raise ConfigLoadError(
+            f"There are multiple categories named {arg}, refusing to infer the correct one. "
+            f"Maybe use a category id? ({parse_context})"
+        )
+
+    return categories[0].id
+
+
 async def resolve_batch_member(ctx: Context, args: List[Union[str, int]], parse_context: str) -> List[int]:
     ids = [x for x in args if isinstance(x, int)]
     names = [x for x in args if isinstance(x, str)]
@@ -733,7 +875,7 @@ async def static_parse(parsable: str, context: str, strict_errors=False) -> List
 
     def _var(token):
         nonlocal depth, last
-        _last = VariableAccess(token, stack)
+        _last = VariableAccess.make(token, stack)
         if depth:
             if last is not VarSep:
                 no_var_sep(token)
@@ -892,6 +1034,9 @@ async def postextract_resolve_action(cfg: GuildConfig, action: Actions, context:
         tokens = arg_lex.run_lex(action["condition"])
         resolve_data(tokens, action["condition"], cfg, context)
 
+        if cfg.reorder_conditions:
+            action["condition"] = reorder_condition(action["condition"], tokens)
+
     if "log" in action:
         if action["log"] not in cfg.loggers:
             raise ConfigLoadError(f"{context}\n| Could not find logger '{action['log']}'")
@@ -920,3 +1065,137 @@ def resolve_data(data: List[arg_lex.Token], raw_line: str, cfg: GuildConfig, con
 
         elif x.name == "Var":
             ...  # TODO somehow parse variables?
+
+
+# builtins that only compute a value. Anything else (sending messages, moderation, assigning variables) has to keep its
+# place in a condition, as moving it around would change what the condition does.
+PURE_BUILTINS = {"match", "replace", "now", "pick", "coalesce", "ismessagecontext", "casecount", "usercases"}
+
+
+def _operand_cost(tokens: List[arg_lex.Token]) -> Optional[int]:
+    from .parse import FROZEN_BUILTINS
+
+    cost = 0
+    for x in tokens:
+        if x.name == "Counter":
+            cost = max(cost, 2)  # counters are backed by the database
+
+        elif x.name == "Var" and x.value.lstrip("$") in FROZEN_BUILTINS:
+            if x.value.lstrip("$") not in PURE_BUILTINS:
+                return None
+
+            cost = max(cost, 1)
+
+    return cost
+
+
+def reorder_condition(condition: str, tokens: List[arg_lex.Token]) -> str:
+    """
+    Reorders the operands of chained && / || comparisons so that the cheap ones (plain variables and literals) run
+    before builtins and counter reads, letting short-circuiting skip the expensive ones.
+    Operands with side effects (returns None from _operand_cost) are never moved, and nothing is moved across them.
+    """
+    operands: List[str] = []
+    costs: List[Optional[int]] = []
+    ops: List[str] = []
+
+    depth = start = 0
+    current: List[arg_lex.Token] = []
+    for x in tokens:
+        if x.name == "PIn":
+            depth += 1
+        elif x.name == "POut":
+            depth -= 1
+        elif x.name in ("And", "Or") and not depth:
+            operands.append(condition[start : x.start].strip())
+            costs.append(_operand_cost(current))
+            ops.append(x.value)
+            start = x.end
+            current = []
+            continue
+
+        current.append(x)
+
+    operands.append(condition[start:].strip())
+    costs.append(_operand_cost(current))
+
+    if not ops:
+        return condition
+
+    # evaluation is left to right, so the operands within a run of the same operator can be shuffled around freely.
+    # the first run includes the very first operand, later runs have to leave everything before them in place
+    order = list(range(len(operands)))
+    i = 0
+    while i < len(ops):
+        j = i
+        while j + 1 < len(ops) and ops[j + 1] == ops[i]:
+            j += 1
+
+        run = list(range(0 if i == 0 else i + 1, j + 2))
+        chunk: List[int] = []
+        for n in run + [None]:
+            if n is None or costs[n] is None:
+                for pos, idx in zip(chunk, sorted(chunk, key=lambda k: costs[k])):
+                    order[pos] = idx
+
+                chunk = []
+            else:
+                chunk.append(n)
+
+        i = j + 1
+
+    if order == list(range(len(operands))):
+        return condition
+
+    out = operands[order[0]]
+    for op, idx in zip(ops, order[1:]):
+        out += f" {op} {operands[idx]}"
+
+    return out
+
+
+def equality_guard(condition: str, tokens: List[arg_lex.Token]) -> Optional[Tuple[str, Union[str, int, bool]]]:
+    """
+    Finds the ``$variable == value`` comparison a condition starts with, if the condition is that comparison alone or
+    that comparison joined to the rest with &&. When the variable is set to something else of the same type, the
+    condition is false before anything else in it runs, so automod can skip the action without evaluating it
+    (see compiler.ActionIndex). Returns (variable name, value), or None if there's no such comparison.
+    """
+    from .parse import FROZEN_BUILTINS
+
+    operands: List[List[arg_lex.Token]] = [[]]
+    depth = 0
+    for x in tokens:
+        if x.name == "PIn":
+            depth += 1
+        elif x.name == "POut":
+            depth -= 1
+        elif x.name == "Or" and not depth:
+            return None  # with a || at the top level, the first comparison being false doesn't decide anything
+        elif x.name == "And" and not depth:
+            operands.append([])
+            continue
+
+        if x.name != "Whitespace":
+            operands[-1].append(x)
+
+    operand = operands[0]
+    if len(operand) != 3 or operand[1].name != "EQ":
+        return None
+
+    var, value = operand[0], operand[2]
+    if var.name != "Var":
+        var, value = value, var
+
+    if var.name != "Var" or value.name not in ("Literal", "Bool") or var.value.lstrip("$") in FROZEN_BUILTINS:
+        return None
+
+    # the same conversions ast.Literal and ast.Bool do
+    if value.name == "Bool":
+        return var.value.lstrip("$"), value.value.lower() == "true"
+
+    text = value.value.lstrip("\\").strip("'")
+    try:
+        return var.value.lstrip("$"), int(text)
+    except ValueError:
+        return var.value.lstrip("$"), text
@@ -0,0 +1,443 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import sys
+import traceback
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = (
+    "MessageWriter",
+    "RecentMessages",
+    "MESSAGE_COLUMNS",
+    "encode_content",
+    "decode_content",
+    "delete_stored",
+    "update_stored",
+)
+
+# the order messages are held in memory. in the database, content lives in message_contents (see encode_content)
+MESSAGE_COLUMNS = ("guild_id", "message_id", "author_id", "channel_id", "content", "image_urls")
+STORED_COLUMNS = ("guild_id", "message_id", "author_id", "channel_id", "content_hash", "image_urls")
+MessageKey = Tuple[int, int]  # guild id, message id
+
+# roughly what a cached record costs besides its text: the list, its ints, and its slot in the guild's OrderedDict
+RECORD_OVERHEAD = 320
+
+CONTENTS_QUERY = """
+INSERT INTO message_contents (guild_id, hash, compressed, data)
+SELECT * FROM UNNEST($1::BIGINT[], $2::BYTEA[], $3::BOOL[], $4::BYTEA[])
+ON CONFLICT (guild_id, hash) DO UPDATE SET last_seen = EXCLUDED.last_seen
+"""
+# for writing a batch row by row, once it failed as a whole
+INSERT_QUERY = """
+INSERT INTO messages (guild_id, message_id, author_id, channel_id, content_hash, image_urls)
+VALUES ($1, $2, $3, $4, $5, $6)
+ON CONFLICT DO NOTHING
+"""
+UPDATE_QUERY = "UPDATE messages SET content = NULL, content_hash = $3 WHERE guild_id = $1 AND message_id = $2"
+DELETE_QUERY = """
+DELETE FROM messages WHERE (guild_id, message_id) IN (SELECT * FROM UNNEST($1::BIGINT[], $2::BIGINT[]))
+"""
+
+DELETE_STORED_QUERY = """
+WITH deleted AS (
+    DELETE FROM messages WHERE guild_id = $1 AND message_id = ANY($2) RETURNING *
+)
+SELECT
+    deleted.*, c.compressed, c.data
+FROM deleted
+LEFT JOIN message_contents c ON c.guild_id = deleted.guild_id AND c.hash = deleted.content_hash
+"""
+
+# the self join sees the row as it was before the update, so this returns the old content
+UPDATE_STORED_QUERY = """
+WITH stored AS (
+    INSERT INTO message_contents (guild_id, hash, compressed, data)
+    SELECT $1, $3, $4, $5 WHERE $3::BYTEA IS NOT NULL
+    ON CONFLICT (guild_id, hash) DO UPDATE SET last_seen = EXCLUDED.last_seen
+)
+UPDATE messages SET content = NULL, content_hash = $3
+FROM messages old
+LEFT JOIN message_contents c ON c.guild_id = old.guild_id AND c.hash = old.content_hash
+WHERE messages.guild_id = $1 AND messages.message_id = $2 AND old.guild_id = $1 AND old.message_id = $2
+RETURNING
+    messages.guild_id, messages.message_id, messages.author_id, messages.channel_id, old.content,
+    messages.image_urls, c.compressed, c.data
+"""
+
+_compressor = zstandard and zstandard.ZstdCompressor(level=3)
+_decompressor = zstandard and zstandard.ZstdDecompressor()
+
+
+def encode_content(content: str, compress_threshold: Optional[int] = None) -> Tuple[bytes, bool, bytes]:
+    """
+    Returns the hash, whether it's compressed, and the data to store in message_contents for a message's content.
+    Content of at least ``compress_threshold`` bytes is compressed with zstd, if zstandard is installed and it helps.
+    """
+    data = content.encode()
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    if _compressor and compress_threshold is not None and len(data) >= compress_threshold:
+        compressed = _compressor.compress(data)
+        if len(compressed) < len(data):
+            return digest, True, compressed
+
+    return digest, False, data
+
+
+def decode_content(row: asyncpg.Record) -> str:
+    """
+    Returns the content of a messages row joined with its message_contents row (``compressed`` and ``data``).
+    """
+    if row["data"] is None:
+        return row["content"] or ""  # written before message_contents, or stored without content
+
+    if row["compressed"]:
+        if _decompressor is None:
+            raise RuntimeError("Found compressed message content, but zstandard is not installed")
+
+        return _decompressor.decompress(row["data"]).decode()
+
+    return bytes(row["data"]).decode()
+
+
+def _as_message(row: asyncpg.Record) -> Dict[str, Any]:
+    return {**{x: row[x] for x in MESSAGE_COLUMNS}, "content": decode_content(row)}
+
+
+async def delete_stored(conn: asyncpg.Connection, guild_id: int, message_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Deletes stored messages from the database, returning the ones that were there.
+    """
+    return [_as_message(x) for x in await conn.fetch(DELETE_STORED_QUERY, guild_id, message_ids)]
+
+
+async def update_stored(
+    conn: asyncpg.Connection, guild_id: int, message_id: int, content: str, compress_threshold: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Changes the content of a stored message in the database, returning the message as it was before.
+    Returns None if it isn't there.
+    """
+    digest, compressed, data = encode_content(content, compress_threshold) if content else (None, None, None)
+    row = await conn.fetchrow(UPDATE_STORED_QUERY, guild_id, message_id, digest, compressed, data)
+    return row and _as_message(row)
+
+
+class MessageWriter:
+    """
+    Buffers stored messages and writes them to the messages table with COPY, once ``flush_size`` of them are waiting
+    or every ``flush_interval`` seconds, whichever comes first.
+
+    Content is written to message_contents once per guild, and compressed past ``compress_threshold`` bytes (see
+    encode_content).
+
+    At most ``max_pending`` messages are held. Past that, ``overflow`` decides what happens: ``"wait"`` makes the
+    caller wait for the next flush, ``"drop"`` drops the message (it just won't show up in delete/edit events).
+    Messages that haven't been written yet can be read and changed through pop/get/update, so the delete and edit
+    handlers don't miss anything that's still in the buffer. Edits and deletes of messages that were already written
+    are sent with the next flush.
+
+    A batch that fails to write is tried again with the next flush, ``max_retries`` times. After that its messages are
+    written one at a time, skipping the ones that are already stored and dropping the ones that still fail, and if even
+    that doesn't go through the batch is dropped, so that one bad row can't hold up everything behind it.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 10_000,
+        overflow: str = "wait",
+        compress_threshold: Optional[int] = 512,
+        max_retries: int = 3,
+    ):
+        if overflow not in ("wait", "drop"):
+            raise ValueError(f"Unknown overflow policy '{overflow}'")
+
+        self.pool = pool
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.compress_threshold = compress_threshold
+        self.max_retries = max_retries
+
+        self.pending: Dict[MessageKey, List[Any]] = {}
+        self.in_flight: Dict[MessageKey, List[Any]] = {}
+        self.updates: Dict[MessageKey, str] = {}
+        self.deletes: Set[MessageKey] = set()
+        self.dropped = 0
+        self.failed = 0  # messages, edits and deletes given up on after max_retries
+        self.retries = 0  # failed flushes in a row
+
+        self._wakeup = asyncio.Event()
+        self._flushed: Optional[asyncio.Future] = None
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            # let a flush that's running finish instead of cancelling it halfway through
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+
+    async def add(self, record: List[Any]) -> None:
+        """
+        Queues a message, given as a list in the order of MESSAGE_COLUMNS.
+        """
+        while len(self.pending) >= self.max_pending:
+            if self.overflow == "drop":
+                self.dropped += 1
+                return
+
+            self._wakeup.set()
+            await self._wait_for_flush()
+
+        self.pending[(record[0], record[1])] = record
+        if len(self.pending) >= self.flush_size:
+            self._wakeup.set()
+
+    def _as_row(self, record: List[Any]) -> Dict[str, Any]:
+        return dict(zip(MESSAGE_COLUMNS, record))
+
+    async def _wait_for_flush(self) -> None:
+        if self._flushed is None:
+            self._flushed = asyncio.get_running_loop().create_future()
+
+        await asyncio.shield(self._flushed)
+
+    async def pop(self, guild_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Removes a message that hasn't been written yet, so that it never is. Returns None if the message isn't in the
+        buffer, in which case it's in the database (if it was stored at all).
+        """
+        key = (guild_id, message_id)
+        if key in self.in_flight:
+            await self._wait_for_flush()
+
+        record = self.pending.pop(key, None)
+        return record and self._as_row(record)
+
+    async def get(self, guild_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        key = (guild_id, message_id)
+        if key in self.in_flight:
+            await self._wait_for_flush()
+
+        record = self.pending.get(key)
+        return record and self._as_row(record)
+
+    def update(self, guild_id: int, message_id: int, content: str) -> None:
+        """
+        Changes the content of a stored message. If it hasn't been written yet the buffered copy is changed, otherwise
+        the row is updated with the next flush.
+        """
+        key = (guild_id, message_id)
+        record = self.pending.get(key)
+        if record is not None:
+            record[4] = content
+        else:
+            self.updates[key] = content
+
+    def discard(self, guild_id: int, message_id: int) -> None:
+        """
+        Deletes a stored message without reading it back. If it hasn't been written yet it never is, otherwise the row
+        is deleted with the next flush.
+        """
+        key = (guild_id, message_id)
+        if self.pending.pop(key, None) is None:
+            self.updates.pop(key, None)
+            self.deletes.add(key)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self.pending and not self.updates and not self.deletes:
+                return
+
+            self.in_flight, self.pending = self.pending, {}
+            updates, self.updates = self.updates, {}
+            deletes, self.deletes = self.deletes, set()
+            if self._flushed is None:
+                self._flushed = asyncio.get_running_loop().create_future()
+
+            contents: Dict[Tuple[int, bytes], Tuple[bool, bytes]] = {}  # (guild id, hash): (compressed, data)
+
+            def store(guild_id: int, content: str) -> Optional[bytes]:
+                if not content:
+                    return None
+
+                digest, compressed, data = encode_content(content, self.compress_threshold)
+                contents[(guild_id, digest)] = compressed, data
+                return digest
+
+            try:
+                records = [(*x[:4], store(x[0], x[4]), x[5]) for x in self.in_flight.values()]
+                edited = [(*key, store(key[0], content)) for key, content in updates.items()]
+
+                async with self.pool.acquire() as conn, conn.transaction():
+                    if contents:
+                        guild_ids, hashes = zip(*contents.keys())
+                        compressed, data = zip(*contents.values())
+                        await conn.execute(CONTENTS_QUERY, list(guild_ids), list(hashes), list(compressed), list(data))
+
+                    if records and self.retries < self.max_retries:
+                        await conn.copy_records_to_table("messages", records=records, columns=STORED_COLUMNS)
+                    elif records:
+                        for record in records:
+                            try:
+                                async with conn.transaction():  # a savepoint, so one row failing doesn't end the rest
+                                    await conn.execute(INSERT_QUERY, *record)
+                            except asyncpg.PostgresError:
+                                self.failed += 1
+
+                    if edited:
+                        await conn.executemany(UPDATE_QUERY, edited)
+
+                    if deletes:
+                        guild_ids, message_ids = zip(*deletes)
+                        await conn.execute(DELETE_QUERY, list(guild_ids), list(message_ids))
+            except BaseException as e:
+                if isinstance(e, Exception):
+                    self.retries += 1
+
+                if self.retries > self.max_retries:
+                    self.failed += len(self.in_flight) + len(updates) + len(deletes)
+                    self.retries = 0
+                else:
+                    # put them back in front of anything that came in meanwhile, the next flush will try again.
+                    # if that pushes the buffer over its limit, the new ones wait in add() until it's back under
+                    self.pending = {**self.in_flight, **self.pending}
+                    self.updates = {**updates, **self.updates}
+                    self.deletes |= deletes
+
+                raise
+            else:
+                self.retries = 0
+            finally:
+                self.in_flight = {}
+                flushed, self._flushed = self._flushed, None
+                flushed.set_result(None)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            if self._closing:
+                return
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print("Failed to write stored messages:", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+
+
+class RecentMessages:
+    """
+    Keeps the most recently stored messages of each guild in memory, so that the delete and edit handlers can usually
+    find a message without asking the database. Each guild gets ``guild_budget`` bytes (an estimate of what the
+    records take up), past which its least recently used messages are evicted. Evicted messages are still stored, they
+    just have to be looked up in the database.
+    """
+
+    def __init__(self, guild_budget: int = 1 << 20):
+        self.guild_budget = guild_budget
+        self.guilds: Dict[int, OrderedDict[int, List[Any]]] = {}
+        self.sizes: Dict[int, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(record: List[Any]) -> int:
+        size = RECORD_OVERHEAD + sys.getsizeof(record[4])
+        if record[5]:
+            size += sum(sys.getsizeof(x) for x in record[5])
+
+        return size
+
+    def put(self, record: List[Any]) -> None:
+        """
+        Caches a message, given as a list in the order of MESSAGE_COLUMNS.
+        """
+        guild_id = record[0]
+        cache = self.guilds.setdefault(guild_id, OrderedDict())
+        old = cache.pop(record[1], None)
+        size = self.sizes.get(guild_id, 0) + self._size(record) - (old and self._size(old) or 0)
+
+        cache[record[1]] = list(record)  # a copy, the writer changes its own
+        while size > self.guild_budget and cache:
+            _, evicted = cache.popitem(last=False)
+            size -= self._size(evicted)
+            self.evictions += 1
+
+        self.sizes[guild_id] = size
+
+    def _lookup(self, guild_id: int, message_id: int, remove: bool) -> Optional[List[Any]]:
+        cache = self.guilds.get(guild_id, {})
+        record = cache.pop(message_id, None) if remove else cache.get(message_id)
+        if record is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if remove:
+            self.sizes[guild_id] -= self._size(record)
+        else:
+            cache.move_to_end(message_id)
+
+        return record
+
+    def get(self, guild_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        record = self._lookup(guild_id, message_id, False)
+        return record and dict(zip(MESSAGE_COLUMNS, record))
+
+    def pop(self, guild_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        record = self._lookup(guild_id, message_id, True)
+        return record and dict(zip(MESSAGE_COLUMNS, record))
+
+    def update(self, guild_id: int, message_id: int, content: str) -> None:
+        record = self.guilds.get(guild_id, {}).get(message_id)
+        if record is not None:
+            self.put([*record[:4], content, record[5]])
+
+    def drop_guild(self, guild_id: int) -> None:
+        self.guilds.pop(guild_id, None)
+        self.sizes.pop(guild_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "guilds": len(self.guilds),
+            "messages": sum(len(x) for x in self.guilds.values()),
+            "bytes": sum(self.sizes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": lookups and self.hits / lookups,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,68 @@
+from __future__ import annotations
+import os
+import re
+from typing import List, Tuple
+
+import asyncpg
+
+__all__ = ("run_migrations",)
+
+MIGRATION_RE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+LOCK_ID = 0x626F62  # "bob", so that two instances starting at once don't both migrate
+
+SCHEMA_VERSION = """
+CREATE TABLE IF NOT EXISTS schema_version
+(
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc')
+)
+"""
+
+
+def find_migrations(directory: str) -> List[Tuple[int, str, str]]:
+    """
+    Returns the (version, name, path) of every migration in the directory, oldest first.
+    """
+    found = []
+    for fn in os.listdir(directory):
+        match = MIGRATION_RE.match(fn)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(directory, fn)))
+
+    found.sort()
+    versions = [x[0] for x in found]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Found more than one migration with the same number in {directory}")
+
+    return found
+
+
+async def run_migrations(pool: asyncpg.Pool, directory: str = "migrations") -> List[str]:
+    """
+    Applies every migration in the directory that isn't recorded in schema_version yet, each in its own transaction.
+    Returns the names of the ones that were applied.
+    """
+    applied = []
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", LOCK_ID)
+        try:
+            await conn.execute(SCHEMA_VERSION)
+            done = {x["version"] for x in await conn.fetch("SELECT version FROM schema_version")}
+
+            for version, name, path in find_migrations(directory):
+                if version in done:
+                    continue
+
+                with open(path) as f:
+                    query = f.read()
+
+                async with conn.transaction():
+                    await conn.execute(query)
+                    await conn.execute("INSERT INTO schema_version (version, name) VALUES ($1, $2)", version, name)
+
+                applied.append(f"{version:04}_{name}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_ID)
+
+    return applied
@@ -22,10 +22,17 @@ __all__ = (
     "Automod",
     "AutomodIgnore",
     "GuildConfig",
+    "MessageStorage",
+    "DEFAULT_MESSAGE_RETENTION",
+    "MAX_MESSAGE_RETENTION",
     "ReplyAction",
 )
 
 
+DEFAULT_MESSAGE_RETENTION = 7 * 86400
+MAX_MESSAGE_RETENTION = 30 * 86400
+
+
 class ActionTypes:
     counter = 1
     dispatch = 2
@@ -122,6 +129,8 @@ class ConfigCounter(TypedDict):
     initial_count: int
     decay_rate: Optional[int]
     decay_per: Optional[int]
+    window: Optional[int]  # in seconds. set for window counters, which count events instead of holding a value
+    buckets: Optional[int]
 
 
 class ConfiguredCounter(ConfigCounter):
@@ -170,12 +179,24 @@ class Command(TypedDict):
 class AutomodIgnore(TypedDict):
     roles: Optional[List[int]]
     channels: Optional[List[int]]
+    categories: List[int]
+    emoji: List[str]  # unicode emoji, or custom emoji ids
+    bots: bool
 
 
 class Automod(TypedDict):
     event: str
     ignore: AutomodIgnore
     actions: List[Actions]
+    priority: int  # blocks for the same event run lowest first
+    stop: bool  # whether the blocks after this one are skipped when any of its actions ran
+
+
+class MessageStorage(TypedDict):
+    enabled: bool  # messages are only stored when this is set *and* there's a message_delete or message_edit trigger
+    content: bool
+    attachments: bool
+    retention: int  # in seconds
 
 
 class GuildConfig:
@@ -188,9 +209,13 @@ class GuildConfig:
         self.selfroles: List[SelfRole] = []
         self.counters: Dict[str, ConfigCounter] = {}
         self.events: List[ConfigEvent] = []
-        self.automod_events: Dict[str, Automod] = {}
+        self.automod_events: Dict[str, List[Automod]] = {}  # event: every block for it, in config order
         self.loggers: Dict[str, Logger] = {}
         self.commands: Dict[str, Command] = {}
+        self.reorder_conditions: bool = False
+        self.message_storage: MessageStorage = MessageStorage(
+            enabled=True, content=True, attachments=True, retention=DEFAULT_MESSAGE_RETENTION
+        )
 
 
 class SparseGuildConfig:
@@ -0,0 +1,195 @@
+from __future__ import annotations
+import asyncio
+import collections
+import itertools
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import discord
+
+from .utils import chunk_lines
+
+__all__ = ("ChannelQueue", "LogSink", "ReplyQueue")
+
+
+class ChannelQueue:
+    """
+    Base for sending things to channels from the background, so that whatever produces them never waits on discord.
+    Items for a channel are collected for ``linger`` seconds and then handed to ``_send`` together, from a task per
+    channel that only lives while the channel has something to send. While that task waits on a send (or a rate
+    limit), new items pile up and go out together with the next round.
+
+    At most ``max_backlog`` droppable items wait per channel, anything past that is dropped.
+    """
+
+    def __init__(self, linger: float, max_backlog: int):
+        self.linger = linger
+        self.max_backlog = max_backlog
+
+        self.queues: Dict[int, Deque[Any]] = {}
+        self.dropped: Dict[int, int] = {}  # channel id: items dropped since the last send
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+        self.sent = 0
+        self.messages_sent = 0
+        self.shed = 0
+        self.failures = 0
+
+    def _put(self, channel: discord.abc.Messageable, item: Any, droppable: bool = True) -> bool:
+        """
+        Queues an item for a channel, returning False if it was dropped instead.
+        """
+        queue = self.queues.setdefault(channel.id, collections.deque())
+        if droppable and len(queue) >= self.max_backlog:
+            self.dropped[channel.id] = self.dropped.get(channel.id, 0) + 1
+            self.shed += 1
+            queued = False
+        else:
+            queue.append(item)
+            queued = True
+
+        if channel.id not in self._tasks:
+            self._tasks[channel.id] = asyncio.create_task(self._drain(channel))
+
+        return queued
+
+    async def _drain(self, channel: discord.abc.Messageable) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.linger)
+                queue = self.queues.get(channel.id)
+                dropped = self.dropped.pop(channel.id, 0)
+                if not queue and not dropped:
+                    return
+
+                items = list(queue)
+                queue.clear()
+                self.sent += len(items)
+                await self._send(channel, items, dropped)
+        finally:
+            del self._tasks[channel.id]
+            if not self.queues.get(channel.id):
+                self.queues.pop(channel.id, None)
+                self._forget(channel)
+
+    async def _send(self, channel: discord.abc.Messageable, items: List[Any], dropped: int) -> None:
+        raise NotImplementedError
+
+    def _forget(self, channel: discord.abc.Messageable) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "channels": len(self._tasks),
+            "backlog": sum(len(x) for x in self.queues.values()),
+            "sent": self.sent,
+            "messages_sent": self.messages_sent,
+            "shed": self.shed,
+            "failures": self.failures,
+        }
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """
+        Gives whatever is queued a chance to be sent, then stops.
+        """
+        if not self._tasks:
+            return
+
+        tasks = list(self._tasks.values())
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+
+class LogSink(ChannelQueue):
+    """
+    Sends log lines for the loggers, as few messages as they fit in. Lines dropped because a channel's backlog was
+    full are counted in the next message.
+    """
+
+    def __init__(self, linger: float = 1.0, max_backlog: int = 200):
+        super().__init__(linger, max_backlog)
+        # channel id: (logger name, where to report a failed send), from the most recent line
+        self.sources: Dict[int, Tuple[str, Optional[discord.abc.Messageable]]] = {}
+
+    def send(
+        self,
+        channel: discord.abc.Messageable,
+        line: str,
+        name: str,
+        errors_to: Optional[discord.abc.Messageable] = None,
+    ) -> None:
+        """
+        Queues a line for a channel. ``name`` is the logger the line is from, and ``errors_to`` is where to say so if
+        the line can't be sent.
+        """
+        self.sources[channel.id] = name, errors_to
+        self._put(channel, line)
+
+    async def _send(self, channel: discord.abc.Messageable, items: List[str], dropped: int) -> None:
+        if dropped:
+            items.append(f"... {dropped} more log lines were dropped, too many were sent at once")
+
+        for chunk in chunk_lines(items):
+            try:
+                await channel.send(chunk)
+            except discord.HTTPException as e:
+                self.failures += 1
+                await self._report(channel, e)
+                return
+
+            self.messages_sent += 1
+
+    def _forget(self, channel: discord.abc.Messageable) -> None:
+        self.sources.pop(channel.id, None)
+
+    async def _report(self, channel: discord.abc.Messageable, error: discord.HTTPException) -> None:
+        name, errors_to = self.sources.get(channel.id, (None, None))
+        if errors_to is None or errors_to == channel:
+            return
+
+        try:
+            await errors_to.send(f"Failed to send message to logger '{name}': {error}")
+        except discord.HTTPException:
+            pass
+
+
+class ReplyQueue(ChannelQueue):
+    """
+    Sends the responses of reply actions. Replies bound for the same channel (and replying to the same message) are
+    joined into as few messages as they fit in.
+
+    Replies that are ``sheddable`` (the ones automod triggers send) are dropped once ``max_backlog`` of them are
+    waiting for a channel, since during a raid nobody reads the hundredth copy of a warning anyway. Command replies are
+    never dropped.
+    """
+
+    def __init__(self, linger: float = 0.1, max_backlog: int = 20):
+        super().__init__(linger, max_backlog)
+
+    def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: str,
+        reference: Optional[discord.Message] = None,
+        sheddable: bool = False,
+    ) -> bool:
+        """
+        Queues a reply, returning False if it was dropped instead.
+        """
+        return self._put(channel, (content, reference), droppable=sheddable)
+
+    async def _send(
+        self, channel: discord.abc.Messageable, items: List[Tuple[str, Optional[discord.Message]]], dropped: int
+    ) -> None:
+        for reference, group in itertools.groupby(items, key=lambda x: x[1]):
+            for chunk in chunk_lines([x[0] for x in group]):
+                try:
+                    await channel.send(chunk, reference=reference)
+                except discord.Forbidden:
+                    self.failures += 1
+                    return  # nothing else is getting through either
+                except discord.HTTPException:
+                    self.failures += 1
+                    continue
+
+                self.messages_sent += 1
@@ -1,7 +1,8 @@
 from __future__ import annotations
 import itertools
+import contextlib
 import contextvars
-from typing import Optional, List, Union, TYPE_CHECKING, Dict, Any
+from typing import Optional, List, Tuple, Union, TYPE_CHECKING, Dict, Any
 
 import datetime
 import re
@@ -20,6 +21,12 @@ from .bot import Bot
 from .context import Context
 from .time import ShortTime, human_timedelta, UserFriendlyTime
 from .ast import *
+from .compiler import *
+from .writes import WriteBuffer
+from .cases import create_case
+from .extractor import equality_guard
+from .prefilter import AutomodTrigger
+from .utils import LazyVariables, Scope
 
 if TYPE_CHECKING:
     from extensions.commands import Command as DispatcherCommand
@@ -35,16 +42,20 @@ class ParsingContext:
         self.mute_role: Optional[int] = None
         self.events = {}
         self.loggers = {}
-        self.counters = {}  # lazy filled, don't assume the counter is in this
+        self.counters: Dict[str, ConfiguredCounter] = {}  # filled on fetch, get_counter picks up stragglers
         self.commands = {}
         self.automod = {}
         self.actions = {}
+        self.action_indexes: Dict[tuple, ActionIndex] = {}  # automod action ids: their index
         self._fetched = False
 
         self.session: aiohttp.ClientSession | None = None
 
         self.message = contextvars.ContextVar("message", default=None)
         self.callerid = contextvars.ContextVar("callerid", default=None)
+        # compiled trees are shared between runs, so they pull the stack for their errors from here instead
+        self.stack = contextvars.ContextVar("stack", default=None)
+        self.writes: contextvars.ContextVar[Optional[WriteBuffer]] = contextvars.ContextVar("writes", default=None)
 
     async def ensure_session(self):
         if not self.session:
@@ -110,6 +121,9 @@ class ParsingContext:
             """
             cmds = await conn.fetch(query, cfg_id)
 
+            for counter in await conn.fetch("SELECT * FROM counters WHERE cfg_id = $1", cfg_id):
+                self._load_counter(counter)
+
             self.commands = _cmds = {}
             actions = []
             for cmdname, rows in itertools.groupby(cmds, key=lambda c: c["cmd_name"]):
@@ -147,6 +161,11 @@ class ParsingContext:
                     "id": x["id"],
                 }
 
+        for logger in logs.values():
+            logger["compiled"] = {
+                k: await self._try_compile(v, [f"logger format '{k}'"], False) for k, v in logger["formats"].items()
+            }
+
         self._fetched = True
 
     async def link(self, actions: List[int], conn: asyncpg.Connection):
@@ -159,8 +178,91 @@ class ParsingContext:
         data = await conn.fetch(query, actions)
 
         for x in data:
-            self.actions[x["id"]] = dict(x)
-            self.actions[x["id"]]["args"] = x["args"] and ujson.loads(x["args"])
+            action = self.actions[x["id"]] = dict(x)
+            action["args"] = x["args"] and ujson.loads(x["args"])
+            action["compiled"] = await self.compile_action(action)
+
+    async def compile_action(self, action: AnyAction) -> CompiledAction:
+        """
+        Parses the static strings of an action once, so that running it doesn't need to lex and build the trees again.
+        Anything that fails to compile is left as None, and gets parsed (and raises) at runtime instead.
+        """
+        stack = [f"action {action['id']}"]
+        compiled = CompiledAction(
+            condition=None, main_text=None, target=None, event=None, args={}, counters=[], guard=None
+        )
+
+        if action["condition"]:
+            compiled["condition"] = await self._try_compile(action["condition"], stack, True)
+            nodes = compiled["condition"] and compiled["condition"].nodes
+            if nodes and len(nodes) == 1 and isinstance(nodes[0], (BiOpExpr, ChainedBiOpExpr)):
+                compiled["guard"] = equality_guard(action["condition"], arg_lex.run_lex(action["condition"]))
+
+        if action["type"] in (ActionTypes.reply, ActionTypes.do):
+            compiled["main_text"] = await self._try_compile(action["main_text"], stack, False)
+
+        elif action["type"] == ActionTypes.log:
+            compiled["event"] = await self._try_compile(action["event"], stack, False)
+
+        elif action["type"] == ActionTypes.counter and action["target"]:
+            compiled["target"] = await self._try_compile(action["target"], stack, True)
+
+        if action["args"]:
+            compiled["args"] = {k: await self._try_compile(str(v), stack, False) for k, v in action["args"].items()}
+
+        counters = compiled["counters"] = []
+        if action["type"] == ActionTypes.counter:
+            if not action["target"]:
+                counters.append((action["main_text"], None))
+            elif (
+                compiled["target"]
+                and compiled["target"].nodes
+                and isinstance(compiled["target"].nodes[0], VariableAccess)
+            ):
+                counters.append((action["main_text"], compiled["target"].nodes[0].value))
+
+        for program in (compiled["condition"], compiled["main_text"], compiled["event"], *compiled["args"].values()):
+            if program is not None:
+                counters.extend(program.counter_reads)
+
+        return compiled
+
+    async def _try_compile(self, parsable: str, stack: List[str], strict_errors: bool) -> Optional[Program]:
+        try:
+            return Program(await self.parse_input(parsable, stack, strict_errors=strict_errors))
+        except ExecutionInterrupt:
+            return None
+
+    @contextlib.asynccontextmanager
+    async def unit_of_work(self, conn: asyncpg.Connection):
+        """
+        Gives the outermost dispatch a WriteBuffer (see ParsingContext.writes) and flushes it once the dispatch is done,
+        errors included, since whatever the actions already did to discord should still be recorded.
+        Nested dispatches (dispatch actions, case events) share their caller's buffer.
+        """
+        if self.writes.get() is not None:
+            yield
+            return
+
+        buffer = WriteBuffer()
+        token = self.writes.set(buffer)
+        try:
+            yield
+        finally:
+            self.writes.reset(token)
+            await buffer.flush(conn)
+
+    async def buffer_write(self, conn: asyncpg.Connection, query: str, *args: Any, callback=None) -> None:
+        """
+        Adds a write to the current dispatch's buffer, or runs it right away when there's no dispatch running.
+        """
+        buffer = self.writes.get()
+        if buffer is None:
+            buffer = WriteBuffer()
+            buffer.add(query, *args, callback=callback)
+            await buffer.flush(conn)
+        else:
+            buffer.add(query, *args, callback=callback)
 
     async def run_event(
         self,
@@ -184,61 +286,127 @@ class ParsingContext:
         if unlinked:
             await self.link(unlinked, conn)
 
+        await self.prefetch_counters(
+            [self.actions[x] for dispatch in self.events[name] for x in dispatch["actions"]], conn, vbls
+        )
         stack.append(f"event '{name}'")  # at this point it's safe to assume that the dispatching can go ahead
 
-        for dispatch in self.events[name]:
-            for i, runner in enumerate(dispatch["actions"]):
-                runner = self.actions[runner]
-                if not messageable and runner["type"] == ActionTypes.reply:
-                    continue
+        async with self.unit_of_work(conn):
+            for dispatch in self.events[name]:
+                for i, runner in enumerate(dispatch["actions"]):
+                    runner = self.actions[runner]
+                    if not messageable and runner["type"] == ActionTypes.reply:
+                        continue
+
+                    r = await self.run_action(runner, conn, vbls, stack, i)
+                    if r and messageable:
+                        self.bot.replies.send(messageable, r, sheddable=True)
+
+    async def _prepare_automod(
+        self, trigger: AutomodTrigger, conn: asyncpg.Connection, events: List[PARSE_VARS]
+    ) -> List[Tuple[dict, ActionIndex]]:
+        await self.fetch_required_data()
+
+        unlinked = {x for rule in trigger.rules for x in rule["actions"] if x not in self.actions}
+
+        if unlinked:
+            await self.link(list(unlinked), conn)
+
+        rules = []
+        for rule in trigger.rules:
+            key = tuple(rule["actions"])
+            index = self.action_indexes.get(key)
+            if index is None:
+                index = self.action_indexes[key] = ActionIndex([self.actions[x] for x in rule["actions"]])
+
+            rules.append((rule, index))
 
-                r = await self.run_action(runner, conn, vbls, stack, i)
+        await self.prefetch_counters([x for _, index in rules for x in index.actions], conn, *events)
+        return rules
+
+    async def _run_automod_rules(
+        self,
+        rules: List[Tuple[dict, ActionIndex]],
+        conn: asyncpg.Connection,
+        stack: List[str],
+        vbls: PARSE_VARS,
+        messageable: Optional[discord.abc.Messageable],
+    ):
+        for n, (rule, index) in enumerate(rules, start=1):
+            rule_stack = stack if len(rules) == 1 else [*stack, f"rule #{n} (priority {rule['priority']})"]
+            matched = False
+            for i in index.candidates(vbls):
+                r = await self.run_action(index.actions[i], conn, vbls, rule_stack, i, messageable)
+                matched = matched or r is not False
                 if r and messageable:
-                    await messageable.send(r)
+                    self.bot.replies.send(messageable, r, sheddable=True)
+
+            if matched and rule["stop"]:
+                break
 
     async def run_automod(
         self,
-        automod: dict,
+        trigger: AutomodTrigger,
         conn: asyncpg.Connection,
         stack: List[str] = None,
         vbls: PARSE_VARS = None,
         messageable: discord.abc.Messageable = None,
     ):
-        await self.fetch_required_data()
+        rules = await self._prepare_automod(trigger, conn, [vbls])
         stack = stack or ["<dispatch>"]
-
-        unlinked = [x for x in automod["actions"] if x not in self.actions]
-
-        if unlinked:
-            await self.link(unlinked, conn)
-
         stack.append(
-            f"automod trigger '{automod['event']}'"
+            f"automod trigger '{trigger.event}'"
         )  # at this point it's safe to assume that the dispatching can go ahead
 
-        for i, runner in enumerate(automod["actions"]):
-            act = self.actions[runner]
+        async with self.unit_of_work(conn):
+            await self._run_automod_rules(rules, conn, stack, vbls, messageable)
 
-            r = await self.run_action(act, conn, vbls, stack, i, messageable)
-            # stack.pop()
-            if r and messageable:
+    async def run_automod_many(
+        self,
+        trigger: AutomodTrigger,
+        conn: asyncpg.Connection,
+        events: List[PARSE_VARS],
+        stack: List[str] = None,
+        messageable: discord.abc.Messageable = None,
+    ) -> List[ExecutionInterrupt]:
+        """
+        Runs one automod trigger for each of the given events, in order. Linking, counter prefetching and buffered
+        writes are shared by the whole batch, so a batch costs about as many queries as a single event does.
+        An error only stops the event it happened in. The errors are returned instead of raised, in the order they
+        happened.
+        """
+        rules = await self._prepare_automod(trigger, conn, events)
+        stack = stack or ["<dispatch>"]
+        stack.append(f"automod trigger '{trigger.event}'")
+
+        errors = []
+        async with self.unit_of_work(conn):
+            for vbls in events:
                 try:
-                    await messageable.send(r)
-                except discord.HTTPException:
-                    pass
+                    await self._run_automod_rules(rules, conn, stack, vbls, messageable)
+                except ExecutionInterrupt as e:
+                    errors.append(e)
+
+        return errors
 
     async def run_logger(
-        self, name: str, event: str, conn: asyncpg.Connection, stack: List[str], vbls: PARSE_VARS = None
+        self,
+        name: str,
+        event: str,
+        conn: asyncpg.Connection,
+        stack: List[str],
+        vbls: PARSE_VARS = None,
+        compiled_event: Optional[Program] = None,
     ):
         await self.fetch_required_data()
-        event = await self.format_fmt(event, conn, stack, vbls)
+        event = await self.format_fmt(event, conn, stack, vbls, compiled=compiled_event)
 
         logger = self.loggers[name]
         stack.append(f"logger '{name}' @ event '{event}'")
         if event in logger["formats"]:
-            fmt = logger["formats"][event]
+            fmt_name = event
         elif "_" in logger["formats"]:
-            fmt = logger["formats"]["_"]
+            fmt_name = "_"
         else:
             raise ExecutionInterrupt(f"Failed late to catch unknown logger ({name}) event: '{event}'", stack)
 
@@ -246,32 +414,45 @@ class ParsingContext:
         if not channel:
             raise ExecutionInterrupt(f"Channel does not exist for logger {name}", stack)
 
-        try:
-            await channel.send(await self.format_fmt(fmt, conn, stack, vbls))
-        except discord.HTTPException as e:
-            raise ExecutionInterrupt(f"Failed to send message to logger '{name}': {e}", stack)
+        fmt = logger["formats"][fmt_name]
+        line = await self.format_fmt(fmt, conn, stack, vbls, compiled=logger["compiled"][fmt_name])
+        # sent in the background, along with whatever else is logged to the channel around the same time
+        self.bot.log_sink.send(channel, line, name, self.error_channel and self.guild.get_channel(self.error_channel))
 
         stack.pop()
 
     async def run_command(self, ctx: Context):
         await self.fetch_required_data()
 
-        async with self.bot.db.acquire() as conn:
+        async with self.bot.lazy_connection() as conn:
             try:
-                await self.parse_command(ctx, conn)
+                async with self.unit_of_work(conn):
+                    await self.parse_command(ctx, conn)
             except ExecutionInterrupt as e:
                 await ctx.reply(str(e), mention_author=False)
 
     async def format_fmt(
-        self, fmt: str, conn: asyncpg.Connection, stack: List[str], vbls: PARSE_VARS = None, try_int=False
+        self,
+        fmt: str,
+        conn: asyncpg.Connection,
+        stack: List[str],
+        vbls: PARSE_VARS = None,
+        try_int=False,
+        compiled: Optional[Program] = None,
     ):
         stack.append(f"formatting string '{fmt}'")
-        as_ast = await self.parse_input(fmt, stack, strict_errors=False)
+        program = compiled if compiled is not None else Program(await self.parse_input(fmt, stack, strict_errors=False))
+        token = self.stack.set(stack)
         try:
-            v = [str(await x.access(self, vbls, conn)) for x in as_ast]
+            if program.is_async:
+                v = [str(x) for x in await program.run(self, vbls, conn)]
+            else:
+                v = [str(x) for x in program.run_sync(self, vbls, conn)]
         except ExecutionInterrupt as e:
             e.msg = e.msg.format(input=fmt)
             raise
+        finally:
+            self.stack.reset(token)
 
         resp = "".join(v).strip()
         stack.pop()
@@ -284,6 +465,51 @@ class ParsingContext:
 
         return resp
 
+    def _load_counter(self, data: asyncpg.Record) -> ConfiguredCounter:
+        self.counters[data["name"]] = counter = ConfiguredCounter(
+            id=data["id"],
+            initial_count=data["start"],
+            decay_per=data["decay_per"],
+            decay_rate=data["decay_rate"],
+            name=data["name"],
+            per_user=data["per_user"],
+            window=data["window_size"],
+            buckets=data["buckets"],
+        )
+        return counter
+
+    async def get_counter(self, name: str, conn: asyncpg.Connection) -> Optional[ConfiguredCounter]:
+        if name in self.counters:
+            return self.counters[name]
+
+        data = await conn.fetchrow("SELECT * FROM counters WHERE cfg_id = $1 AND name = $2", self._cfg_id, name)
+        if not data:
+            return None
+
+        return self._load_counter(data)
+
+    async def prefetch_counters(self, actions: List[AnyAction], conn: asyncpg.Connection, *vbls: PARSE_VARS) -> None:
+        """
+        Loads every counter value the given actions can touch into the counter engine in one query, instead of one
+        query per counter the first time each is read. Anything that can't be worked out ahead of time (unknown
+        counters, targets that come from builtins or action args) is simply left to load itself when it's used.
+        Given the variables of several events, the values for all of them are loaded at once.
+        """
+        keys = []
+        for action in actions:
+            for name, variable in action["compiled"]["counters"]:
+                counter = self.counters.get(name)
+                if counter is None or counter["window"]:
+                    continue
+
+                if not counter["per_user"]:
+                    keys.append((counter, None))
+                elif variable is not None:
+                    keys.extend((counter, x[variable]) for x in vbls if x and isinstance(x.get(variable), int))
+
+        if keys:
+            await self.bot.counters.prefetch(conn, self.guild.id, keys)
+
     async def alter_counter(
         self,
         counter: str,
@@ -292,10 +518,12 @@ class ParsingContext:
         modify: int,
         target: Optional[str] = None,
         vbls: PARSE_VARS = None,
+        compiled_target: Optional[Program] = None,
     ):
         stack.append(f"edit counter {counter}")
         if target:
-            t = await self.parse_input(target, stack)
+            program = compiled_target if compiled_target is not None else Program(await self.parse_input(target, stack))
+            t = program.nodes
             if not t:
                 raise ExecutionInterrupt(f"Got an empty target", stack)
 
@@ -306,7 +534,15 @@ class ParsingContext:
                 )
 
             else:
-                _target = await t[0].access(self, vbls, conn)
+                ctx_token = self.stack.set(stack)
+                try:
+                    fn, is_async = program.parts[0]
+                    _target = fn(self, vbls, conn)
+                    if is_async:
+                        _target = await _target
+                finally:
+                    self.stack.reset(ctx_token)
+
                 if not isinstance(_target, int):
                     token = t[0].token
                     raise ExecutionInterrupt(
@@ -316,53 +552,17 @@ class ParsingContext:
 
                 target = _target
 
-        if counter in self.counters:
-            cnt = self.counters[counter]
-        else:
-            d = await conn.fetchrow("SELECT * FROM counters WHERE cfg_id = $1 AND name = $2", self._cfg_id, counter)
-            if not d:
-                raise ExecutionInterrupt(f"Unknown counter '{counter}'", stack)
-
-            cnt = self.counters[counter] = ConfiguredCounter(
-                id=d["id"],
-                initial_count=d["start"],
-                decay_per=d["decay_per"],
-                decay_rate=d["decay_rate"],
-                name=counter,
-                per_user=d["per_user"],
+        cnt = await self.get_counter(counter, conn)
+        if cnt is None:
+            raise ExecutionInterrupt(f"Unknown counter '{counter}'", stack)
+
+        if cnt["per_user"] and not target:
+            raise ExecutionInterrupt(
+                f"No target given while modifying per-user counter '{counter}'",
+                stack,
             )
-            if not cnt["per_user"]:
-                c = await conn.fetchval("SELECT val FROM counter_values WHERE counter_id = $1", cnt["id"])
-                if c is None:
-                    await conn.execute(
-                        "INSERT INTO counter_values VALUES ($1, $2, (NOW() AT TIME ZONE 'utc'), null)",
-                        cnt["id"],
-                        cnt["initial_count"],
-                    )
 
-        if cnt["per_user"]:
-            if not target:
-                raise ExecutionInterrupt(
-                    f"No target given while modifying per-user counter '{counter}'",
-                    stack,
-                )
-            else:
-                await conn.execute(
-                    """
-                INSERT INTO counter_values VALUES (
-                $1,
-                ($2::INT + $3::INT),
-                (NOW() AT TIME ZONE 'utc'),
-                $4
-                ) ON CONFLICT (counter_id, user_id) DO UPDATE SET val = excluded.val + $3::INT
-                """,
-                    cnt["id"],
-                    cnt["initial_count"] or 0,
-                    modify,
-                    target,
-                )
-        else:
-            await conn.execute("UPDATE counter_values SET val = val + $1 WHERE counter_id = $2", modify, cnt["id"])
+        await self.bot.counters.modify(conn, self.guild.id, cnt, modify, target if cnt["per_user"] else None)
 
         stack.pop()
 
@@ -374,63 +574,78 @@ class ParsingContext:
         stack: List[str],
         n: int = None,
         messageable=None,
-    ) -> Optional[str]:
+    ) -> Union[str, bool, None]:
+        """
+        Runs an action if its condition holds. Returns the text to reply with for reply actions, or False if the
+        condition didn't hold.
+        """
         stack = stack.copy()
         stack.append(f"action #{n} (type: {ActionTypes.reversed[action['type']]})")
 
-        if not await self.calculate_conditional(action["condition"], stack, vbls, conn):
-            return
+        compiled = action["compiled"]
+        if not await self.calculate_conditional(action["condition"], stack, vbls, conn, compiled["condition"]):
+            return False
 
         stack.append(f"parse action #{n}")
-        args = (vbls and vbls.copy()) or {}
+        # every action gets a scope of its own for its args and whatever builtins capture into it. the event's
+        # variables are read through it rather than copied, and are never written to
+        args = Scope(vbls)
 
         if action["args"]:
             stack.append(f"'args' values parsing")
             args.update(
-                {k.strip("$"): await self.format_fmt(v, conn, stack, args, True) for k, v in action["args"].items()}
+                {
+                    k.strip("$"): await self.format_fmt(v, conn, stack, args, True, compiled=compiled["args"][k])
+                    for k, v in action["args"].items()
+                }
             )
             stack.pop()
 
         stack.pop()
 
-        acts = {
-            ActionTypes.dispatch: (False, lambda: self.run_event(action["main_text"], conn, stack, args, messageable)),
-            ActionTypes.log: (
-                False,
-                lambda: self.run_logger(action["main_text"], action["event"], conn, stack, args),
-            ),
-            ActionTypes.counter: (
-                False,
-                lambda: self.alter_counter(action["main_text"], conn, stack, action["modify"], action["target"], args),
-            ),
-            ActionTypes.reply: (True, lambda: self.format_fmt(action["main_text"], conn, stack, args)),
-            ActionTypes.do: (False, lambda: self.format_fmt(action["main_text"], conn, stack, args)),
-        }
-
-        respond, fn = acts[action["type"]]
-
-        if respond:
-            return await fn()
-
-        await fn()
+        kind = action["type"]
+        if kind == ActionTypes.dispatch:
+            await self.run_event(action["main_text"], conn, stack, args, messageable)
+        elif kind == ActionTypes.log:
+            await self.run_logger(action["main_text"], action["event"], conn, stack, args, compiled["event"])
+        elif kind == ActionTypes.counter:
+            await self.alter_counter(
+                action["main_text"], conn, stack, action["modify"], action["target"], args, compiled["target"]
+            )
+        elif kind == ActionTypes.reply:
+            return await self.format_fmt(action["main_text"], conn, stack, args, compiled=compiled["main_text"])
+        elif kind == ActionTypes.do:
+            await self.format_fmt(action["main_text"], conn, stack, args, compiled=compiled["main_text"])
 
     async def calculate_conditional(
-        self, condition: Optional[str], stack: List[str], vbls: Optional[PARSE_VARS], conn: asyncpg.Connection
+        self,
+        condition: Optional[str],
+        stack: List[str],
+        vbls: Optional[PARSE_VARS],
+        conn: asyncpg.Connection,
+        compiled: Optional[Program] = None,
     ) -> bool:
         if not condition:
             return True
 
         stack.append("<conditional>")
 
-        data = await self.parse_input(condition, stack)
+        program = compiled if compiled is not None else Program(await self.parse_input(condition, stack))
+        data = program.nodes
         if not data or len(data) != 1 or not isinstance(data[0], (BiOpExpr, ChainedBiOpExpr)):
             raise ExecutionInterrupt("Expected a comparison", stack)
 
+        fn, is_async = program.parts[0]
+        token = self.stack.set(stack)
         try:
-            cond = await data[0].access(self, vbls, conn)
+            cond = fn(self, vbls, conn)
+            if is_async:
+                cond = await cond
         except ExecutionInterrupt as e:
             e.msg = e.msg.format(input=condition)
             raise
+        finally:
+            self.stack.reset(token)
 
         stack.pop()
         return cond
@@ -557,7 +772,7 @@ class ParsingContext:
 
         def _var(token):
             nonlocal depth, last
-            _last = VariableAccess(token, stack)
+            _last = VariableAccess.make(token, stack)
             if depth:
                 if last is not VarSep:
                     no_var_sep(token)
@@ -713,16 +928,17 @@ class ParsingContext:
 
         cmd = self.commands[invoker]
         stack = ["<dispatch>", f"command {invoker}"]
-        vbls = {
-            "authorid": message.author.id,
-            "authorname": str(message.author),
-            "authornick": message.author.nick,
-            "channelid": message.channel.id,
-            "channelname": message.channel.name,
-            "messagecontent": message.content,
-            "messageid": message.id,
-            "messagelink": message.jump_url,
-        }
+        vbls = LazyVariables(
+            {
+                "authorid": message.author.id,
+                "authornick": message.author.nick,
+                "channelid": message.channel.id,
+                "channelname": message.channel.name,
+                "messagecontent": message.content,
+                "messageid": message.id,
+            },
+            {"authorname": lambda: str(message.author), "messagelink": lambda: message.jump_url},
+        )
         ln = len(cmd["args"]) - 1
         for i, x in enumerate(cmd["args"]):
             stack.append(f"argument #{i+1} ({x['name']})")
@@ -737,7 +953,7 @@ class ParsingContext:
 
             r = await self.run_action(runner, conn, vbls, stack, i)
             if r:
-                await message.reply(r)
+                self.bot.replies.send(message.channel, r, reference=message)
 
     async def parse_command_arg(self, ctx: Context, arg: dict, view: StringView, stack: List[str], is_last: bool):
         typs = {
@@ -861,7 +1077,7 @@ async def resolve_channel(
         raise ExecutionInterrupt(
             f"| {{input}}\n| {' ' * arg.token.start}{'^' * (arg.token.end - arg.token.start)}\n| "
             f"There are multiple channels named '{_arg}'. Refusing to infer the correct one",
-            arg.stack,
+            stack,
         )
 
     return channels[0]
@@ -886,7 +1102,7 @@ async def resolve_role(
         raise ExecutionInterrupt(
             f"| {{input}}\n| {' ' * arg.token.start}{'^' * (arg.token.end - arg.token.start)}\n| "
             f"There are multiple roles named '{_arg}'. Refusing to infer the correct one",
-            arg.stack,
+            stack,
         )
 
     return roles[0]
@@ -945,8 +1161,8 @@ async def builtin_save_case(
         stack.append(f"builtins 'savecase', argument {e.args[0]}")
         raise ExecutionInterrupt(e.args[1], stack)
 
-    query = "INSERT INTO cases VALUES ($1, (SELECT MAX(id) FROM cases WHERE guild_id = $1) + 1, $2, $3, $4, $5, $6) RETURNING id"
-    return await conn.fetchval(query, ctx.guild.id, *pargs)
+    user_id, mod_id, reason, link, action = pargs
+    return await create_case(conn, ctx.guild.id, user_id, mod_id, action, reason, link)
 
 
 @_name("editcase", 2)  # case id, reason, action?
@@ -1014,16 +1230,7 @@ async def builtin_send(
 async def make_case(
     ctx: ParsingContext, conn: asyncpg.Connection, userid: int, action: str, reason: str, modid: int = None
 ):
-    modid = modid or ctx.bot.user.id
-    query = """
-    INSERT INTO
-        cases
-        (guild_id, id, user_id, mod_id, action, reason)
-    VALUES 
-        ($1, (SELECT COUNT(*) + 1 FROM cases WHERE guild_id = $1), $2, $3, $4, $5)
-    RETURNING id
-    """
-    return await conn.fetchval(query, ctx.guild.id, userid, modid, action, reason)
+    return await create_case(conn, ctx.guild.id, userid, modid or ctx.bot.user.id, action, reason)
 
 
 @_name("kick", 1)
@@ -1056,7 +1263,7 @@ async def builtin_kick(
     caseid = await make_case(ctx, conn, user, "kick", reason or "No reason given", modid=caller)
 
     if "case" in ctx.events:
-        mutated = vbls.copy()
+        mutated = Scope(vbls)
         mutated["caseid"] = caseid
         mutated["casereason"] = reason or "No reason given"
         mutated["caseaction"] = "kick"
@@ -1105,7 +1312,14 @@ async def builtin_ban(
         )
 
     if duration:
-        await timers.schedule_task("ban_complete", duration, conn=conn, guild_id=ctx.guild.id, user_id=user)
+        await ctx.buffer_write(
+            conn,
+            "INSERT INTO dispatchers (dispatch_at, event, data) VALUES ($1, $2, $3)",
+            duration,
+            "ban_complete",
+            ujson.dumps({"args": [], "kwargs": {"guild_id": ctx.guild.id, "user_id": user}}),
+            callback=lambda _: timers.reschedule(duration),
+        )
 
     try:
         await ctx.guild.ban(discord.Object(id=user), reason=reason)
@@ -1123,7 +1337,7 @@ async def builtin_ban(
         caseid = await make_case(ctx, conn, user, "ban", reason or "No reason given", modid=caller)
 
     if "case" in ctx.events:
-        mutated = vbls.copy()
+        mutated = Scope(vbls)
         mutated["caseid"] = caseid
         mutated["casereason"] = reason or "No reason given"
         mutated["caseaction"] = "ban"
@@ -1178,26 +1392,36 @@ async def builtin_mute(
             "Failed to schedule the unmute task. This is an internal error that you should not see.", stack
         )
 
-    tid = None
-    if duration:
-        _data = await timers.schedule_task("mute_complete", duration, conn=conn, guild_id=ctx.guild.id, user_id=user)
-        tid = _data["id"]
-
-    # TODO: if someone knows how to do this in one query feel free to do so
-
-    exists = await conn.fetchval(
-        "SELECT dispatch_id FROM mutes WHERE guild_id = $1 AND user_id = $2", ctx.guild.id, user
+    # schedules the unmute, cancels the one from any previous mute, and records the mute, all in one statement.
+    # nothing else in the dispatch needs it, so it goes out with the rest of the dispatch's writes
+    query = """
+    WITH old AS (
+        SELECT dispatch_id FROM mutes WHERE guild_id = $1 AND user_id = $2
+    ), scheduled AS (
+        INSERT INTO dispatchers (dispatch_at, event, data)
+        SELECT $3::TIMESTAMP, 'mute_complete', $4::JSONB WHERE $3::TIMESTAMP IS NOT NULL
+        RETURNING id
+    ), cancelled AS (
+        DELETE FROM dispatchers WHERE id = (SELECT dispatch_id FROM old) RETURNING id
+    ), muted AS (
+        INSERT INTO mutes VALUES ($1, $2, (SELECT id FROM scheduled))
+        ON CONFLICT (guild_id, user_id) DO UPDATE SET dispatch_id = excluded.dispatch_id
     )
-    if exists:
-        await timers.cancel_task(exists, conn=conn)
-
-    await conn.execute(
-        "INSERT INTO mutes VALUES ($1, $2, $3) ON CONFLICT (guild_id, user_id) DO UPDATE SET dispatch_id = $3",
+    SELECT (SELECT id FROM cancelled) AS cancelled
+    """
+    params = (
         ctx.guild.id,
         user,
-        tid,
+        duration,
+        ujson.dumps({"args": [], "kwargs": {"guild_id": ctx.guild.id, "user_id": user}}),
     )
 
+    def reschedule(row):
+        if timers:
+            timers.reschedule(duration, row and row["cancelled"])
+
+    await ctx.buffer_write(conn, query, *params, callback=reschedule)
+
     caller: int = ctx.callerid.get()  # noqa
 
     if duration:
@@ -1206,7 +1430,7 @@ async def builtin_mute(
         caseid = await make_case(ctx, conn, user, "mute", reason or "No reason given", modid=caller)
 
     if "case" in ctx.events:
-        mutated = vbls.copy()
+        mutated = Scope(vbls)
         mutated["caseid"] = caseid
         mutated["casereason"] = reason or "No reason given"
         mutated["caseaction"] = "tempmute" if duration else "mute"
@@ -1270,7 +1494,7 @@ async def builtin_timeout(
     caseid = await make_case(ctx, conn, user, "tempmute", reason or "No reason given", modid=caller)
 
     if "case" in ctx.events:
-        mutated = vbls.copy()
+        mutated = Scope(vbls)
         mutated["caseid"] = caseid
         mutated["casereason"] = reason or "No reason given"
         mutated["caseaction"] = "tempmute" if duration else "mute"
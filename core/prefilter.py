@@ -0,0 +1,114 @@
+from __future__ import annotations
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Union
+
+import discord
+
+__all__ = ("AutomodFilter", "AutomodTrigger")
+
+
+class AutomodFilter:
+    """
+    The ``ignore`` table of an automod block, as sets, so that a listener can throw away events the trigger ignores
+    before it queues them, builds their variables, or touches the database.
+
+    Everything ``rejects`` is given is optional, since not every event knows its channel or author up front. Whatever
+    is missing just isn't checked.
+    """
+
+    __slots__ = ("roles", "channels", "categories", "emoji", "bots")
+
+    def __init__(
+        self,
+        roles: Iterable[int] = (),
+        channels: Iterable[int] = (),
+        categories: Iterable[int] = (),
+        emoji: Iterable[str] = (),
+        bots: bool = False,
+    ):
+        self.roles: FrozenSet[int] = frozenset(roles or ())
+        self.channels: FrozenSet[int] = frozenset(channels or ())
+        self.categories: FrozenSet[int] = frozenset(categories or ())
+        self.emoji: FrozenSet[str] = frozenset(emoji or ())
+        self.bots = bots
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> AutomodFilter:
+        return cls(
+            row["ignore_roles"],
+            row["ignore_channels"],
+            row["ignore_categories"],
+            row["ignore_emoji"],
+            row["ignore_bots"],
+        )
+
+    def __bool__(self) -> bool:
+        # a filter that ignores nothing is skipped entirely
+        return bool(self.roles or self.channels or self.categories or self.emoji or self.bots)
+
+    def rejects(
+        self,
+        channel_id: Optional[int] = None,
+        category_id: Optional[int] = None,
+        roles: Optional[Iterable[int]] = None,
+        bot: bool = False,
+        emoji: Optional[Union[discord.PartialEmoji, str]] = None,
+    ) -> bool:
+        if bot and self.bots:
+            return True
+
+        if channel_id is not None and channel_id in self.channels:
+            return True
+
+        if category_id is not None and category_id in self.categories:
+            return True
+
+        if emoji is not None and self.emoji:
+            if isinstance(emoji, discord.PartialEmoji):
+                emoji = str(emoji.id) if emoji.id else emoji.name
+
+            if emoji in self.emoji:
+                return True
+
+        return roles is not None and not self.roles.isdisjoint(roles)
+
+
+class AutomodTrigger:
+    """
+    Every automod block a guild has for one event, in the order they run: lowest priority first, then in the order
+    they're written in the config. Each block (a ``rule``) is a dict with its ``id``, ``actions``, ``filter``,
+    ``priority`` and ``stop``.
+
+    ``select`` narrows the rules down to the ones that don't ignore an event, so that dispatch only walks those.
+    """
+
+    __slots__ = ("event", "rules", "filtered", "categories")
+
+    def __init__(self, event: str, rules: List[Dict[str, Any]]):
+        self.event = event
+        self.rules = sorted(rules, key=lambda x: (x["priority"], x["id"]))
+        self.filtered = any(x["filter"] for x in self.rules)
+        self.categories = any(x["filter"].categories for x in self.rules)  # whether the channel's category matters
+
+    def __repr__(self):
+        return f"<AutomodTrigger event={self.event} rules={len(self.rules)}>"
+
+    def select(
+        self,
+        channel_id: Optional[int] = None,
+        category_id: Optional[int] = None,
+        roles: Optional[Iterable[int]] = None,
+        bot: bool = False,
+        emoji: Optional[Union[discord.PartialEmoji, str]] = None,
+    ) -> Optional[AutomodTrigger]:
+        """
+        Returns the trigger with only the rules that don't ignore the event (itself, if that's all of them), or None
+        if every rule does. Takes the same arguments as AutomodFilter.rejects.
+        """
+        if not self.filtered:
+            return self
+
+        rules = [x for x in self.rules if not x["filter"].rejects(channel_id, category_id, roles, bot, emoji)]
+        if len(rules) == len(self.rules):
+            return self
+
+        return rules and AutomodTrigger(self.event, rules) or None
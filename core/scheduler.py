@@ -0,0 +1,231 @@
+from __future__ import annotations
+import asyncio
+import collections
+import contextlib
+import contextvars
+import enum
+import random
+import sys
+import traceback
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+__all__ = ("EventScheduler", "EventPriority", "OVERFLOW_POLICIES")
+
+Job = Callable[[], Awaitable[Any]]
+OVERFLOW_POLICIES = ("drop_oldest", "sample", "coalesce")
+
+# the scheduler running the current job, and whether the job holds its concurrency slot
+_slot: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar("scheduler_slot", default=None)
+
+
+class EventPriority(enum.IntEnum):
+    """
+    Which events are handled first when a guild has a backlog. Lower goes first.
+    """
+
+    moderation = 0  # bans, kicks, mutes and the cases they make
+    member = 1  # joins, leaves, reactions, message edits and deletes
+    message = 2  # message automod
+
+
+class _GuildQueue:
+    __slots__ = ("levels", "keys", "size", "workers", "seen")
+
+    def __init__(self):
+        self.levels: List[Deque[list]] = [collections.deque() for _ in EventPriority]
+        self.keys: Dict[tuple, list] = {}  # (priority, key): the queued item, for coalescing
+        self.size = 0
+        self.workers = 0
+        self.seen = 0  # events that arrived while the queue was full, for sampling
+
+    def pop(self) -> list:
+        for priority, level in enumerate(self.levels):
+            if level:
+                item = level.popleft()
+                self.size -= 1
+                if not self.size:
+                    self.seen = 0
+
+                if item[0] is not None and self.keys.get((priority, item[0])) is item:
+                    del self.keys[(priority, item[0])]
+
+                return item
+
+        raise IndexError("pop from an empty queue")
+
+
+class EventScheduler:
+    """
+    Runs event handlers from a bounded queue per guild instead of all at once, so that a raid in one guild can't start
+    thousands of handlers that all wait on the database pool.
+
+    Each guild gets up to ``workers_per_guild`` workers, which only live while the guild has something queued, and at
+    most ``max_concurrency`` handlers run at a time over all guilds. Handlers are taken in EventPriority order. A
+    handler that has to wait on something slow gives its place up meanwhile with ``async with scheduler.waiting()``.
+
+    A guild holds at most ``max_queued`` events. When one arrives past that, ``overflow`` decides what gets shed:
+
+    - ``"drop_oldest"``: the oldest queued event of the least important priority (no more important than the new one)
+    - ``"sample"``: a random one of those, or the new event, so that what's kept is an even sample of the whole burst
+    - ``"coalesce"``: a queued event from the same user (the ``key``) is replaced by the new one, otherwise as
+      ``"drop_oldest"``
+    """
+
+    def __init__(
+        self,
+        workers_per_guild: int = 2,
+        max_concurrency: int = 8,
+        max_queued: int = 500,
+        overflow: str = "drop_oldest",
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}'")
+
+        self.workers_per_guild = workers_per_guild
+        self.max_queued = max_queued
+        self.overflow = overflow
+
+        self.guilds: Dict[int, _GuildQueue] = {}
+        self._running = asyncio.Semaphore(max_concurrency)
+        self._workers: set = set()
+        self._closed = False
+
+        self.handled = 0
+        self.shed: Dict[EventPriority, int] = {x: 0 for x in EventPriority}
+
+    def submit(self, guild_id: int, priority: EventPriority, job: Job, key: Optional[Hashable] = None) -> bool:
+        """
+        Queues a handler for a guild. Returns False if the event was shed instead, or the scheduler is closed.
+        """
+        if self._closed:
+            return False
+
+        queue = self.guilds.get(guild_id)
+        if queue is None:
+            queue = self.guilds[guild_id] = _GuildQueue()
+
+        if queue.size >= self.max_queued:
+            queue.seen += 1
+            if self.overflow == "coalesce" and key is not None:
+                queued = queue.keys.get((priority, key))
+                if queued is not None:
+                    queued[1] = job  # keeps its place in line
+                    self.shed[priority] += 1
+                    return True
+
+            level = next((x for x in range(len(EventPriority) - 1, priority - 1, -1) if queue.levels[x]), None)
+            # something less important always makes way, sampling is between events of the same priority
+            if level is None or (
+                level == priority
+                and self.overflow == "sample"
+                and random.random() >= self.max_queued / (self.max_queued + queue.seen)
+            ):
+                self.shed[priority] += 1
+                return False
+
+            if self.overflow == "sample":
+                index = random.randrange(len(queue.levels[level]))
+                evicted = queue.levels[level][index]
+                del queue.levels[level][index]
+            else:
+                evicted = queue.levels[level].popleft()
+
+            queue.size -= 1
+            if evicted[0] is not None and queue.keys.get((level, evicted[0])) is evicted:
+                del queue.keys[(level, evicted[0])]
+
+            self.shed[EventPriority(level)] += 1
+
+        item = [key, job]
+        queue.levels[priority].append(item)
+        queue.size += 1
+        if key is not None:
+            queue.keys[(priority, key)] = item
+
+        if queue.workers < self.workers_per_guild:
+            queue.workers += 1
+            task = asyncio.create_task(self._work(guild_id, queue))
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+
+        return True
+
+    async def _work(self, guild_id: int, queue: _GuildQueue) -> None:
+        try:
+            while queue.size:
+                _, job = queue.pop()
+                await self._running.acquire()
+                held = [True]
+                token = _slot.set((self, held))
+                try:
+                    # its own task, so that the context variables it sets don't leak into the next one
+                    await asyncio.ensure_future(job())
+                except Exception:
+                    print(f"Ignoring exception in queued event handler for guild {guild_id}:", file=sys.stderr)
+                    traceback.print_exc(file=sys.stderr)
+                finally:
+                    _slot.reset(token)
+                    if held[0]:
+                        self._running.release()
+
+                self.handled += 1
+        finally:
+            queue.workers -= 1
+            if not queue.size and not queue.workers and self.guilds.get(guild_id) is queue:
+                del self.guilds[guild_id]
+
+    @contextlib.asynccontextmanager
+    async def waiting(self):
+        """
+        Gives up the running job's concurrency slot for the body, for waits that aren't work of the bot's own (sleeping
+        until the audit log catches up, paging through it), so that other guilds' events run in the meantime. The
+        guild's own queue still waits on the job. Outside of a job this does nothing.
+        """
+        slot = _slot.get()
+        if slot is None or slot[0] is not self or not slot[1][0]:
+            yield
+            return
+
+        held = slot[1]
+        self._running.release()
+        held[0] = False
+        try:
+            yield
+        finally:
+            await self._running.acquire()
+            held[0] = True
+
+    def stats(self) -> Dict[str, Any]:
+        depth = {x.name: sum(len(q.levels[x]) for q in self.guilds.values()) for x in EventPriority}
+        busiest = sorted(self.guilds.items(), key=lambda x: x[1].size, reverse=True)[:5]
+        return {
+            "guilds": len(self.guilds),
+            "queued": sum(depth.values()),
+            "depth": depth,
+            "shed": {x.name: n for x, n in self.shed.items()},
+            "handled": self.handled,
+            "busiest": [(guild_id, queue.size) for guild_id, queue in busiest],
+        }
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """
+        Drops everything still queued and gives the handlers that are running a chance to finish, then stops.
+        """
+        self._closed = True
+        for queue in self.guilds.values():
+            for level in queue.levels:
+                level.clear()
+
+            queue.keys.clear()
+            queue.size = 0
+
+        self.guilds.clear()
+        if not self._workers:
+            return
+
+        _, pending = await asyncio.wait(list(self._workers), timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+        if pending:
+            await asyncio.wait(pending)
@@ -1,3 +1,4 @@
+import itertools
 import time
 
 
@@ -37,3 +38,118 @@ class ExpiringDict(dict):
         for x, (y, z) in set(self.items()):
             if now - y > self._timeout:
                 del self[x]
+
+
+class LazyVariables(dict):
+    """
+    Variables for an event, where the ones that take work to make (formatting names, avatar urls, links) are given as
+    functions instead, which are only called the first time the variable is read. The value is then kept like any
+    other. Everything that reads variables goes through ``in``, ``[]`` or ``get``, which all see the lazy ones.
+
+    Scopes layered on top read through to it, and copies share what's been computed, so nothing is made twice per
+    event.
+    """
+
+    __slots__ = ("lazy", "cache")
+
+    def __init__(self, values=None, lazy=None, cache=None):
+        super().__init__(values or ())
+        self.lazy = lazy or {}
+        self.cache = {} if cache is None else cache
+
+    def __missing__(self, key):
+        if key not in self.cache:
+            self.cache[key] = self.lazy[key]()
+
+        value = self[key] = self.cache[key]
+        return value
+
+    def __setitem__(self, key, value):
+        self.lazy.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __contains__(self, key):
+        return key in self.lazy or super().__contains__(key)
+
+    def __iter__(self):
+        return itertools.chain(super().__iter__(), iter(self.lazy))
+
+    def __len__(self):
+        return super().__len__() + len(self.lazy)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def copy(self):
+        return LazyVariables(dict.copy(self), self.lazy.copy(), self.cache)
+
+
+class Scope(dict):
+    """
+    Variables layered on top of the ones of the event (or scope) they were made in, for an action's ``args`` or the
+    extra variables a builtin passes on. Only what's set in the scope itself is stored in it, everything else is read
+    from ``parent``, so making one costs the same however many variables the event has. The parent is never written
+    to.
+    """
+
+    __slots__ = ("parent",)
+
+    def __init__(self, parent=None, values=None):
+        super().__init__(values or ())
+        self.parent = parent
+
+    def __missing__(self, key):
+        if self.parent is None:
+            raise KeyError(key)
+
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return super().__contains__(key) or (self.parent is not None and key in self.parent)
+
+    def __bool__(self):
+        return super().__len__() > 0 or bool(self.parent)
+
+    def __iter__(self):
+        if self.parent is None:
+            return super().__iter__()
+
+        return itertools.chain(super().__iter__(), (x for x in self.parent if not dict.__contains__(self, x)))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def copy(self):
+        return Scope(self)
+
+
+def chunk_lines(lines, limit=2000):
+    """
+    Joins lines with newlines into as few strings of at most ``limit`` characters as possible.
+    A line that's longer than the limit on its own is cut up.
+    """
+    chunk = ""
+    for line in lines:
+        while len(line) > limit:
+            if chunk:
+                yield chunk
+                chunk = ""
+
+            yield line[:limit]
+            line = line[limit:]
+
+        if chunk and len(chunk) + 1 + len(line) > limit:
+            yield chunk
+            chunk = line
+        else:
+            chunk = f"{chunk}\n{line}" if chunk else line
+
+    if chunk:
+        yield chunk
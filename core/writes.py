@@ -0,0 +1,58 @@
+from __future__ import annotations
+import itertools
+from typing import Any, Callable, List, Optional, Tuple
+
+import asyncpg
+
+__all__ = ("WriteBuffer",)
+
+ResultCallback = Callable[[Optional[asyncpg.Record]], Any]
+
+
+class WriteBuffer:
+    """
+    Collects the writes a dispatch makes that nothing later in the same dispatch needs the result of, and sends them
+    in one transaction when the dispatch is done. Runs of the same statement are sent with a single executemany.
+
+    Statements run in the order they were added, so a buffered write that depends on an earlier buffered one sees it.
+    Callbacks are for the in-memory state that has to follow the database (timers and the like), and only run once
+    the transaction has committed.
+    """
+
+    __slots__ = ("statements",)
+
+    def __init__(self):
+        self.statements: List[Tuple[str, tuple, Optional[ResultCallback]]] = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def add(self, query: str, *args: Any, callback: Optional[ResultCallback] = None) -> None:
+        """
+        Queues a statement. If a callback is given, the first row the statement returns (or None) is passed to it
+        after the commit.
+        """
+        self.statements.append((query, args, callback))
+
+    async def flush(self, conn: asyncpg.Connection) -> None:
+        if not self.statements:
+            return
+
+        statements, self.statements = self.statements, []
+        results: List[Tuple[ResultCallback, Optional[asyncpg.Record]]] = []
+
+        async with conn.transaction():
+            for (query, with_result), group in itertools.groupby(statements, key=lambda x: (x[0], x[2] is not None)):
+                group = list(group)
+                if with_result:
+                    for _, args, callback in group:
+                        results.append((callback, await conn.fetchrow(query, *args)))
+
+                elif len(group) == 1:
+                    await conn.execute(query, *group[0][1])
+
+                else:
+                    await conn.executemany(query, [x[1] for x in group])
+
+        for callback, row in results:
+            callback(row)
@@ -115,7 +115,21 @@ class Config(commands.Cog):
             elif cmd:
                 _evens.append((cfg_id, _event["name"], acts, _event["help"], _event["group"]))
             elif automod:
-                _evens.append((cfg_id, _event["event"], acts, _event["ignore"]["roles"], _event["ignore"]["channels"]))
+                ignore = _event["ignore"]
+                _evens.append(
+                    (
+                        cfg_id,
+                        _event["event"],
+                        acts,
+                        _event["priority"],
+                        _event["stop"],
+                        ignore["roles"],
+                        ignore["channels"],
+                        ignore["categories"],
+                        ignore["emoji"],
+                        ignore["bots"],
+                    )
+                )
 
         return _evens
 
@@ -147,12 +161,19 @@ class Config(commands.Cog):
                 step += 1
                 await update_msg()
 
+                storage = cfg.message_storage
                 new_id = await conn.fetchval(
-                    "INSERT INTO configs (guild_id, store_messages, error_channel, mute_role) VALUES ($1, $2, $3, $4) RETURNING id",
+                    "INSERT INTO configs "
+                    "(guild_id, store_messages, error_channel, mute_role, store_content, store_attachments, message_retention) "
+                    "VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id",
                     ctx.guild.id,
-                    any(x in cfg.automod_events for x in ("message_delete", "message_edit")),
+                    # stored messages are only ever read by these two triggers, so there's no point keeping them otherwise
+                    storage["enabled"] and any(x in cfg.automod_events for x in ("message_delete", "message_edit")),
                     cfg.error_channel,
                     cfg.mute_role,
+                    storage["content"],
+                    storage["attachments"],
+                    storage["retention"],
                 )
                 rows = await conn.fetch(
                     "DELETE FROM events "
@@ -220,9 +241,19 @@ class Config(commands.Cog):
                     ctx.guild.id,
                 )
                 await conn.executemany(
-                    "INSERT INTO counters (cfg_id, start, per_user, name, decay_rate, decay_per) VALUES ($1, $2, $3, $4, $5, $6)",
+                    "INSERT INTO counters (cfg_id, start, per_user, name, decay_rate, decay_per, window_size, buckets) "
+                    "VALUES ($1, $2, $3, $4, $5, $6, $7, $8)",
                     [
-                        (new_id, x["initial_count"], x["per_user"], x["name"], x["decay_rate"], x["decay_per"])
+                        (
+                            new_id,
+                            x["initial_count"],
+                            x["per_user"],
+                            x["name"],
+                            x["decay_rate"],
+                            x["decay_per"],
+                            x["window"],
+                            x["buckets"],
+                        )
                         for x in cfg.counters.values()
                         if x["name"] not in derefed
                     ],
@@ -231,11 +262,16 @@ class Config(commands.Cog):
                 step += 1
                 await update_msg()
 
-                _evens = await self.insert_actions(conn, new_id, list(cfg.automod_events.values()), automod=True)
+                blocks = list(itertools.chain.from_iterable(cfg.automod_events.values()))
+                _evens = await self.insert_actions(conn, new_id, blocks, automod=True)
                 await conn.executemany(
                     """
-                    WITH ins AS (INSERT INTO automod (cfg_id, event, actions) VALUES ($1, $2, $3) RETURNING id)
-                    INSERT INTO automod_ignore VALUES ((select id FROM ins), $4, $5)
+                    WITH ins AS (
+                        INSERT INTO automod (cfg_id, event, actions, priority, stop) VALUES ($1, $2, $3, $4, $5)
+                        RETURNING id
+                    )
+                    INSERT INTO automod_ignore (event_id, roles, channels, categories, emoji, bots)
+                    VALUES ((select id FROM ins), $6, $7, $8, $9, $10)
                     """,
                     _evens,
                 )
@@ -1,19 +1,86 @@
 import asyncio
+import collections
+import functools
 
 import asyncpg
 import discord
 import itertools
-from typing import Dict, Union
+from typing import Callable, Counter, Dict, Hashable, List, Optional, Tuple, Union
 
 from discord.ext import commands
 from core.bot import Bot
 from core import parse, utils
+from core.utils import LazyVariables
+from core.prefilter import AutomodFilter, AutomodTrigger
+from core.scheduler import EventPriority, EventScheduler
+from core.cases import create_case
+from core.messages import delete_stored, update_stored
+
+
+# the newest config of each guild
+CONFIG_QUERY = """
+SELECT DISTINCT ON (guild_id)
+    id, guild_id, store_messages, store_content, store_attachments, message_retention, error_channel
+FROM configs
+"""
+AUTOMOD_QUERY = """
+SELECT
+    automod.id,
+    event,
+    actions,
+    priority,
+    stop,
+    c.guild_id,
+    ai.roles as ignore_roles,
+    ai.channels as ignore_channels,
+    ai.categories as ignore_categories,
+    ai.emoji as ignore_emoji,
+    ai.bots as ignore_bots
+FROM automod
+INNER JOIN automod_ignore ai on automod.id = ai.event_id
+INNER JOIN configs c on automod.cfg_id = c.id
+"""
 
 
 async def setup(bot: Bot):
     await bot.add_cog(Dispatch(bot))
 
 
+def queued(
+    priority: EventPriority,
+    guild: Callable[..., Optional[int]],
+    key: Optional[Callable[..., Optional[Hashable]]] = None,
+    prefilter: Optional[Callable[..., bool]] = None,
+):
+    """
+    Makes a listener run from its guild's event queue (see Dispatch.scheduler) instead of straight away.
+    ``guild`` and ``key`` are given the listener's arguments, and return the guild id and the user the event is about.
+    Events without a guild run straight away.
+    ``prefilter`` is given the cog and the listener's arguments, and returns True to drop the event before it's queued
+    (see Dispatch.ignored).
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self: "Dispatch", *args):
+            if prefilter is not None and prefilter(self, *args):
+                return
+
+            guild_id = guild(*args)
+            if guild_id is None:
+                return await func(self, *args)
+
+            self.scheduler.submit(guild_id, priority, functools.partial(func, self, *args), key and key(*args))
+
+        return wrapper
+
+    return decorator
+
+
+def avatar_url(user: Union[discord.User, discord.Member]) -> str:
+    return user.avatar.with_format("gif").url if user.avatar.is_animated() else user.avatar.with_format("png").url
+
+
 class Dispatch(commands.Cog):
     hidden = True
 
@@ -24,6 +91,99 @@ class Dispatch(commands.Cog):
         self.filled = asyncio.Event()
 
         self.recent_events = utils.ExpiringDict()
+        self.scheduler = EventScheduler(
+            workers_per_guild=bot.settings.get("event_workers_per_guild", 2),
+            max_concurrency=bot.settings.get("event_concurrency", 8),
+            max_queued=bot.settings.get("event_queue_size", 500),
+            overflow=bot.settings.get("event_queue_overflow", "drop_oldest"),
+        )
+        self.ignored_events: Counter[str] = collections.Counter()  # trigger: events all of its rules ignored
+
+    @staticmethod
+    def _cache_config(row: asyncpg.Record) -> dict:
+        return {
+            "id": row["id"],
+            "store_messages": row["store_messages"],
+            "store_content": row["store_content"],
+            "store_attachments": row["store_attachments"],
+            "message_retention": row["message_retention"],
+            "error_channel": row["error_channel"],
+        }
+
+    @staticmethod
+    def _cache_automod(rows: List[asyncpg.Record]) -> Dict[str, AutomodTrigger]:
+        rules = {}
+        for row in rows:
+            rules.setdefault(row["event"], []).append(
+                {
+                    "id": row["id"],
+                    "event": row["event"],
+                    "actions": row["actions"],
+                    "filter": AutomodFilter.from_row(row),
+                    "priority": row["priority"],
+                    "stop": row["stop"],
+                }
+            )
+
+        return {event: AutomodTrigger(event, x) for event, x in rules.items()}
+
+    def select(
+        self,
+        guild_id: Optional[int],
+        event: str,
+        channel_id: Optional[int] = None,
+        author: Optional[Union[discord.Member, discord.User]] = None,
+        emoji: Optional[discord.PartialEmoji] = None,
+    ) -> Optional[AutomodTrigger]:
+        """
+        Returns the guild's ``event`` trigger, with only the rules that don't ignore this event (see
+        AutomodTrigger.select). None if there's no such trigger, or every rule ignores the event.
+        Only looks at what's already in memory, so listeners can call it before doing anything else with the event.
+        """
+        trigger = self.cached_triggers.get("automod", {}).get(guild_id, {}).get(event)
+        if trigger is None or not trigger.filtered:
+            return trigger
+
+        category_id = None
+        if channel_id is not None and trigger.categories:
+            guild = self.bot.get_guild(guild_id)
+            channel = guild and guild.get_channel_or_thread(channel_id)
+            category_id = channel and channel.category_id
+
+        roles = getattr(author, "_roles", None)  # only members have them
+        selected = trigger.select(channel_id, category_id, roles, author is not None and author.bot, emoji)
+        if selected is None:
+            self.ignored_events[event] += 1
+
+        return selected
+
+    def ignored(
+        self,
+        guild_id: Optional[int],
+        event: str,
+        channel_id: Optional[int] = None,
+        author: Optional[Union[discord.Member, discord.User]] = None,
+        emoji: Optional[discord.PartialEmoji] = None,
+    ) -> bool:
+        """
+        Whether the guild has an ``event`` trigger, but every one of its rules ignores this event.
+        """
+        return (
+            event in self.cached_triggers.get("automod", {}).get(guild_id, {})
+            and self.select(guild_id, event, channel_id, author, emoji) is None
+        )
+
+    def message_expired(self, guild_id: int, message_id: int) -> bool:
+        """
+        Whether a message is past its guild's retention, and so shouldn't be treated as stored even if the row is
+        still around.
+        """
+        retention = self.cached_triggers["configs"].get(guild_id, {}).get("message_retention")
+        if not retention:
+            return False
+
+        age = discord.utils.utcnow() - discord.utils.snowflake_time(message_id)
+        return age.total_seconds() > retention
 
     async def cog_load(self) -> None:
         if not self.bot.is_ready():
@@ -31,6 +191,9 @@ class Dispatch(commands.Cog):
         else:
             await self.fill_triggers()
 
+    async def cog_unload(self) -> None:
+        await self.scheduler.close()
+
     async def fill_triggers(self):
         await self.bot.wait_until_ready()
 
@@ -41,18 +204,14 @@ class Dispatch(commands.Cog):
             data = await conn.fetch(
                 """
                 SELECT
-                    name, actions, c.guild_id, cfg_id, c.store_messages, c.error_channel
+                    name, actions, c.guild_id
                 FROM events
                 INNER JOIN configs c on c.id = events.cfg_id
                 """
             )
             self.cached_triggers["configs"] = {
-                x["guild_id"]: {
-                    "id": x["cfg_id"],
-                    "store_messages": x["store_messages"],
-                    "error_channel": x["error_channel"],
-                }
-                for x in data
+                x["guild_id"]: self._cache_config(x)
+                for x in await conn.fetch(f"{CONFIG_QUERY} ORDER BY guild_id, id DESC")
             }
             self.cached_triggers["configs"].update(
                 {x.id: {} for x in self.bot.guilds if x.id not in self.cached_triggers["configs"]}
@@ -67,16 +226,10 @@ class Dispatch(commands.Cog):
             )
 
             data = await conn.fetch(
-                """
-                SELECT
-                    event, actions, ai.roles as ignore_roles, ai.channels as ignore_channels, c.guild_id
-                FROM automod
-                INNER JOIN automod_ignore ai on automod.id = ai.event_id
-                INNER JOIN configs c on automod.cfg_id = c.id
-                """
+                f"{AUTOMOD_QUERY} WHERE c.id IN (SELECT MAX(id) FROM configs GROUP BY guild_id) ORDER BY c.guild_id"
             )
             guilds = itertools.groupby(data, lambda k: k["guild_id"])
-            self.cached_triggers["automod"] = {c[0]: {x["event"]: dict(x) for x in c[1]} for c in guilds}
+            self.cached_triggers["automod"] = {c[0]: self._cache_automod(list(c[1])) for c in guilds}
             self.cached_triggers["automod"].update(
                 {x.id: {} for x in self.bot.guilds if x.id not in self.cached_triggers["automod"]}
             )
@@ -123,37 +276,29 @@ class Dispatch(commands.Cog):
             ctx = self.ctx_cache.pop(guild_id)
             await ctx.dispose()
 
+        # the new config may store less than the old one did
+        self.bot.recent_messages.drop_guild(guild_id)
+
         data = await conn.fetch(
             """
             SELECT
-                name, actions, c.guild_id, cfg_id, c.store_messages, c.error_channel
+                name, actions, c.guild_id
             FROM events
             INNER JOIN configs c on c.id = events.cfg_id
             WHERE c.id = (SELECT MAX(id) FROM configs WHERE configs.guild_id = $1)
             """,
             guild_id,
         )
-        self.cached_triggers["configs"][guild_id] = {
-            "id": data[0]["cfg_id"],
-            "store_messages": data[0]["store_messages"],
-            "error_channel": data[0]["error_channel"],
-        }
+        cfg = await conn.fetchrow(f"{CONFIG_QUERY} WHERE guild_id = $1 ORDER BY guild_id, id DESC", guild_id)
+        self.cached_triggers["configs"][guild_id] = cfg and self._cache_config(cfg) or {}
         self.cached_triggers["events"][guild_id] = {
             c["name"]: {"name": c["name"], "actions": c["actions"]} for c in data
         }
 
         data = await conn.fetch(
-            """
-            SELECT
-                event, actions, ai.roles as ignore_roles, ai.channels as ignore_channels, c.guild_id
-            FROM automod
-            INNER JOIN automod_ignore ai on automod.id = ai.event_id
-            INNER JOIN configs c on automod.cfg_id = c.id
-            WHERE c.id = (SELECT MAX(id) FROM configs WHERE configs.guild_id = $1)
-            """,
-            guild_id,
+            f"{AUTOMOD_QUERY} WHERE c.id = (SELECT MAX(id) FROM configs WHERE configs.guild_id = $1)", guild_id
         )
-        self.cached_triggers["automod"][guild_id] = {x["event"]: dict(x) for x in data}
+        self.cached_triggers["automod"][guild_id] = self._cache_automod(data)
 
         data = await conn.fetch(
             """
@@ -181,7 +326,7 @@ class Dispatch(commands.Cog):
 
     async def fire_event_dispatch(
         self,
-        event: dict,
+        event: AutomodTrigger,
         guild: discord.Guild,
         kwargs: Dict[str, Union[str, int, bool]],
         conn: asyncpg.Connection,
@@ -198,12 +343,38 @@ class Dispatch(commands.Cog):
         try:
             await ctx.run_automod(event, conn, None, kwargs, messageable=message and message.channel)
         except parse.ExecutionInterrupt as e:
-            g = guild.get_channel(self.cached_triggers["configs"][guild.id]["error_channel"])
-            if g:  # drop it silently if it got deleted
+            await self.report_errors(guild, [e])
+
+    async def fire_event_dispatch_many(
+        self,
+        event: AutomodTrigger,
+        guild: discord.Guild,
+        events: List[Dict[str, Union[str, int, bool]]],
+        conn: asyncpg.Connection,
+        message: discord.Message = None,
+    ):
+        """
+        Like fire_event_dispatch, for a batch of events of the same kind (see ParsingContext.run_automod_many).
+        """
+        if guild.id in self.ctx_cache:
+            ctx = self.ctx_cache[guild.id]
+        else:
+            ctx = self.ctx_cache[guild.id] = parse.ParsingContext(self.bot, guild)
+
+        ctx.message.set(message)
+        ctx.callerid.set(self.bot.user.id)
+
+        errors = await ctx.run_automod_many(event, conn, events, messageable=message and message.channel)
+        await self.report_errors(guild, errors)
+
+    async def report_errors(self, guild: discord.Guild, errors: List[parse.ExecutionInterrupt]):
+        g = errors and guild.get_channel(self.cached_triggers["configs"][guild.id]["error_channel"])
+        if g:  # drop it silently if it got deleted
+            for chunk in utils.chunk_lines([str(x) for x in errors]):
                 try:
-                    await g.send(str(e))
+                    await g.send(chunk)
                 except discord.HTTPException:
-                    pass
+                    break
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
@@ -212,6 +383,8 @@ class Dispatch(commands.Cog):
 
     @commands.Cog.listener()
     async def on_guild_leave(self, guild: discord.Guild):
+        self.bot.counters.drop_guild(guild.id)
+        self.bot.recent_messages.drop_guild(guild.id)
         async with self.bot.db.acquire() as conn:
             data = await conn.fetch(
                 "SELECT actions FROM events WHERE cfg_id = (SELECT id FROM configs WHERE guild_id = $1)", guild.id
@@ -221,9 +394,49 @@ class Dispatch(commands.Cog):
             """
             await conn.execute(query, guild.id, list(itertools.chain([x["actions"] for x in data])))
 
+    @commands.command("messagecache")
+    @commands.is_owner()
+    async def message_cache_stats(self, ctx):
+        """
+        Shows how well the recent message cache is doing, and what the message writer is holding.
+        """
+        stats = self.bot.recent_messages.stats()
+        writer = self.bot.message_writer
+        await ctx.send(
+            f"Cached: {stats['messages']} messages in {stats['guilds']} guilds, ~{stats['bytes'] / 1024:.1f} KiB\n"
+            f"Hits: {stats['hits']}, misses: {stats['misses']} ({stats['hit_rate']:.1%} hit rate), "
+            f"evictions: {stats['evictions']}\n"
+            f"Writer: {len(writer.pending)} pending, {len(writer.updates)} edits and {len(writer.deletes)} deletes "
+            f"queued, {writer.dropped} dropped, {writer.failed} failed to write"
+        )
+
+    @commands.command("eventqueues")
+    @commands.is_owner()
+    async def event_queue_stats(self, ctx):
+        """
+        Shows how many events are waiting to be handled, how many were shed or ignored, and how long handlers wait on
+        the pool.
+        """
+        stats = self.scheduler.stats()
+        pool = self.bot.pool_stats.as_dict()
+        depth = ", ".join(f"{k}: {v}" for k, v in stats["depth"].items())
+        shed = ", ".join(f"{k}: {v}" for k, v in stats["shed"].items())
+        busiest = ", ".join(f"{guild_id} ({size})" for guild_id, size in stats["busiest"]) or "none"
+        ignored = ", ".join(f"{k}: {v}" for k, v in self.ignored_events.most_common()) or "none"
+        await ctx.send(
+            f"Queued: {stats['queued']} events in {stats['guilds']} guilds ({depth})\n"
+            f"Shed: {shed}\n"
+            f"Ignored by trigger filters: {ignored}\n"
+            f"Handled: {stats['handled']}\n"
+            f"Busiest guilds: {busiest}\n"
+            f"Pool: {pool['acquired']} connections acquired (waited {pool['average_wait'] * 1000:.1f}ms on average, "
+            f"{pool['max_wait'] * 1000:.1f}ms at most), {pool['skipped']} dispatches didn't need one"
+        )
+
     # XXX dispatch firing mechanisms
 
     @commands.Cog.listener()
+    @queued(EventPriority.moderation, lambda guild_id, user_id: guild_id, lambda guild_id, user_id: user_id)
     async def on_mute_complete(self, guild_id: int, user_id: int):
         await self.bot.wait_until_ready()
         await self.filled.wait()
@@ -253,15 +466,16 @@ class Dispatch(commands.Cog):
                     pass
 
         if "unmute" in self.cached_triggers["automod"][guild_id]:
-            vbls = {
-                "userid": user_id,
-                "username": str(member),
-                "usernick": member.nick,
-                "modname": str(self.bot.user),
-                "modid": self.bot.user.id,
-                "reason": "Timed mute expired",
-            }
-            async with self.bot.db.acquire() as conn:
+            vbls = LazyVariables(
+                {
+                    "userid": user_id,
+                    "usernick": member.nick,
+                    "modid": self.bot.user.id,
+                    "reason": "Timed mute expired",
+                },
+                {"username": lambda: str(member), "modname": lambda: str(self.bot.user)},
+            )
+            async with self.bot.lazy_connection() as conn:
                 try:
                     await ctx.run_automod(self.cached_triggers["automod"][guild_id]["unmute"], conn, vbls=vbls)
                 except parse.ExecutionInterrupt as e:
@@ -273,6 +487,7 @@ class Dispatch(commands.Cog):
                             pass
 
     @commands.Cog.listener()
+    @queued(EventPriority.moderation, lambda guild_id, user_id: guild_id, lambda guild_id, user_id: user_id)
     async def on_ban_complete(self, guild_id: int, user_id: int):
         await self.bot.wait_until_ready()
         await self.filled.wait()
@@ -294,14 +509,14 @@ class Dispatch(commands.Cog):
             await ctx.fetch_required_data()
 
             if "unban" in self.cached_triggers["automod"][guild_id]:
-                vbls = {
-                    "userid": user_id,
-                    "usercreatedat": discord.utils.snowflake_time(user_id).isoformat(),
-                    "reason": "Timed ban expired",
-                    "moderatorname": str(self.bot.user),
-                    "moderatorid": self.bot.user.id,
-                }
-                async with self.bot.db.acquire() as conn:
+                vbls = LazyVariables(
+                    {"userid": user_id, "reason": "Timed ban expired", "moderatorid": self.bot.user.id},
+                    {
+                        "usercreatedat": lambda: discord.utils.snowflake_time(user_id).isoformat(),
+                        "moderatorname": lambda: str(self.bot.user),
+                    },
+                )
+                async with self.bot.lazy_connection() as conn:
                     try:
                         await ctx.run_automod(self.cached_triggers["automod"][guild_id]["unban"], conn, vbls=vbls)
                     except parse.ExecutionInterrupt as e:
@@ -320,29 +535,44 @@ class Dispatch(commands.Cog):
             return
 
         await self.filled.wait()
-        if "message" in self.cached_triggers["automod"][message.guild.id]:
-            even = {
-                "content": message.content,
-                "authorid": message.author.id,
-                "authorname": str(message.author),
-                "authornick": message.author.nick,
-                "channelid": message.channel.id,
-                "channelname": message.channel.name,
-                "messageid": message.id,
-                "messagelink": message.jump_url,
-            }
-            async with self.bot.db.acquire() as conn:
-                await conn.execute(
-                    "INSERT INTO messages VALUES ($1, $2, $3, $4, $5, $6)",
-                    message.guild.id,
-                    message.id,
-                    message.author.id,
-                    message.channel.id,
-                    message.content,
-                    [x.proxy_url for x in message.attachments],
-                )
+        config = self.cached_triggers["configs"].get(message.guild.id)
+        if config and config.get("store_messages"):
+            record = [
+                message.guild.id,
+                message.id,
+                message.author.id,
+                message.channel.id,
+                message.content if config["store_content"] else "",
+                [x.proxy_url for x in message.attachments] if config["store_attachments"] else None,
+            ]
+            self.bot.recent_messages.put(record)
+            await self.bot.message_writer.add(record)
+
+        if self.select(message.guild.id, "message", message.channel.id, message.author):
+            self.scheduler.submit(
+                message.guild.id,
+                EventPriority.message,
+                functools.partial(self.dispatch_message, message),
+                message.author.id,
+            )
+
+    async def dispatch_message(self, message: discord.Message):
+        trigger = self.select(message.guild.id, "message", message.channel.id, message.author)
+        if trigger:
+            even = LazyVariables(
+                {
+                    "content": message.content,
+                    "authorid": message.author.id,
+                    "authornick": message.author.nick,
+                    "channelid": message.channel.id,
+                    "channelname": message.channel.name,
+                    "messageid": message.id,
+                },
+                {"authorname": lambda: str(message.author), "messagelink": lambda: message.jump_url},
+            )
+            async with self.bot.lazy_connection() as conn:
                 await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][message.guild.id]["message"],
+                    trigger,
                     message.guild,
                     even,
                     conn=conn,
@@ -350,6 +580,7 @@ class Dispatch(commands.Cog):
                 )
 
     @commands.Cog.listener()
+    @queued(EventPriority.member, lambda payload: payload.guild_id)
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         if not payload.guild_id:
             return
@@ -358,32 +589,43 @@ class Dispatch(commands.Cog):
 
         await self.filled.wait()
         if "message_delete" in self.cached_triggers["automod"][payload.guild_id]:
-            async with self.bot.db.acquire() as conn:
-                data = await conn.fetchrow(
-                    "DELETE FROM messages WHERE guild_id = $1 AND message_id = $2 RETURNING *",
-                    payload.guild_id,
-                    payload.message_id,
-                )
+            if self.message_expired(payload.guild_id, payload.message_id):
+                return
+
+            data = self.bot.recent_messages.pop(payload.guild_id, payload.message_id)
+            if data:
+                self.bot.message_writer.discard(payload.guild_id, payload.message_id)
+
+            async with self.bot.lazy_connection() as conn:
+                if not data:
+                    data = await self.bot.message_writer.pop(payload.guild_id, payload.message_id)
+                if not data:
+                    data = next(iter(await delete_stored(conn, payload.guild_id, [payload.message_id])), None)
+                if not data:
+                    return
+
                 guild = self.bot.get_guild(payload.guild_id)
                 author = guild.get_member(data["author_id"])
+                trigger = self.select(payload.guild_id, "message_delete", data["channel_id"], author)
+                if not trigger:
+                    return
+
                 channel = guild.get_channel(data["channel_id"])
-                even = {
-                    "content": data["content"],
-                    "authorid": data["author_id"],
-                    "authorname": author and str(author),
-                    "authornick": author and author.nick,
-                    "channelid": data["channel_id"],
-                    "channelname": channel and channel.name,
-                    "messageid": data["message_id"],
-                }
-                await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][payload.guild_id]["message_delete"],
-                    self.bot.get_guild(payload.guild_id),
-                    even,
-                    conn=conn,
+                even = LazyVariables(
+                    {
+                        "content": data["content"],
+                        "authorid": data["author_id"],
+                        "authornick": author and author.nick,
+                        "channelid": data["channel_id"],
+                        "channelname": channel and channel.name,
+                        "messageid": data["message_id"],
+                    },
+                    {"authorname": lambda: author and str(author)},
                 )
+                await self.fire_event_dispatch(trigger, guild, even, conn=conn)
 
     @commands.Cog.listener()
+    @queued(EventPriority.member, lambda payload: payload.guild_id)
     async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
         if not payload.guild_id:
             return
@@ -391,31 +633,54 @@ class Dispatch(commands.Cog):
             return
 
         await self.filled.wait()
-        if "message_edit" in self.cached_triggers["automod"][payload.guild_id]:
-            async with self.bot.db.acquire() as conn:
-                data = await conn.fetch(
-                    "DELETE FROM messages WHERE guild_id = $1 AND message_id = ANY($2) RETURNING *",
-                    payload.guild_id,
-                    payload.message_ids,
-                )
-                for x in data:
-                    guild = self.bot.get_guild(payload.guild_id)
+        if "message_delete" in self.cached_triggers["automod"][payload.guild_id]:
+            async with self.bot.lazy_connection() as conn:
+                data = []
+                message_ids = {x for x in payload.message_ids if not self.message_expired(payload.guild_id, x)}
+                for message_id in message_ids:
+                    record = self.bot.recent_messages.pop(payload.guild_id, message_id)
+                    if record:
+                        self.bot.message_writer.discard(payload.guild_id, message_id)
+                    else:
+                        record = await self.bot.message_writer.pop(payload.guild_id, message_id)
+
+                    if record:
+                        data.append(record)
+
+                data += await delete_stored(conn, payload.guild_id, list(message_ids - {x["message_id"] for x in data}))
+                if not data:
+                    return
+
+                guild = self.bot.get_guild(payload.guild_id)
+                # authors can have different roles, so different messages can be ignored by different rules
+                batches: Dict[tuple, Tuple[AutomodTrigger, List[dict]]] = {}
+                for x in sorted(data, key=lambda x: x["message_id"]):
                     author = guild.get_member(x["author_id"])
+                    trigger = self.select(payload.guild_id, "message_delete", x["channel_id"], author)
+                    if not trigger:
+                        continue
+
                     channel = guild.get_channel(x["channel_id"])
-                    even = {
-                        "content": x["content"],
-                        "authorid": x["author_id"],
-                        "authorname": author and str(author),
-                        "authornick": author and author.nick,
-                        "channelid": x["channel_id"],
-                        "channelname": channel and channel.name,
-                        "messageid": x["message_id"],
-                    }
-                    await self.fire_event_dispatch(
-                        self.cached_triggers["automod"][payload.guild_id]["message_delete"], guild, even, conn=conn
+                    _, events = batches.setdefault(tuple(r["id"] for r in trigger.rules), (trigger, []))
+                    events.append(
+                        LazyVariables(
+                            {
+                                "content": x["content"],
+                                "authorid": x["author_id"],
+                                "authornick": author and author.nick,
+                                "channelid": x["channel_id"],
+                                "channelname": channel and channel.name,
+                                "messageid": x["message_id"],
+                            },
+                            {"authorname": lambda author=author: author and str(author)},
+                        )
                     )
 
+                for trigger, events in batches.values():
+                    await self.fire_event_dispatch_many(trigger, guild, events, conn)
+
     @commands.Cog.listener()
+    @queued(EventPriority.member, lambda payload: payload.guild_id)
     async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
         if not payload.guild_id:
             return
@@ -430,40 +695,63 @@ class Dispatch(commands.Cog):
             return
 
         if "message_edit" in self.cached_triggers["automod"][payload.guild_id]:
-            async with self.bot.db.acquire() as conn:
-                data = await conn.fetchrow(
-                    "SELECT * FROM messages WHERE guild_id = $1 AND message_id = $2",
-                    payload.guild_id,
-                    payload.message_id,
-                )
+            if self.message_expired(payload.guild_id, payload.message_id):
+                return
+
+            config = self.cached_triggers["configs"][payload.guild_id]
+            content = payload.data["content"] if config.get("store_content", True) else ""
+            data = self.bot.recent_messages.get(payload.guild_id, payload.message_id)
+            if data:
+                self.bot.recent_messages.update(payload.guild_id, payload.message_id, content)
+                self.bot.message_writer.update(payload.guild_id, payload.message_id, content)
+
+            async with self.bot.lazy_connection() as conn:
                 if not data:
-                    return
+                    data = await self.bot.message_writer.get(payload.guild_id, payload.message_id)
+                    if data:
+                        self.bot.message_writer.update(payload.guild_id, payload.message_id, content)
 
-                await conn.execute(
-                    "UPDATE messages SET content = $1 WHERE guild_id = $1 AND message_id = $2",
-                    payload.data["content"],
-                    payload.guild_id,
-                    payload.message_id,
-                )
+                if not data:
+                    data = await update_stored(
+                        conn,
+                        payload.guild_id,
+                        payload.message_id,
+                        content,
+                        self.bot.message_writer.compress_threshold,
+                    )
+                    if not data:
+                        return
 
                 guild = self.bot.get_guild(payload.guild_id)
                 author = guild.get_member(data["author_id"])
+                trigger = self.select(payload.guild_id, "message_edit", data["channel_id"], author)
+                if not trigger:
+                    return
+
                 channel = guild.get_channel(data["channel_id"])
-                even = {
-                    "content": payload.data["content"],
-                    "prev-content": data["content"],
-                    "authorid": data["author_id"],
-                    "authorname": str(author),
-                    "authornick": author.nick,
-                    "channelid": data["channel_id"],
-                    "channelname": channel.name,
-                    "messageid": data["message_id"],
-                }
-                await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][payload.guild_id]["message_edit"], guild, even, conn=conn
+                even = LazyVariables(
+                    {
+                        "content": payload.data["content"],
+                        "prev-content": data["content"],
+                        "authorid": data["author_id"],
+                        "authornick": author.nick,
+                        "channelid": data["channel_id"],
+                        "channelname": channel.name,
+                        "messageid": data["message_id"],
+                    },
+                    {"authorname": lambda: str(author)},
                 )
+                await self.fire_event_dispatch(trigger, guild, even, conn=conn)
 
     @commands.Cog.listener()
+    @queued(
+        EventPriority.member,
+        lambda payload: payload.guild_id,
+        lambda payload: payload.user_id,
+        prefilter=lambda self, payload: self.ignored(
+            payload.guild_id, "reaction_add", payload.channel_id, payload.member, payload.emoji
+        ),
+    )
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         if not payload.guild_id:
             return
@@ -472,22 +760,31 @@ class Dispatch(commands.Cog):
 
         await self.filled.wait()
 
-        if "reaction_add" in self.cached_triggers["automod"][payload.guild_id]:
+        trigger = self.select(payload.guild_id, "reaction_add", payload.channel_id, payload.member, payload.emoji)
+        if trigger:
             even = {
                 "messageid": payload.message_id,
                 "channelid": payload.channel_id,
                 "userid": payload.user_id,
                 "reaction": payload.emoji.name,
             }
-            async with self.bot.db.acquire() as conn:
+            async with self.bot.lazy_connection() as conn:
                 await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][payload.guild_id]["reaction_add"],
+                    trigger,
                     self.bot.get_guild(payload.guild_id),
                     even,
                     conn=conn,
                 )
 
     @commands.Cog.listener()
+    @queued(
+        EventPriority.member,
+        lambda payload: payload.guild_id,
+        lambda payload: payload.user_id,
+        prefilter=lambda self, payload: self.ignored(
+            payload.guild_id, "reaction_remove", payload.channel_id, emoji=payload.emoji
+        ),
+    )
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
         if not payload.guild_id:
             return
@@ -496,22 +793,28 @@ class Dispatch(commands.Cog):
 
         await self.filled.wait()
 
-        if "reaction_remove" in self.cached_triggers["automod"][payload.guild_id]:
+        trigger = self.select(payload.guild_id, "reaction_remove", payload.channel_id, emoji=payload.emoji)
+        if trigger:
             even = {
                 "messageid": payload.message_id,
                 "channelid": payload.channel_id,
                 "userid": payload.user_id,
                 "reaction": payload.emoji.name,
             }
-            async with self.bot.db.acquire() as conn:
+            async with self.bot.lazy_connection() as conn:
                 await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][payload.guild_id]["reaction_remove"],
+                    trigger,
                     self.bot.get_guild(payload.guild_id),
                     even,
                     conn=conn,
                 )
 
     @commands.Cog.listener()
+    @queued(
+        EventPriority.member,
+        lambda payload: payload.guild_id,
+        prefilter=lambda self, payload: self.ignored(payload.guild_id, "reaction_all_remove", payload.channel_id),
+    )
     async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent):
         if not payload.guild_id:
             return
@@ -520,17 +823,25 @@ class Dispatch(commands.Cog):
 
         await self.filled.wait()
 
-        if "reaction_all_remove" in self.cached_triggers["automod"][payload.guild_id]:
+        trigger = self.select(payload.guild_id, "reaction_all_remove", payload.channel_id)
+        if trigger:
             even = {"messageid": payload.message_id, "channelid": payload.channel_id, "reaction": None}
-            async with self.bot.db.acquire() as conn:
+            async with self.bot.lazy_connection() as conn:
                 await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][payload.guild_id]["reaction_all_remove"],
+                    trigger,
                     self.bot.get_guild(payload.guild_id),
                     even,
                     conn=conn,
                 )
 
     @commands.Cog.listener()
+    @queued(
+        EventPriority.member,
+        lambda payload: payload.guild_id,
+        prefilter=lambda self, payload: self.ignored(
+            payload.guild_id, "reaction_all_remove", payload.channel_id, emoji=payload.emoji
+        ),
+    )
     async def on_raw_reaction_emoji_clear(self, payload: discord.RawReactionClearEmojiEvent):
         if not payload.guild_id:
             return
@@ -539,50 +850,60 @@ class Dispatch(commands.Cog):
 
         await self.filled.wait()
 
-        if "reaction_all_remove" in self.cached_triggers["automod"][payload.guild_id]:
+        trigger = self.select(payload.guild_id, "reaction_all_remove", payload.channel_id, emoji=payload.emoji)
+        if trigger:
             even = {"messageid": payload.message_id, "channelid": payload.channel_id, "reaction": payload.emoji.name}
-            async with self.bot.db.acquire() as conn:
+            async with self.bot.lazy_connection() as conn:
                 await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][payload.guild_id]["reaction_all_remove"],
+                    trigger,
                     self.bot.get_guild(payload.guild_id),
                     even,
                     conn=conn,
                 )
 
     @commands.Cog.listener()
+    @queued(
+        EventPriority.member,
+        lambda member: member.guild.id,
+        lambda member: member.id,
+        prefilter=lambda self, member: self.ignored(member.guild.id, "user_join", author=member),
+    )
     async def on_member_join(self, member: discord.Member):
         await self.filled.wait()
         if member.guild.id not in self.cached_triggers["automod"]:
             return
 
-        if "user_join" in self.cached_triggers["automod"][member.guild.id]:
-            even = {
-                "userid": member.id,
-                "username": str(member),
-                "userisbot": member.bot,
-                "useravatar": member.avatar.with_format("gif").url
-                if member.avatar.is_animated()
-                else member.avatar.with_format("png").url,
-                "usergatepending": member.pending,
-                "userstatus": member.status.name,  # noqa
-                "usercreatedat": member.created_at,
-                "usernick": member.nick,
-            }
-            async with self.bot.db.acquire() as conn:
-                await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][member.guild.id]["user_join"], member.guild, even, conn=conn
-                )
+        trigger = self.select(member.guild.id, "user_join", author=member)
+        if trigger:
+            even = LazyVariables(
+                {
+                    "userid": member.id,
+                    "userisbot": member.bot,
+                    "usergatepending": member.pending,
+                    "userstatus": member.status.name,  # noqa
+                    "usernick": member.nick,
+                },
+                {
+                    "username": lambda: str(member),
+                    "useravatar": lambda: avatar_url(member),
+                    "usercreatedat": lambda: member.created_at,
+                },
+            )
+            async with self.bot.lazy_connection() as conn:
+                await self.fire_event_dispatch(trigger, member.guild, even, conn=conn)
 
     @commands.Cog.listener()
+    @queued(EventPriority.moderation, lambda member: member.guild.id, lambda member: member.id)
     async def on_member_remove(self, member: discord.Member):
         await self.filled.wait()
         if member.guild.id not in self.cached_triggers["automod"]:
             return
 
-        await asyncio.sleep(0.5)  # so that other handlers fetch from recent events before we pop it off
-        # also cause im too lazy to do any semaphores lol
+        async with self.scheduler.waiting():
+            await asyncio.sleep(0.5)  # so that other handlers fetch from recent events before we pop it off
+            # also cause im too lazy to do any semaphores lol
 
-        async with self.bot.db.acquire() as conn:
+        async with self.bot.lazy_connection() as conn:
             recent = self.recent_events.maybe_pop((member.guild.id, member.id, "ban"))
             if recent:
                 return
@@ -591,16 +912,8 @@ class Dispatch(commands.Cog):
 
             if recent:
                 user, moderator, reason, link = recent
-                query = """
-                INSERT INTO
-                    cases
-                    (guild_id, id, user_id, mod_id, action, reason, link)
-                VALUES
-                    ($1, (SELECT COUNT(*) + 1 FROM cases WHERE guild_id = $1), $2, $3, $4, $5, $6)
-                RETURNING id
-                """
-                resp = await conn.fetchval(
-                    query,
+                resp = await create_case(
+                    conn,
                     member.guild.id,
                     member.id,
                     (moderator and moderator.id) or self.bot.user.id,
@@ -609,38 +922,41 @@ class Dispatch(commands.Cog):
                     link,
                 )
                 if "case" in self.cached_triggers["automod"][member.guild.id]:
-                    cont = {
-                        "caseid": resp,
-                        "casereason": reason,
-                        "caseaction": "kick",
-                        "casemodid": moderator.id,
-                        "casemodname": str(moderator),
-                        "caseuserid": member.id,
-                        "caseusername": str(member),
-                    }
+                    cont = LazyVariables(
+                        {
+                            "caseid": resp,
+                            "casereason": reason,
+                            "caseaction": "kick",
+                            "casemodid": (moderator and moderator.id) or self.bot.user.id,
+                            "caseuserid": member.id,
+                        },
+                        {"casemodname": lambda: str(moderator or self.bot.user), "caseusername": lambda: str(member)},
+                    )
                     await self.fire_event_dispatch(
                         self.cached_triggers["automod"][member.guild.id]["case"], member.guild, cont, conn
                     )
 
                 return
 
-            if "user_leave" in self.cached_triggers["automod"][member.guild.id]:
-                even = {
-                    "userid": member.id,
-                    "username": str(member),
-                    "userisbot": member.bot,
-                    "useravatar": member.avatar.with_format("gif").url
-                    if member.avatar.is_animated()
-                    else member.avatar.with_format("png").url,
-                    "usergatepending": member.pending,
-                    "usercreatedat": member.created_at,
-                    "usernick": member.nick,
-                }
-                await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][member.guild.id]["user_leave"], member.guild, even, conn=conn
+            trigger = self.select(member.guild.id, "user_leave", author=member)
+            if trigger:
+                even = LazyVariables(
+                    {
+                        "userid": member.id,
+                        "userisbot": member.bot,
+                        "usergatepending": member.pending,
+                        "usernick": member.nick,
+                    },
+                    {
+                        "username": lambda: str(member),
+                        "useravatar": lambda: avatar_url(member),
+                        "usercreatedat": lambda: member.created_at,
+                    },
                 )
+                await self.fire_event_dispatch(trigger, member.guild, even, conn=conn)
 
     @commands.Cog.listener()
+    @queued(EventPriority.member, lambda before, after: after.guild.id, lambda before, after: after.id)
     async def on_member_update(self, before: discord.Member, after: discord.Member):
         await self.filled.wait()
 
@@ -650,40 +966,30 @@ class Dispatch(commands.Cog):
         ctx = await self.get_context(after.guild.id)
         guild = after.guild
 
-        if "user_update" in self.cached_triggers["automod"][before.guild.id]:
-            even = {
-                "userid": before.id,
-                "usercreatedat": before.created_at,
-                "userisbot": before.bot,
-                "busername": str(before),
-                "ausername": str(after),
-                "buseravatar": before.avatar.with_format("gif").url
-                if before.avatar.is_animated()
-                else before.avatar.with_format("png").url,
-                "auseravatar": after.avatar.with_format("gif").url
-                if after.avatar.is_animated()
-                else after.avatar.with_format("png").url,
-                "busergatepending": before.pending,
-                "ausergatepending": after.pending,
-                "busernick": before.nick,
-                "ausernick": after.nick,
-            }
-            async with self.bot.db.acquire() as conn:
-                await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][before.guild.id]["user_leave"], before.guild, even, conn=conn
-                )
+        trigger = self.select(after.guild.id, "user_update", author=after)
+        if trigger:
+            even = LazyVariables(
+                {
+                    "userid": before.id,
+                    "userisbot": before.bot,
+                    "busergatepending": before.pending,
+                    "ausergatepending": after.pending,
+                    "busernick": before.nick,
+                    "ausernick": after.nick,
+                },
+                {
+                    "usercreatedat": lambda: before.created_at,
+                    "busername": lambda: str(before),
+                    "ausername": lambda: str(after),
+                    "buseravatar": lambda: avatar_url(before),
+                    "auseravatar": lambda: avatar_url(after),
+                },
+            )
+            async with self.bot.lazy_connection() as conn:
+                await self.fire_event_dispatch(trigger, before.guild, even, conn=conn)
 
         if ctx.mute_role and after._roles.has(ctx.mute_role) and not before._roles.has(ctx.mute_role):  # noqa
             # create a case for it and dispatch mute events
-            query = """
-            INSERT INTO
-                cases
-                (guild_id, id, user_id, mod_id, action, reason, link)
-            VALUES
-                ($1, (SELECT COUNT(*) + 1 FROM cases WHERE guild_id = $1), $2, $3, $4, $5, $6)
-            RETURNING id
-            """
-
             recent = self.recent_events.maybe_pop((after.guild.id, after.id, "mute"))
             reason = "<Mute not found>"
             link = None
@@ -697,21 +1003,22 @@ class Dispatch(commands.Cog):
                 dt = recent[3]
 
             elif guild.me.guild_permissions.view_audit_log:
-                await asyncio.sleep(0.5)
-                async for upd in guild.audit_logs(
-                    action=discord.AuditLogAction.member_role_update
-                ):  # type: discord.AuditLogEntry
-                    if upd.target == after:
-                        reason = upd.reason or "No reason provided"
-                        moderator = upd.user
-                        break
-
-                else:
-                    reason = "<Mute not found>"
-
-            async with self.bot.db.acquire() as conn:
-                resp = await conn.fetchval(
-                    query,
+                async with self.scheduler.waiting():
+                    await asyncio.sleep(0.5)
+                    async for upd in guild.audit_logs(
+                        action=discord.AuditLogAction.member_role_update
+                    ):  # type: discord.AuditLogEntry
+                        if upd.target == after:
+                            reason = upd.reason or "No reason provided"
+                            moderator = upd.user
+                            break
+
+                    else:
+                        reason = "<Mute not found>"
+
+            async with self.bot.lazy_connection() as conn:
+                resp = await create_case(
+                    conn,
                     ctx.guild.id,
                     after.id,
                     (moderator and moderator.id) or self.bot.user.id,
@@ -720,30 +1027,22 @@ class Dispatch(commands.Cog):
                     link,
                 )
                 if "case" in self.cached_triggers["automod"][ctx.guild.id]:
-                    cont = {
-                        "caseid": resp,
-                        "casereason": reason,
-                        "caseaction": "tempmute" if dt else "mute",
-                        "casemodid": moderator.id,
-                        "casemodname": str(moderator),
-                        "caseuserid": after.id,
-                        "caseusername": str(after),
-                    }
+                    cont = LazyVariables(
+                        {
+                            "caseid": resp,
+                            "casereason": reason,
+                            "caseaction": "tempmute" if dt else "mute",
+                            "casemodid": (moderator and moderator.id) or self.bot.user.id,
+                            "caseuserid": after.id,
+                        },
+                        {"casemodname": lambda: str(moderator or self.bot.user), "caseusername": lambda: str(after)},
+                    )
                     await self.fire_event_dispatch(
                         self.cached_triggers["automod"][ctx.guild.id]["case"], ctx.guild, cont, conn
                     )
 
         elif ctx.mute_role and before._roles.has(ctx.mute_role) and not after._roles.has(ctx.mute_role):  # noqa
             # create a case for it and dispatch mute events
-            query = """
-            INSERT INTO
-                cases
-                (guild_id, id, user_id, mod_id, action, reason, link)
-            VALUES
-                ($1, (SELECT COUNT(*) + 1 FROM cases WHERE guild_id = $1), $2, $3, $4, $5, $6)
-            RETURNING id
-            """
-
             recent = self.recent_events.maybe_pop((after.guild.id, after.id, "unmute"))
             reason = "<Unmute not found>"
             link = moderator = None
@@ -752,21 +1051,22 @@ class Dispatch(commands.Cog):
                 reason, moderator, link = recent
 
             elif guild.me.guild_permissions.view_audit_log:
-                await asyncio.sleep(0.5)
-                async for upd in guild.audit_logs(
-                    action=discord.AuditLogAction.member_role_update
-                ):  # type: discord.AuditLogEntry
-                    if upd.target == after:
-                        reason = upd.reason or "No reason provided"
-                        moderator = upd.user
-                        break
-
-                else:
-                    reason = "<Unmute not found>"
-
-            async with self.bot.db.acquire() as conn:
-                resp = await conn.fetchval(
-                    query,
+                async with self.scheduler.waiting():
+                    await asyncio.sleep(0.5)
+                    async for upd in guild.audit_logs(
+                        action=discord.AuditLogAction.member_role_update
+                    ):  # type: discord.AuditLogEntry
+                        if upd.target == after:
+                            reason = upd.reason or "No reason provided"
+                            moderator = upd.user
+                            break
+
+                    else:
+                        reason = "<Unmute not found>"
+
+            async with self.bot.lazy_connection() as conn:
+                resp = await create_case(
+                    conn,
                     ctx.guild.id,
                     after.id,
                     (moderator and moderator.id) or self.bot.user.id,
@@ -775,20 +1075,22 @@ class Dispatch(commands.Cog):
                     link,
                 )
                 if "case" in self.cached_triggers["automod"][ctx.guild.id]:
-                    cont = {
-                        "caseid": resp,
-                        "casereason": reason,
-                        "caseaction": "unmute",
-                        "casemodid": moderator.id,
-                        "casemodname": str(moderator),
-                        "caseuserid": after.id,
-                        "caseusername": str(after),
-                    }
+                    cont = LazyVariables(
+                        {
+                            "caseid": resp,
+                            "casereason": reason,
+                            "caseaction": "unmute",
+                            "casemodid": (moderator and moderator.id) or self.bot.user.id,
+                            "caseuserid": after.id,
+                        },
+                        {"casemodname": lambda: str(moderator or self.bot.user), "caseusername": lambda: str(after)},
+                    )
                     await self.fire_event_dispatch(
                         self.cached_triggers["automod"][ctx.guild.id]["case"], ctx.guild, cont, conn
                     )
 
     @commands.Cog.listener()
+    @queued(EventPriority.moderation, lambda guild, user: guild.id, lambda guild, user: user.id)
     async def on_member_ban(self, guild: discord.Guild, user: discord.User):
         await self.filled.wait()
         if guild.id not in self.cached_triggers["automod"]:
@@ -801,62 +1103,68 @@ class Dispatch(commands.Cog):
 
         else:
             self.recent_events[(guild.id, user.id, "ban")] = None  # set this for the member_remove handler
-            await asyncio.sleep(0.5)
+            async with self.scheduler.waiting():
+                await asyncio.sleep(0.5)
+
+                if guild.me.guild_permissions.view_audit_log:
+                    async for ban in guild.audit_logs(action=discord.AuditLogAction.ban):  # type: discord.AuditLogEntry
+                        if ban.target == user:
+                            reason = ban.reason or "No reason provided"
+                            moderator = ban.user
 
-            if guild.me.guild_permissions.view_audit_log:
-                async for ban in guild.audit_logs(action=discord.AuditLogAction.ban):  # type: discord.AuditLogEntry
-                    if ban.target == user:
-                        reason = ban.reason or "No reason provided"
-                        moderator = ban.user
+                            break
 
-                        break
+                    else:
+                        reason = "<Ban not found>"
+                        moderator = None
 
                 else:
-                    reason = "<Ban not found>"
+                    reason = "<Cannot see audit logs>"
                     moderator = None
 
-            else:
-                reason = "<Cannot see audit logs>"
-                moderator = None
-
-        async with self.bot.db.acquire() as conn:
-            if "ban" in self.cached_triggers["automod"][guild.id]:
-                even = {
-                    "userid": user.id,
-                    "usercreatedat": user.created_at,
-                    "userisbot": user.bot,
-                    "username": str(user),
-                    "useravatar": user.avatar.with_format("gif").url
-                    if user.avatar.is_animated()
-                    else user.avatar.with_format("png").url,
-                    "reason": reason,
-                    "moderator": str(moderator) if moderator else str(self.bot.user),
-                    "moderatorid": moderator.id if moderator else self.bot.user.id,
-                }
-                await self.fire_event_dispatch(self.cached_triggers["automod"][guild.id]["ban"], guild, even, conn=conn)
-
-            query = """
-            INSERT INTO
-                cases
-                (guild_id, id, user_id, mod_id, action, reason, link)
-            VALUES 
-                ($1, (SELECT COUNT(*) + 1 FROM cases WHERE guild_id = $1), $2, $3, $4, $5, $6)
-            RETURNING id
-            """
-            resp = await conn.fetchval(query, guild.id, user.id, moderator.id, "tempban" if dt else "ban", reason, link)
+        async with self.bot.lazy_connection() as conn:
+            trigger = self.select(guild.id, "ban", author=user)
+            if trigger:
+                even = LazyVariables(
+                    {
+                        "userid": user.id,
+                        "userisbot": user.bot,
+                        "reason": reason,
+                        "moderatorid": moderator.id if moderator else self.bot.user.id,
+                    },
+                    {
+                        "usercreatedat": lambda: user.created_at,
+                        "username": lambda: str(user),
+                        "useravatar": lambda: avatar_url(user),
+                        "moderator": lambda: str(moderator or self.bot.user),
+                    },
+                )
+                await self.fire_event_dispatch(trigger, guild, even, conn=conn)
+
+            resp = await create_case(
+                conn,
+                guild.id,
+                user.id,
+                (moderator and moderator.id) or self.bot.user.id,
+                "tempban" if dt else "ban",
+                reason,
+                link,
+            )
             if "case" in self.cached_triggers["automod"][guild.id]:
-                cont = {
-                    "caseid": resp,
-                    "casereason": reason,
-                    "caseaction": "tempban" if dt else "ban",
-                    "casemodid": moderator.id,
-                    "casemodname": str(moderator),
-                    "caseuserid": user.id,
-                    "caseusername": str(user),
-                }
+                cont = LazyVariables(
+                    {
+                        "caseid": resp,
+                        "casereason": reason,
+                        "caseaction": "tempban" if dt else "ban",
+                        "casemodid": (moderator and moderator.id) or self.bot.user.id,
+                        "caseuserid": user.id,
+                    },
+                    {"casemodname": lambda: str(moderator or self.bot.user), "caseusername": lambda: str(user)},
+                )
                 await self.fire_event_dispatch(self.cached_triggers["automod"][guild.id]["case"], guild, cont, conn)
 
     @commands.Cog.listener()
+    @queued(EventPriority.moderation, lambda guild, user: guild.id, lambda guild, user: user.id)
     async def on_member_unban(self, guild: discord.Guild, user: discord.User):
         await self.filled.wait()
         if guild.id not in self.cached_triggers["automod"]:
@@ -869,59 +1177,58 @@ class Dispatch(commands.Cog):
             target, moderator, reason, link = recent
 
         else:
-            await asyncio.sleep(0.5)
+            async with self.scheduler.waiting():
+                await asyncio.sleep(0.5)
 
-            if guild.me.guild_permissions.view_audit_log:
-                async for ban in guild.audit_logs(action=discord.AuditLogAction.unban):  # type: discord.AuditLogEntry
-                    if ban.target == user:
-                        reason = ban.reason or "No reason provided"
-                        moderator = ban.user
+                if guild.me.guild_permissions.view_audit_log:
+                    async for ban in guild.audit_logs(
+                        action=discord.AuditLogAction.unban
+                    ):  # type: discord.AuditLogEntry
+                        if ban.target == user:
+                            reason = ban.reason or "No reason provided"
+                            moderator = ban.user
 
-                        break
+                            break
+
+                    else:
+                        reason = "<Unban not found>"
+                        moderator = None
 
                 else:
-                    reason = "<Unban not found>"
+                    reason = "<Cannot see audit logs>"
                     moderator = None
 
-            else:
-                reason = "<Cannot see audit logs>"
-                moderator = None
-
-        async with self.bot.db.acquire() as conn:
-            if "unban" in self.cached_triggers["automod"][guild.id]:
-                even = {
-                    "userid": user.id,
-                    "usercreatedat": user.created_at,
-                    "userisbot": user.bot,
-                    "username": str(user),
-                    "useravatar": user.avatar.with_format("gif").url
-                    if user.avatar.is_animated()
-                    else user.avatar.with_format("png").url,
-                    "reason": reason,
-                    "moderator": str(moderator) if moderator else str(self.bot.user),
-                    "moderatorid": moderator.id if moderator else self.bot.user.id,
-                }
-                await self.fire_event_dispatch(
-                    self.cached_triggers["automod"][guild.id]["unban"], guild, even, conn=conn
+        async with self.bot.lazy_connection() as conn:
+            trigger = self.select(guild.id, "unban", author=user)
+            if trigger:
+                even = LazyVariables(
+                    {
+                        "userid": user.id,
+                        "userisbot": user.bot,
+                        "reason": reason,
+                        "moderatorid": moderator.id if moderator else self.bot.user.id,
+                    },
+                    {
+                        "usercreatedat": lambda: user.created_at,
+                        "username": lambda: str(user),
+                        "useravatar": lambda: avatar_url(user),
+                        "moderator": lambda: str(moderator or self.bot.user),
+                    },
                 )
+                await self.fire_event_dispatch(trigger, guild, even, conn=conn)
 
-            query = """
-            INSERT INTO
-                cases
-                (guild_id, id, user_id, mod_id, action, reason, link)
-            VALUES 
-                ($1, (SELECT COUNT(*) + 1 FROM cases WHERE guild_id = $1), $2, $3, $4, $5, $6)
-            RETURNING id
-            """
-            resp = await conn.fetchval(query, guild.id, user.id, moderator.id, "unban", reason, link)
+            resp = await create_case(
+                conn, guild.id, user.id, (moderator and moderator.id) or self.bot.user.id, "unban", reason, link
+            )
             if "case" in self.cached_triggers["automod"][guild.id]:
-                cont = {
-                    "caseid": resp,
-                    "casereason": reason,
-                    "caseaction": "unban",
-                    "casemodid": moderator.id,
-                    "casemodname": str(moderator),
-                    "caseuserid": user.id,
-                    "caseusername": str(user),
-                }
+                cont = LazyVariables(
+                    {
+                        "caseid": resp,
+                        "casereason": reason,
+                        "caseaction": "unban",
+                        "casemodid": (moderator and moderator.id) or self.bot.user.id,
+                        "caseuserid": user.id,
+                    },
+                    {"casemodname": lambda: str(moderator or self.bot.user), "caseusername": lambda: str(user)},
+                )
                 await self.fire_event_dispatch(self.cached_triggers["automod"][guild.id]["case"], guild, cont, conn)
@@ -9,6 +9,7 @@ from discord.ext import commands
 from discord.ext.commands import converter
 
 from core import helping, time
+from core.cases import create_case
 from core.context import Context
 from core.converters import RegexConverter
 from core.parse import ParsingContext
@@ -115,16 +116,8 @@ class Moderation(commands.Cog):
         if not users:
             return await ctx.reply("Please pass one or more users", mention_author=False)
 
-        query = """
-        INSERT INTO
-            cases
-            (guild_id, id, user_id, mod_id, action, reason, link)
-        VALUES 
-            ($1, (SELECT COUNT(*) + 1 FROM cases WHERE guild_id = $1), $2, $3, $4, $5, $6)
-        RETURNING id
-        """
-
         async with self.bot.db.acquire() as conn:
+            # one user at a time, so that each warn event sees the cases of the users before it
             for user in users:
                 context = {
                     "username": str(user),
@@ -135,8 +128,8 @@ class Moderation(commands.Cog):
                 }
                 await self.dispatch_automod(ctx, "warn", conn, context)
 
-                resp = await conn.fetchval(
-                    query, ctx.guild.id, user.id, ctx.author.id, "warn", reason, ctx.message.jump_url
+                resp = await create_case(
+                    conn, ctx.guild.id, user.id, ctx.author.id, "warn", reason, ctx.message.jump_url
                 )
                 context = {
                     "caseid": resp,
@@ -6,6 +6,9 @@ import discord
 import ujson
 from discord.ext import commands, tasks
 from core.bot import Bot
+from core.models import DEFAULT_MESSAGE_RETENTION
+
+MESSAGE_PARTITIONS_AHEAD = 3  # days
 
 
 async def setup(bot):
@@ -31,10 +34,12 @@ class Timers(commands.Cog):
         self.processor = bot.loop.create_task(self.process_tasks())
         self.current_task: Optional[CurrentTask] = None
 
-        self.run_decay.start()
+        self.compact_counters.start()
+        self.maintain_message_partitions.start()
 
     def cog_unload(self):
-        self.run_decay.stop()
+        self.compact_counters.stop()
+        self.maintain_message_partitions.stop()
 
     async def pull_next_task(self) -> asyncpg.Record:
         await self.bot.wait_until_ready()
@@ -84,33 +89,111 @@ class Timers(commands.Cog):
         if not data:
             return None
 
-        if self.current_task and data["id"] == self.current_task.id:
-            self.current_task = None
-            self.processor.cancel()
-            self.processor = self.bot.loop.create_task(self.process_tasks())
-
+        self.reschedule(cancelled_id=data["id"])
         return data
 
-    # this handles the counter decays
-
-    @tasks.loop(seconds=5)
-    async def run_decay(self):
-        query = """
-        UPDATE counter_values
-        SET
-            val = CASE 
-                WHEN val - (SELECT decay_rate FROM counters WHERE counters.id = counter_values.counter_id) > 0
-                THEN val - (SELECT decay_rate FROM counters WHERE counters.id = counter_values.counter_id)
-                ELSE 0
-            END,
-            last_decay = (NOW() AT TIME ZONE 'utc')
-        WHERE
-            last_decay IS NOT NULL AND
-            last_decay <= (NOW() AT TIME ZONE 'utc') AND
-            (SELECT decay_per FROM counters WHERE counters.id = counter_values.counter_id) IS NOT NULL
+    def reschedule(self, dispatch_at: datetime.datetime = None, cancelled_id: int = None):
         """
+        Brings the task processor up to date with tasks that were added or removed without going through
+        schedule_task or cancel_task (such as in a write that was batched with others).
+        """
+        if self.current_task and cancelled_id == self.current_task.id:
+            self.current_task = None
+
+        elif not dispatch_at or (self.current_task and dispatch_at >= self.current_task.dispatch_at):
+            return
+
+        self.processor.cancel()
+        self.processor = self.bot.loop.create_task(self.process_tasks())
+
+    # counters decay when they're read (see core.counters), this just catches up the rows that nobody has touched
+    # in a while, and clears out per-user values that have decayed back to where they started
+
+    @tasks.loop(hours=1)
+    async def compact_counters(self):
+        now = "(NOW() AT TIME ZONE 'utc')"
+        ticks = f"FLOOR(EXTRACT(EPOCH FROM {now} - counter_values.last_decay) / counters.decay_per)::BIGINT"
+        async with self.bot.db.acquire() as conn:
+            await conn.execute(
+                f"""
+                UPDATE counter_values
+                SET
+                    val = GREATEST(counter_values.val - counters.decay_rate * {ticks}, 0),
+                    last_decay = counter_values.last_decay + MAKE_INTERVAL(secs => counters.decay_per * {ticks})
+                FROM counters
+                WHERE
+                    counters.id = counter_values.counter_id AND
+                    counters.decay_per IS NOT NULL AND
+                    counters.decay_rate IS NOT NULL AND
+                    counter_values.val > 0 AND
+                    counter_values.last_decay <= {now} - MAKE_INTERVAL(secs => counters.decay_per)
+                """
+            )
+            await conn.execute(
+                """
+                DELETE FROM counter_values
+                USING counters
+                WHERE
+                    counters.id = counter_values.counter_id AND
+                    counter_values.user_id IS NOT NULL AND
+                    counters.decay_per IS NOT NULL AND
+                    counter_values.val = COALESCE(counters.start, 0)
+                """
+            )
+
+        # the engine's copies stay correct on their own, this only keeps it from holding every value ever read
+        await self.bot.counters.forget_clean()
+
+    # messages is partitioned by day (see migrations/0004_partition_messages.sql). this keeps a few days of partitions
+    # ready ahead of time, and drops the ones that are past every guild's retention. retention shorter than that is
+    # enforced when the messages are read
+
+    @tasks.loop(hours=1)
+    async def maintain_message_partitions(self):
+        now = discord.utils.utcnow()
+        async with self.bot.db.acquire() as conn:
+            async with conn.transaction():
+                upper = await conn.fetchval("SELECT MAX(upper_bound) FROM message_partitions")
+                horizon = discord.utils.time_snowflake(now + datetime.timedelta(days=MESSAGE_PARTITIONS_AHEAD))
+                while upper < horizon:
+                    day = discord.utils.snowflake_time(upper).replace(hour=0, minute=0, second=0, microsecond=0)
+                    lower, upper = upper, discord.utils.time_snowflake(day + datetime.timedelta(days=1))
+                    name = f"messages_p{day:%Y%m%d}"
+                    # if maintenance fell behind, messages_default already holds rows in this range, and creating the
+                    # partition straight away would fail. they're moved into it before it's attached
+                    await conn.execute(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+                    await conn.execute(
+                        f"""
+                        WITH moved AS (
+                            DELETE FROM messages_default WHERE message_id >= $1 AND message_id < $2 RETURNING *
+                        )
+                        INSERT INTO {name} SELECT * FROM moved
+                        """,
+                        lower,
+                        upper,
+                    )
+                    await conn.execute(
+                        f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"
+                    )
+                    await conn.execute("INSERT INTO message_partitions VALUES ($1, $2, $3)", name, lower, upper)
+
+                retention = await conn.fetchval(
+                    """
+                    SELECT MAX(message_retention) FROM (
+                        SELECT DISTINCT ON (guild_id) message_retention FROM configs ORDER BY guild_id, id DESC
+                    ) AS c
+                    """
+                )
+                expires = now - datetime.timedelta(seconds=retention or DEFAULT_MESSAGE_RETENTION)
+                cutoff = discord.utils.time_snowflake(expires)
+                expired = await conn.fetch(
+                    "DELETE FROM message_partitions WHERE upper_bound <= $1 RETURNING name", cutoff
+                )
+                for partition in expired:
+                    await conn.execute(f"DROP TABLE IF EXISTS {partition['name']}")
 
-        await self.bot.db.execute(query)
+                # nothing stored since then has this content, and anything older is past every guild's retention
+                await conn.execute("DELETE FROM message_contents WHERE last_seen < $1", expires.replace(tzinfo=None))
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
@@ -23,6 +23,7 @@ $$
         DELETE FROM prefixes WHERE guild_id = guildid;
         DELETE FROM selfroles WHERE guild_id = guildid;
         DELETE FROM cases WHERE guild_id = guildid;
+        DELETE FROM case_counters WHERE guild_id = guildid;
     END;
 $$;
 
@@ -58,6 +59,8 @@ CREATE TABLE IF NOT EXISTS counters
     decay_rate INTEGER,
     decay_per INTEGER
 );
+ALTER TABLE counters ADD COLUMN IF NOT EXISTS window_size INTEGER;
+ALTER TABLE counters ADD COLUMN IF NOT EXISTS buckets INTEGER;
 CREATE TABLE IF NOT EXISTS counter_values
 (
     counter_id INT NOT NULL REFERENCES counters(id),
@@ -154,6 +157,12 @@ CREATE TABLE IF NOT EXISTS cases
     reason TEXT,
     link TEXT
 );
+CREATE INDEX IF NOT EXISTS cases_guild_id_id_idx ON cases (guild_id, id);
+CREATE TABLE IF NOT EXISTS case_counters
+(
+    guild_id BIGINT PRIMARY KEY,
+    last_id INT NOT NULL
+);
 CREATE TABLE IF NOT EXISTS mutes
 (
     guild_id BIGINT NOT NULL,
@@ -0,0 +1,8 @@
+CREATE INDEX IF NOT EXISTS configs_guild_id_idx ON configs (guild_id);
+CREATE INDEX IF NOT EXISTS counters_cfg_id_name_idx ON counters (cfg_id, name);
+CREATE INDEX IF NOT EXISTS dispatchers_dispatch_at_idx ON dispatchers (dispatch_at);
+CREATE INDEX IF NOT EXISTS selfroles_roles_interaction_cid_idx ON selfroles_roles (interaction_cid);
+CREATE INDEX IF NOT EXISTS selfroles_roles_msg_id_idx ON selfroles_roles (msg_id);
+CREATE INDEX IF NOT EXISTS cases_guild_id_user_id_idx ON cases (guild_id, user_id);
+CREATE INDEX IF NOT EXISTS events_cfg_id_idx ON events (cfg_id);
+CREATE INDEX IF NOT EXISTS automod_cfg_id_idx ON automod (cfg_id);
@@ -0,0 +1,3 @@
+ALTER TABLE configs ADD COLUMN IF NOT EXISTS store_content BOOL NOT NULL DEFAULT TRUE;
+ALTER TABLE configs ADD COLUMN IF NOT EXISTS store_attachments BOOL NOT NULL DEFAULT TRUE;
+ALTER TABLE configs ADD COLUMN IF NOT EXISTS message_retention INTEGER NOT NULL DEFAULT 604800;
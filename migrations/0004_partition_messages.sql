@@ -0,0 +1,40 @@
+-- messages becomes range partitioned by message id (which is a snowflake, so by time).
+-- the existing table is kept as the partition for everything up to the end of today; from then on there's one
+-- partition per day, created ahead of time and dropped once it's past every guild's retention (see Timers)
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey;
+
+CREATE TABLE messages
+(
+    guild_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    author_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    content TEXT NOT NULL,
+    image_urls TEXT[],
+    PRIMARY KEY (guild_id, message_id)
+) PARTITION BY RANGE (message_id);
+
+CREATE TABLE message_partitions
+(
+    name TEXT PRIMARY KEY,
+    lower_bound BIGINT NOT NULL,
+    upper_bound BIGINT NOT NULL
+);
+
+DO $$
+    DECLARE
+        boundary BIGINT;
+    BEGIN
+        boundary := (
+            (EXTRACT(EPOCH FROM DATE_TRUNC('day', NOW() AT TIME ZONE 'utc') + INTERVAL '1 day') * 1000)::BIGINT
+            - 1420070400000
+        ) << 22;
+
+        EXECUTE format('ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%s)', boundary);
+        INSERT INTO message_partitions VALUES ('messages_legacy', 0, boundary);
+    END;
+$$;
+
+-- catches anything past the newest partition, so that a late maintenance run can't make inserts fail
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
@@ -0,0 +1,47 @@
+-- message content is stored once per guild in message_contents, keyed by a hash of the text, and messages refer to it
+-- by content_hash. content stays on messages for rows written before this, and is NULL from now on.
+-- contents are expired by last_seen (bumped whenever a message with that content is stored) rather than by reference,
+-- since the messages referring to them go away a partition at a time (see Timers)
+CREATE TABLE message_contents
+(
+    guild_id BIGINT NOT NULL,
+    hash BYTEA NOT NULL,
+    compressed BOOL NOT NULL,
+    data BYTEA NOT NULL,
+    last_seen TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    PRIMARY KEY (guild_id, hash)
+);
+CREATE INDEX message_contents_last_seen_idx ON message_contents (last_seen);
+
+ALTER TABLE messages ALTER COLUMN content DROP NOT NULL;
+ALTER TABLE messages ADD COLUMN content_hash BYTEA;
+
+CREATE OR REPLACE FUNCTION
+    remove_guild_data(guildid bigint, rmactions int[])
+RETURNS VOID
+LANGUAGE plpgsql
+as
+$$
+    DECLARE
+        cfgid int;
+    BEGIN
+        SELECT id
+        INTO cfgid
+        FROM configs
+        WHERE configs.guild_id = guildid;
+
+        DELETE FROM actions WHERE id = ANY(rmactions);
+        DELETE FROM automod WHERE cfg_id = cfgid;
+        DELETE FROM events WHERE cfg_id = cfgid;
+        DELETE FROM counters WHERE cfg_id = cfgid;
+        DELETE FROM loggers WHERE cfg_id = cfgid;
+        DELETE FROM commands WHERE cfg_id = cfgid;
+        DELETE FROM messages WHERE guild_id = guildid;
+        DELETE FROM message_contents WHERE guild_id = guildid;
+        DELETE FROM mutes WHERE guild_id = guildid;
+        DELETE FROM prefixes WHERE guild_id = guildid;
+        DELETE FROM selfroles WHERE guild_id = guildid;
+        DELETE FROM cases WHERE guild_id = guildid;
+        DELETE FROM case_counters WHERE guild_id = guildid;
+    END;
+$$;
@@ -0,0 +1,4 @@
+-- more things an automod trigger can ignore. these are checked by the listeners before an event is queued
+ALTER TABLE automod_ignore ADD COLUMN IF NOT EXISTS categories BIGINT[] NOT NULL DEFAULT '{}';
+ALTER TABLE automod_ignore ADD COLUMN IF NOT EXISTS emoji TEXT[] NOT NULL DEFAULT '{}';
+ALTER TABLE automod_ignore ADD COLUMN IF NOT EXISTS bots BOOL NOT NULL DEFAULT FALSE;
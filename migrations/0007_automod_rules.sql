@@ -0,0 +1,4 @@
+-- a config can have any number of automod blocks for the same event. they run lowest priority first (then in the
+-- order they were written in), and a block with stop set skips the rest once any of its actions ran
+ALTER TABLE automod ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE automod ADD COLUMN IF NOT EXISTS stop BOOL NOT NULL DEFAULT FALSE;
@@ -0,0 +1,193 @@
+import asyncio
+import datetime
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from core import counters  # noqa: E402
+from core.counters import CounterEngine, CounterValue, WindowCounter  # noqa: E402
+
+
+def counter(**kwargs):
+    return {
+        "id": 1,
+        "name": "spam",
+        "per_user": False,
+        "initial_count": 0,
+        "decay_rate": None,
+        "decay_per": None,
+        "window": None,
+        "buckets": None,
+        **kwargs,
+    }
+
+
+class Conn:
+    def __init__(self, rows=None, fail=False):
+        self.rows = rows or {}
+        self.fail = fail
+        self.written = []
+
+    async def fetchrow(self, query, counter_id, user_id=None):
+        return self.rows.get((counter_id, user_id))
+
+    async def executemany(self, query, args):
+        if self.fail:
+            raise ConnectionError("database went away")
+
+        self.written.append((query, list(args)))
+
+    def transaction(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class Pool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self.conn
+
+
+def test_window_counter_drops_slices_as_time_passes():
+    window = WindowCounter(4, 0)
+    window.add(0, 1)
+    window.add(1, 2)
+    window.add(3, 4)
+    assert window.total == 7
+
+    window.advance(4)  # the slice of tick 0 falls out
+    assert window.total == 6
+
+    window.advance(5)
+    assert window.total == 4
+
+    window.advance(3)  # going back in time does nothing
+    assert window.total == 4 and window.head == 5
+
+
+def test_window_counter_clears_after_a_whole_window():
+    window = WindowCounter(4, 0)
+    window.add(0, 5)
+    window.add(2, 5)
+    window.advance(10)
+    assert window.total == 0 and window.counts == [0, 0, 0, 0]
+    assert window.add(10, 1) == 1
+
+
+def test_decay_is_applied_on_read():
+    async def run():
+        engine = CounterEngine(None)
+        then = datetime.datetime.utcnow() - datetime.timedelta(seconds=25)
+        conn = Conn({(1, None): {"val": 10, "last_decay": then}})
+        decaying = counter(decay_rate=2, decay_per=10)
+
+        assert await engine.get(conn, 1, decaying) == 6
+        value = engine.stores[1].values[(1, None)]
+        assert value.last_decay == then + datetime.timedelta(seconds=20)  # the partial tick isn't lost
+        assert (1, None) not in engine.stores[1].dirty  # reading never needs a write
+
+    asyncio.run(run())
+
+
+def test_decay_stops_at_zero():
+    value = CounterValue(3, datetime.datetime.utcnow() - datetime.timedelta(seconds=100), True)
+    CounterEngine._decay(value, counter(decay_rate=1, decay_per=10))
+    assert value.val == 0
+
+
+def test_window_counters_count_within_the_window(monkeypatch):
+    async def run():
+        engine = CounterEngine(None)
+        windowed = counter(window=10, buckets=5, per_user=True)
+        now = [1000.0]
+        monkeypatch.setattr(counters.time, "monotonic", lambda: now[0])
+
+        assert await engine.modify(None, 1, windowed, 1, 5) == 1
+        now[0] += 4
+        assert await engine.modify(None, 1, windowed, 2, 5) == 3
+        assert await engine.get(None, 1, windowed, 6) == 0
+
+        now[0] += 8  # the first modify is out of the window, the second isn't
+        assert await engine.get(None, 1, windowed, 5) == 2
+
+        now[0] += 20
+        assert await engine.get(None, 1, windowed, 5) == 0
+
+    asyncio.run(run())
+
+
+def test_failed_flush_keeps_values_dirty():
+    async def run():
+        conn = Conn(fail=True)
+        engine = CounterEngine(Pool(conn))
+        await engine.modify(conn, 1, counter(), 3)
+        await engine.modify(conn, 1, counter(id=2, per_user=True), 1, 5)
+
+        with pytest.raises(ConnectionError):
+            await engine.flush()
+
+        assert engine.stores[1].dirty == {(1, None), (2, 5)}
+
+        conn.fail = False
+        await engine.flush()
+        assert not engine.stores[1].dirty
+        assert engine.stores[1].values[(1, None)].exists
+        assert sorted(len(args) for _, args in conn.written) == [1, 1]
+
+    asyncio.run(run())
+
+
+def test_new_global_value_is_inserted_once_then_updated():
+    async def run():
+        conn = Conn()
+        engine = CounterEngine(Pool(conn))
+        await engine.modify(conn, 1, counter(), 1)
+        await engine.flush()
+        await engine.modify(conn, 1, counter(), 1)
+        await engine.flush()
+
+        assert conn.written[0][0].startswith("INSERT") and conn.written[0][1][0][:2] == (1, 1)
+        assert conn.written[1][0].startswith("UPDATE") and conn.written[1][1][0][0] == 2
+
+    asyncio.run(run())
+
+
+def test_forget_clean_waits_for_a_running_flush():
+    async def run():
+        conn = Conn()
+        engine = CounterEngine(Pool(conn))
+        await engine.modify(conn, 1, counter(), 1)
+
+        async with engine._flush_lock:  # stands in for a flush that has taken the dirty keys but not written them
+            engine.stores[1].dirty.clear()
+            forget = asyncio.ensure_future(engine.forget_clean())
+            await asyncio.sleep(0)
+            assert not forget.done()
+            assert (1, None) in engine.stores[1].values
+
+        await forget
+        assert (1, None) not in engine.stores[1].values
+
+    asyncio.run(run())
+
+
+def test_read_only_values_are_evicted():
+    async def run():
+        engine = CounterEngine(Pool(Conn()), max_entries=2)
+        for user_id in range(5):
+            await engine.get(Conn(), 1, counter(per_user=True), user_id)
+
+        await engine.flush()
+        assert len(engine.stores[1].values) == 2
+
+    asyncio.run(run())
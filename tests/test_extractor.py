@@ -0,0 +1,57 @@
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+# the lexer and regex engine are built from deps/ (see build-dependancies.py)
+arg_lex = pytest.importorskip("deps.arg_lex")
+pytest.importorskip("deps.safe_regex")
+
+from core.extractor import equality_guard, reorder_condition  # noqa: E402
+
+
+def reorder(condition):
+    return reorder_condition(condition, arg_lex.run_lex(condition))
+
+
+def guard(condition):
+    return equality_guard(condition, arg_lex.run_lex(condition))
+
+
+def test_cheap_operands_move_in_front():
+    assert reorder("%spam($authorid) > 5 && $channelid == 1") == "$channelid == 1 && %spam($authorid) > 5"
+    assert reorder("$match(/x/, $content) == true || $userid == 1") == "$userid == 1 || $match(/x/, $content) == true"
+
+
+def test_already_ordered_condition_is_unchanged():
+    condition = "$channelid == 1 && %spam($authorid) > 5"
+    assert reorder(condition) is condition
+    assert reorder("$userid == 1") == "$userid == 1"
+
+
+def test_nothing_moves_across_side_effects():
+    condition = "%spam($authorid) > 5 && $send('hi') == true && $channelid == 1"
+    assert reorder(condition) == condition
+
+
+def test_runs_of_different_operators_stay_apart():
+    # a || b && c is (a || b) && c, so c can't be moved before the ||
+    condition = "%spam($authorid) > 5 || $userid == 1 && $channelid == 2"
+    assert reorder(condition) == "$userid == 1 || %spam($authorid) > 5 && $channelid == 2"
+
+
+def test_equality_guard_values():
+    assert guard("$channelid == 123") == ("channelid", 123)
+    assert guard("$reaction == '⭐' && %spam($userid) > 5") == ("reaction", "⭐")
+    assert guard("$userisbot == true") == ("userisbot", True)
+    assert guard("123 == $channelid") == ("channelid", 123)
+
+
+def test_no_equality_guard():
+    assert guard("$channelid != 123") is None
+    assert guard("$channelid == 123 || $userid == 1") is None
+    assert guard("%spam($userid) > 5 && $channelid == 1") is None
+    assert guard("$now == 1") is None  # builtins aren't variables
+    assert guard("$channelid == $userid") is None
@@ -0,0 +1,163 @@
+import asyncio
+import pathlib
+import sys
+
+import asyncpg
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from core.messages import MessageWriter  # noqa: E402
+
+
+class Conn:
+    def __init__(self):
+        self.copy_fails = False
+        self.bad_rows = set()  # message ids that fail when inserted on their own
+        self.fail_everything = False
+        self.stored = []
+
+    async def execute(self, query, *args):
+        if self.fail_everything:
+            raise asyncpg.PostgresError("database went away")
+
+        if "INSERT INTO messages" in query:
+            if args[1] in self.bad_rows:
+                raise asyncpg.PostgresError("bad row")
+
+            self.stored.append(args[1])
+
+    async def copy_records_to_table(self, table, records, columns):
+        if self.copy_fails or self.fail_everything:
+            raise asyncpg.PostgresError("copy failed")
+
+        self.stored.extend(x[1] for x in records)
+
+    async def executemany(self, query, args):
+        pass
+
+    def transaction(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class Pool:
+    def __init__(self):
+        self.conn = Conn()
+
+    def acquire(self):
+        return self.conn
+
+
+def record(message_id):
+    return [1, message_id, 2, 3, "hello", None]
+
+
+def test_flush_writes_and_empties_the_buffer():
+    async def run():
+        pool = Pool()
+        writer = MessageWriter(pool, compress_threshold=None)
+        for i in range(3):
+            await writer.add(record(i))
+
+        await writer.flush()
+        assert pool.conn.stored == [0, 1, 2]
+        assert not writer.pending and not writer.in_flight
+
+    asyncio.run(run())
+
+
+def test_failed_batch_is_retried_then_written_row_by_row():
+    async def run():
+        pool = Pool()
+        pool.conn.copy_fails = True
+        pool.conn.bad_rows = {1}
+        writer = MessageWriter(pool, compress_threshold=None, max_retries=2)
+        for i in range(3):
+            await writer.add(record(i))
+
+        for attempt in range(2):
+            with pytest.raises(asyncpg.PostgresError):
+                await writer.flush()
+
+            assert list(writer.pending) == [(1, 0), (1, 1), (1, 2)]
+            assert writer.retries == attempt + 1
+
+        await writer.flush()
+        assert pool.conn.stored == [0, 2]
+        assert writer.failed == 1 and writer.retries == 0
+        assert not writer.pending
+
+    asyncio.run(run())
+
+
+def test_batch_is_dropped_when_nothing_goes_through():
+    async def run():
+        pool = Pool()
+        pool.conn.fail_everything = True
+        writer = MessageWriter(pool, compress_threshold=None, max_retries=1)
+        await writer.add(record(0))
+        writer.discard(1, 50)
+
+        for _ in range(2):
+            with pytest.raises(asyncpg.PostgresError):
+                await writer.flush()
+
+        assert not writer.pending and not writer.deletes
+        assert writer.failed == 2 and writer.retries == 0
+
+        pool.conn.fail_everything = False
+        await writer.add(record(1))
+        await writer.flush()
+        assert pool.conn.stored == [1]
+
+    asyncio.run(run())
+
+
+def test_drop_overflow():
+    async def run():
+        writer = MessageWriter(Pool(), max_pending=2, overflow="drop", compress_threshold=None)
+        for i in range(4):
+            await writer.add(record(i))
+
+        assert len(writer.pending) == 2 and writer.dropped == 2
+
+    asyncio.run(run())
+
+
+def test_wait_overflow_waits_for_a_flush():
+    async def run():
+        pool = Pool()
+        writer = MessageWriter(pool, max_pending=2, flush_interval=0.01, compress_threshold=None)
+        writer.start()
+        try:
+            for i in range(5):
+                await asyncio.wait_for(writer.add(record(i)), 1)
+        finally:
+            await writer.close()
+
+        assert pool.conn.stored == [0, 1, 2, 3, 4] and writer.dropped == 0
+
+    asyncio.run(run())
+
+
+def test_buffered_messages_can_be_changed_before_they_are_written():
+    async def run():
+        pool = Pool()
+        writer = MessageWriter(pool, compress_threshold=None)
+        await writer.add(record(0))
+        await writer.add(record(1))
+
+        writer.update(1, 0, "edited")
+        assert (await writer.get(1, 0))["content"] == "edited"
+        assert (await writer.pop(1, 1))["message_id"] == 1
+
+        await writer.flush()
+        assert pool.conn.stored == [0]
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+import pathlib
+import sys
+
+import discord
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from core.prefilter import AutomodFilter, AutomodTrigger  # noqa: E402
+
+
+def test_empty_filter_rejects_nothing():
+    ignore = AutomodFilter()
+    assert not ignore
+    assert not ignore.rejects(1, 2, [3], True, "⭐")
+
+
+def test_rejects_each_kind():
+    ignore = AutomodFilter(roles=[10], channels=[20], categories=[30], emoji=["⭐", "1234"], bots=True)
+    assert ignore
+
+    assert ignore.rejects(channel_id=20)
+    assert ignore.rejects(channel_id=21, category_id=30)
+    assert ignore.rejects(roles=[9, 10])
+    assert ignore.rejects(bot=True)
+    assert ignore.rejects(emoji="⭐")
+
+    assert not ignore.rejects(channel_id=21, category_id=31, roles=[9], bot=False, emoji="🔥")
+
+
+def test_missing_information_isnt_checked():
+    ignore = AutomodFilter(channels=[20], roles=[10])
+    assert not ignore.rejects()
+    assert not ignore.rejects(roles=None)
+
+
+def test_partial_emoji_is_matched_by_id_or_name():
+    ignore = AutomodFilter(emoji=["1234", "⭐"])
+    assert ignore.rejects(emoji=discord.PartialEmoji(name="custom", id=1234))
+    assert ignore.rejects(emoji=discord.PartialEmoji(name="⭐"))
+    assert not ignore.rejects(emoji=discord.PartialEmoji(name="custom", id=5678))
+
+
+def test_from_row():
+    ignore = AutomodFilter.from_row(
+        {
+            "ignore_roles": [1],
+            "ignore_channels": None,
+            "ignore_categories": [3],
+            "ignore_emoji": None,
+            "ignore_bots": False,
+        }
+    )
+    assert ignore.roles == {1} and ignore.channels == frozenset() and ignore.categories == {3}
+    assert not ignore.bots
+
+
+def rule(id, filter, priority=0):
+    return {"id": id, "actions": [], "filter": filter, "priority": priority, "stop": False}
+
+
+def test_trigger_orders_rules_and_narrows_them():
+    trigger = AutomodTrigger(
+        "message",
+        [rule(3, AutomodFilter(channels=[20])), rule(1, AutomodFilter(), 5), rule(2, AutomodFilter(channels=[21]))],
+    )
+    assert [x["id"] for x in trigger.rules] == [2, 3, 1]
+
+    assert trigger.select(channel_id=22) is trigger
+    assert [x["id"] for x in trigger.select(channel_id=20).rules] == [2, 1]
+
+
+def test_trigger_select_is_none_when_every_rule_ignores():
+    trigger = AutomodTrigger("message", [rule(1, AutomodFilter(bots=True)), rule(2, AutomodFilter(bots=True))])
+    assert trigger.select(bot=True) is None
+    assert trigger.select(bot=False) is trigger
@@ -0,0 +1,60 @@
+import asyncio
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from core.scheduler import EventPriority, EventScheduler  # noqa: E402
+
+
+def test_waiting_job_does_not_block_other_guilds():
+    async def run():
+        scheduler = EventScheduler(workers_per_guild=2, max_concurrency=2)
+        release = asyncio.Event()
+        done = asyncio.Event()
+
+        async def slow():
+            async with scheduler.waiting():
+                await release.wait()
+
+        async def fast():
+            done.set()
+
+        for _ in range(4):
+            scheduler.submit(1, EventPriority.moderation, slow)
+
+        await asyncio.sleep(0)
+        scheduler.submit(2, EventPriority.message, fast)
+
+        await asyncio.wait_for(done.wait(), 1)
+        release.set()
+        await scheduler.close()
+
+    asyncio.run(run())
+
+
+def test_job_holds_its_slot_outside_waiting():
+    async def run():
+        scheduler = EventScheduler(workers_per_guild=2, max_concurrency=1)
+        release = asyncio.Event()
+        done = asyncio.Event()
+
+        async def busy():
+            await release.wait()
+
+        async def fast():
+            done.set()
+
+        scheduler.submit(1, EventPriority.moderation, busy)
+        await asyncio.sleep(0)
+        scheduler.submit(2, EventPriority.message, fast)
+
+        await asyncio.sleep(0.05)
+        assert not done.is_set()
+
+        release.set()
+        await asyncio.wait_for(done.wait(), 1)
+        assert scheduler._running._value == 1
+        await scheduler.close()
+
+    asyncio.run(run())
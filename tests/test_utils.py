@@ -0,0 +1,104 @@
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from core.utils import LazyVariables, Scope  # noqa: E402
+
+
+def counting(value):
+    calls = []
+
+    def make():
+        calls.append(1)
+        return value
+
+    return make, calls
+
+
+def test_lazy_variables_compute_once():
+    make, calls = counting("name#0001")
+    vbls = LazyVariables({"userid": 1}, {"username": make})
+
+    assert "username" in vbls and len(vbls) == 2 and sorted(vbls) == ["userid", "username"]
+    assert not calls
+
+    assert vbls["username"] == "name#0001"
+    assert vbls.get("username") == "name#0001"
+    assert len(calls) == 1
+    assert len(vbls) == 2 and sorted(vbls) == ["userid", "username"]
+
+
+def test_lazy_variables_missing_key():
+    vbls = LazyVariables({"userid": 1})
+    assert vbls.get("nope") is None
+    with pytest.raises(KeyError):
+        vbls["nope"]
+
+
+def test_lazy_variables_copies_share_computed_values():
+    make, calls = counting(5)
+    vbls = LazyVariables({}, {"x": make})
+    copy = vbls.copy()
+
+    assert copy["x"] == 5 and vbls["x"] == 5
+    assert len(calls) == 1
+
+
+def test_lazy_variables_setting_replaces_lazy_value():
+    make, calls = counting(5)
+    vbls = LazyVariables({}, {"x": make})
+    vbls.update({"x": 6})
+
+    assert vbls["x"] == 6 and len(vbls) == 1
+    assert not calls
+
+
+def test_scope_reads_through_and_never_writes_to_parent():
+    parent = {"a": 1, "b": 2}
+    scope = Scope(parent, {"b": 3})
+    scope["c"] = 4
+
+    assert scope["a"] == 1 and scope["b"] == 3 and scope["c"] == 4
+    assert "a" in scope and "c" in scope and "d" not in scope
+    assert sorted(scope) == ["a", "b", "c"] and len(scope) == 3
+    assert parent == {"a": 1, "b": 2}
+
+
+def test_sibling_scopes_dont_see_each_other():
+    parent = {"a": 1}
+    first, second = Scope(parent), Scope(parent)
+    first["capture"] = "x"
+
+    assert "capture" not in second
+    assert second.get("capture") is None
+
+
+def test_scope_without_parent():
+    scope = Scope(None)
+    assert not scope and "a" not in scope and len(scope) == 0
+    with pytest.raises(KeyError):
+        scope["a"]
+
+    scope["a"] = 1
+    assert scope and scope["a"] == 1
+
+
+def test_scope_over_lazy_variables():
+    make, calls = counting("x")
+    vbls = LazyVariables({"a": 1}, {"b": make})
+    inner = Scope(Scope(vbls, {"c": 3}))
+
+    assert inner["b"] == "x" and inner["c"] == 3 and inner["a"] == 1
+    assert Scope(vbls)["b"] == "x"
+    assert len(calls) == 1
+
+
+def test_scope_copy_is_a_new_frame():
+    scope = Scope({"a": 1})
+    copy = scope.copy()
+    copy["a"] = 2
+
+    assert scope["a"] == 1 and copy["a"] == 2